@@ -0,0 +1,138 @@
+#Usage Example:
+#conda activate bgrenv
+#python3 benchmark-main.py --frames 50 --noise 8 --blur 0 --max-error 25 --max-latency 40 --json benchmark.json
+#python3 benchmark-main.py --frames 50 --meniscus-search pyramid --subpixel
+#python3 benchmark-main.py --suite                (same as: python3 -m pytest tests/test_benchmark.py)
+#
+#The regression suite is tests/ (pytest, pytest-benchmark); this script is the quick report of
+#one configuration, and --suite runs the suite instead.
+#
+#Renders synthetic frames with known fill heights (syntheticTubes.py), times every stage of the
+#estimate and checks the estimated volumes against the ground truth. Exits with 1 when the mean
+#volume error or the median end-to-end latency is above the given limits.
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import cv2
+from volumeEstimation import VolumeEstimation
+from syntheticTubes import SyntheticTubes
+
+
+def timed(timings, stage, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    timings.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+    return result
+
+
+def summarize(values):
+    values = np.asarray(values, dtype=np.float64)
+    return {"MEAN": float(np.mean(values)),
+            "P50": float(np.percentile(values, 50)),
+            "P95": float(np.percentile(values, 95)),
+            "MAX": float(np.max(values))}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Estimator latency and accuracy benchmark on synthetic frames")
+    parser.add_argument('--frames', type=int, default=50, help='Number of synthetic frames (default: 50)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the generator (default: 0)')
+    parser.add_argument('--noise', type=float, default=8.0, help='Pixel noise standard deviation (default: 8)')
+    parser.add_argument('--blur', type=float, default=0.0, help='Gaussian blur sigma, 0 disables it (default: 0)')
+    parser.add_argument('--max-error', type=float, default=None, help='Fail when the mean absolute volume error (uL) is above this')
+    parser.add_argument('--max-latency', type=float, default=None, help='Fail when the median end-to-end latency (ms) is above this')
+    parser.add_argument('--meniscus-search', type=str, default='full', choices=['full', 'pyramid'], help='Meniscus search of the estimator (default: full)')
+    parser.add_argument('--pyramid-factor', type=int, nargs=2, default=[2, 8], metavar=('ROWS', 'COLUMNS'), help='Shrink factors of the pyramid search (default: 2 8)')
+    parser.add_argument('--subpixel', action='store_true', help='Fractional meniscus heights and volumes')
+    parser.add_argument('--reject-on-quality', action='store_true', help='Run and apply the quality gate in the end-to-end estimate, like the service option')
+    parser.add_argument('--json', type=str, default=None, help='Write the results to this file')
+    parser.add_argument('--suite', action='store_true', help='Run the pytest-benchmark suite (tests/test_benchmark.py) instead')
+    parser.add_argument('--save-dataset', type=str, default=None, help='Also write a labelled synthetic dataset to this folder')
+    args = parser.parse_args()
+
+    if args.suite:
+        import pytest
+        suite_args = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "test_benchmark.py"), "-q"]
+        if args.json is not None:
+            suite_args.append(f"--benchmark-json={args.json}")
+        sys.exit(pytest.main(suite_args))
+
+    obj = VolumeEstimation("LEFT")
+    obj.check_quality = args.reject_on_quality
+    obj.meniscus_search = args.meniscus_search
+    obj.pyramid_factor = tuple(args.pyramid_factor)
+    obj.subpixel_meniscus = args.subpixel
+    generator = SyntheticTubes(obj, seed=args.seed)
+
+    if args.save_dataset is not None:
+        generator.save_dataset(args.save_dataset, args.frames, noise=args.noise, blur_sigma=args.blur)
+
+    obj.get_volume_lut()  # built once, not part of any stage
+    regions = [obj.tube_roi(side) for side in obj.sides]
+
+    timings = {}
+    volume_errors = []
+    height_errors = []
+    rejected = 0
+
+    for k in range(args.frames):
+        image, truth = generator.render(generator.random_heights(), noise=args.noise, blur_sigma=args.blur)
+        jpeg = generator.encode(image)
+
+        # individual stages, on the same frame
+        frame = timed(timings, "decode", cv2.imdecode, np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        timed(timings, "roi_decode", obj.roi_decoder.decode_regions, jpeg, regions)
+        timed(timings, "quality_gate", obj.quality_gate.evaluate, frame)
+        for side in obj.sides:
+            strip = timed(timings, "crop", obj.image_crop, frame, side)
+            timed(timings, "hsv", obj.strip_hsv, strip)
+            area, height, _ = timed(timings, "segmentation", obj.strip_segmentation, strip)
+            timed(timings, "polynomial", obj.volume_polynomial, [area])
+            height_errors.append(height - truth[side]["HEIGHT"])
+
+        # what the estimator service runs for every image
+        volumes = timed(timings, "end_to_end", obj.volume_estimation_all, jpeg)
+        if obj.check_quality and not obj.quality["PASS"]:
+            rejected += 1
+            continue
+        for side in obj.sides:
+            volume_errors.append(abs(volumes[side] - truth[side]["VOLUME"]))
+
+    results = {"FRAMES": args.frames,
+               "MENISCUS_SEARCH": args.meniscus_search,
+               "SUBPIXEL": args.subpixel,
+               "NOISE": args.noise,
+               "BLUR": args.blur,
+               "REJECTED": rejected,
+               "LATENCY_MS": {stage: summarize(values) for stage, values in timings.items()},
+               "HEIGHT_ERROR_ROWS": summarize(np.abs(height_errors)),
+               # spread of the signed height errors, the quantization noise of the meniscus search
+               "HEIGHT_ERROR_STD_ROWS": float(np.std(height_errors)),
+               "VOLUME_ERROR_UL": summarize(volume_errors) if volume_errors else None}
+
+    print(f"{'stage':<14}{'mean':>9}{'p50':>9}{'p95':>9}{'max':>9}  (ms)")
+    for stage, stats in results["LATENCY_MS"].items():
+        print(f"{stage:<14}{stats['MEAN']:>9.3f}{stats['P50']:>9.3f}{stats['P95']:>9.3f}{stats['MAX']:>9.3f}")
+    print(f"height error (rows): mean {results['HEIGHT_ERROR_ROWS']['MEAN']:.2f}, max {results['HEIGHT_ERROR_ROWS']['MAX']:.2f}, "
+          f"std {results['HEIGHT_ERROR_STD_ROWS']:.2f}")
+    if volume_errors:
+        print(f"volume error (uL): mean {results['VOLUME_ERROR_UL']['MEAN']:.2f}, max {results['VOLUME_ERROR_UL']['MAX']:.2f}")
+    print(f"{rejected} of {args.frames} frames rejected by the quality gate")
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    failed = False
+    if args.max_error is not None and (not volume_errors or results["VOLUME_ERROR_UL"]["MEAN"] > args.max_error):
+        print(f"FAIL: mean volume error above {args.max_error} uL")
+        failed = True
+    if args.max_latency is not None and results["LATENCY_MS"]["end_to_end"]["P50"] > args.max_latency:
+        print(f"FAIL: median end-to-end latency above {args.max_latency} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,110 @@
+import numpy as np
+from curveFitting import CurveFitting
+from datasetRunner import DatasetRunner
+
+
+class CalibrationFitter:
+    """
+    Chooses the cone/cylinder breakpoint and the polynomial degrees of the area -> volume
+    calibration by k-fold cross-validation.
+
+    Every candidate breakpoint (a ground truth volume) is evaluated in parallel. For each
+    fold, the cone (volumes <= breakpoint, plus the empty tube) and the cylinder
+    (volumes >= breakpoint) are fitted for every degree at once (CurveFitting.fit_polynomials),
+    and the held-out images are predicted with the piecewise model, switching at the mean
+    area of the breakpoint images as VolumeEstimation does with ref_area. The breakpoint
+    and degrees with the lowest held-out error are refitted on all the data.
+    """
+    def __init__(self, degrees=(1, 2, 3, 4, 5, 6), folds=5, seed=0, runner=None):
+        self.degrees = list(degrees)
+        self.folds = folds
+        self.seed = seed
+        self.runner = runner if runner is not None else DatasetRunner(progress=False)
+        self.areas = None
+        self.volumes = None
+        self.fold_ids = None
+
+    def fit(self, areas, volumes, breakpoints=None):
+        """
+        Args:
+            'areas' (array) : segmented area of every tube image
+            'volumes' (array) : ground truth volume (uL) of every tube image
+            'breakpoints' (list) : candidate cone/cylinder breakpoints, default every inner ground truth volume
+        Returns:
+            calibration dict for VolumeEstimation.apply_calibration, with the selected "degrees"
+            and the cross-validated "cv_rmse" (uL)
+        """
+        self.areas = np.asarray(areas, dtype=np.float64)
+        self.volumes = np.asarray(volumes, dtype=np.float64)
+        self.fold_ids = np.random.default_rng(self.seed).permutation(len(self.areas)) % self.folds
+        if breakpoints is None:
+            breakpoints = np.unique(self.volumes)[1:-1]
+
+        scores = self.runner.map(self.evaluate_breakpoint, list(breakpoints))
+
+        best = None
+        for breakpoint, (cone_sse, cylinder_sse) in zip(breakpoints, scores):
+            total = np.min(cone_sse) + np.min(cylinder_sse)
+            if np.isfinite(total) and (best is None or total < best[0]):
+                best = (total, breakpoint, self.degrees[int(np.argmin(cone_sse))], self.degrees[int(np.argmin(cylinder_sse))])
+        if best is None:
+            raise ValueError("Not enough images on both sides of any breakpoint for the requested degrees")
+
+        total, breakpoint, cone_degree, cylinder_degree = best
+        cone, cylinder, ref_area = self.fit_breakpoint(np.ones(len(self.areas), dtype=bool), breakpoint, [cone_degree], [cylinder_degree])
+        cv_rmse = float(np.sqrt(total / len(self.areas)))
+        print(f"Breakpoint {breakpoint} uL (ref_area {ref_area:.0f}), cone degree {cone_degree}, "
+              f"cylinder degree {cylinder_degree}, {self.folds}-fold CV RMSE {cv_rmse:.1f} uL")
+
+        return {"ref_area": int(round(ref_area)),
+                "cone_vol": float(breakpoint),
+                "cone": [float(c) for c in cone[cone_degree]],
+                "cylinder": [float(c) for c in cylinder[cylinder_degree]],
+                "degrees": [cone_degree, cylinder_degree],
+                "cv_rmse": cv_rmse}
+
+    def fit_breakpoint(self, train, breakpoint, cone_degrees, cylinder_degrees):
+        # cone and cylinder fits of the training images for one breakpoint, and the switching area
+        cone_train = train & (self.volumes <= breakpoint)
+        cylinder_train = train & (self.volumes >= breakpoint)
+
+        # the empty tube anchors the cone, as in VolumeEstimation.training_data
+        cone = CurveFitting.fit_polynomials(np.append(self.areas[cone_train], 0), np.append(self.volumes[cone_train], 0), cone_degrees)
+        cylinder = CurveFitting.fit_polynomials(self.areas[cylinder_train], self.volumes[cylinder_train], cylinder_degrees)
+
+        at_breakpoint = train & (self.volumes == breakpoint)
+        if at_breakpoint.any():
+            ref_area = self.areas[at_breakpoint].mean()
+        else:
+            ref_area = (self.areas[train & (self.volumes < breakpoint)].max() + self.areas[train & (self.volumes > breakpoint)].min()) / 2
+        return cone, cylinder, ref_area
+
+    def evaluate_breakpoint(self, breakpoint):
+        # held-out sum of squared errors of every cone degree and every cylinder degree
+        cone_sse = np.zeros(len(self.degrees))
+        cylinder_sse = np.zeros(len(self.degrees))
+        for fold in range(self.folds):
+            train = self.fold_ids != fold
+            test = ~train
+            cone_points = np.count_nonzero(train & (self.volumes <= breakpoint)) + 1
+            cylinder_points = np.count_nonzero(train & (self.volumes >= breakpoint))
+            cone_degrees = [d for d in self.degrees if d < cone_points]
+            cylinder_degrees = [d for d in self.degrees if d < cylinder_points]
+            if not cone_degrees or not cylinder_degrees or not (train & (self.volumes < breakpoint)).any() \
+               or not (train & (self.volumes > breakpoint)).any():
+                return np.full(len(self.degrees), np.inf), np.full(len(self.degrees), np.inf)
+
+            cone, cylinder, ref_area = self.fit_breakpoint(train, breakpoint, cone_degrees, cylinder_degrees)
+
+            test_cone = test & (self.areas < ref_area)
+            test_cylinder = test & ~test_cone
+            for k, degree in enumerate(self.degrees):
+                if degree in cone:
+                    cone_sse[k] += np.sum((np.polyval(cone[degree], self.areas[test_cone]) - self.volumes[test_cone]) ** 2)
+                else:
+                    cone_sse[k] = np.inf
+                if degree in cylinder:
+                    cylinder_sse[k] += np.sum((np.polyval(cylinder[degree], self.areas[test_cylinder]) - self.volumes[test_cylinder]) ** 2)
+                else:
+                    cylinder_sse[k] = np.inf
+        return cone_sse, cylinder_sse
@@ -0,0 +1,76 @@
+import os
+import re
+import json
+import time
+import tempfile
+
+
+class CalibrationRegistry:
+    """
+    Versioned calibration files for VolumeEstimation.
+
+    Every calibration is a JSON file `calibration_v<version>.json` holding the
+    breakpoint area and the cone/cylinder polynomial coefficients (highest power first).
+    Files are never overwritten; loaded versions are memoized.
+    """
+    FILE_PATTERN = re.compile(r"calibration_v(\d+)\.json$")
+
+    def __init__(self, calibration_dir):
+        self.calibration_dir = calibration_dir
+        self.calibrations = {}  # version -> calibration
+        self.current = None
+
+    def versions(self):
+        if not os.path.isdir(self.calibration_dir):
+            return []
+        matches = (self.FILE_PATTERN.match(file) for file in os.listdir(self.calibration_dir))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def path(self, version):
+        return os.path.join(self.calibration_dir, f"calibration_v{version:04d}.json")
+
+    def load(self, version=None):
+        # Returns the requested (default: latest) calibration, or None when there is none
+        if version is None:
+            versions = self.versions()
+            if not versions:
+                return None
+            version = versions[-1]
+        version = int(version)
+        if version not in self.calibrations:
+            with open(self.path(version), 'r') as f:
+                self.calibrations[version] = json.load(f)
+        return self.calibrations[version]
+
+    def activate(self, version=None):
+        calibration = self.load(version)
+        if calibration is not None:
+            self.current = calibration
+        return calibration
+
+    def save(self, calibration):
+        # Writes a new version and returns the stored calibration. Several processes may save at
+        # once: each writes its own temporary file, and the version file is created with os.link,
+        # which fails when it exists, so a taken version is retried with the next number.
+        os.makedirs(self.calibration_dir, exist_ok=True)
+        calibration = dict(calibration)
+        calibration.setdefault("created", time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()))
+
+        versions = self.versions()
+        version = versions[-1] + 1 if versions else 1
+        while True:
+            calibration["version"] = version
+            path = self.path(version)
+            with tempfile.NamedTemporaryFile('w', dir=self.calibration_dir, suffix=".tmp", delete=False) as f:
+                json.dump(calibration, f, indent=4)
+            try:
+                os.link(f.name, path)  # readers never see a partial file
+                break
+            except FileExistsError:
+                version = max(self.versions() + [version]) + 1
+            finally:
+                os.unlink(f.name)
+
+        self.calibrations[version] = calibration
+        print(f"Saved calibration version {calibration['version']} to {path}")
+        return calibration
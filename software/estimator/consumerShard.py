@@ -0,0 +1,92 @@
+import zlib
+
+
+class ConsumerShard:
+    """
+    Splits the estimate requests between several estimator processes or nodes.
+
+    Hash mode (default): every consumer receives every request and keeps the ones whose
+    crc32(CHIP_ID) % count equals its index, so a chip always lands on the same consumer
+    and its requests stay in order. Works with any broker; each consumer still parses
+    every request. A request with a {INDEX: CHIP_ID} map of several chips (a rack photo) is
+    split into one request per chip first (split_by_chip), and every consumer keeps the
+    requests of its own chips. With few chips the split is only as even as their hashes: 8
+    chips over 2 consumers may well land 6 and 2, and the busiest consumer bounds the
+    throughput (shard-benchmark-main.py prints the chips per shard).
+
+    Shared mode (`shared_group`): ESTIMATE requests are subscribed through the MQTT v5
+    shared subscription `$share/<group>/...`, and the broker delivers each one to a single
+    consumer of the group. Control commands (calibration, ping, stats, track resets) keep a normal
+    subscription so every consumer gets them. Per-chip ordering then relies on the broker
+    routing a publisher to the same consumer (e.g. EMQX `hash_clientid` or `sticky`).
+    """
+    CONTROL_KEYS = ["CALIBRATION", "PING", "STATS", "TRACK"]
+
+    def __init__(self, index=0, count=1, shared_group=None):
+        if not 0 <= index < count:
+            raise ValueError(f"Shard index must be between 0 and {count - 1}, got {index}")
+        self.index = index
+        self.count = count
+        self.shared_group = shared_group
+
+    @staticmethod
+    def shard_of(chip_id, count):
+        # stable across processes and hosts, unlike hash()
+        return zlib.crc32(str(chip_id).encode()) % count
+
+    @staticmethod
+    def split_by_chip(message):
+        # [request] per chip of an estimate request whose CHIP_ID is a {INDEX: CHIP_ID} map, with
+        # that chip's tubes as INDEX ("ALL" being every tube of the map) and the chip as CHIP_ID,
+        # so the tubes of a chip are sharded and ordered with its single-tube requests. A map
+        # missing a requested tube is left whole, the estimator answers it with an error.
+        chips = message.get("CHIP_ID")
+        if not isinstance(chips, dict):
+            return [message]
+        indexes = message.get("INDEX")
+        if indexes == "ALL":
+            indexes = list(chips)
+        elif isinstance(indexes, str):
+            indexes = [indexes]
+        if not isinstance(indexes, list) or not indexes or any(index not in chips for index in indexes):
+            return [message]
+
+        chip_indexes = {}
+        for index in indexes:
+            chip_indexes.setdefault(chips[index], []).append(index)
+        return [dict(message, CHIP_ID=chip, INDEX=chip_indexes[chip]) for chip in chip_indexes]
+
+    def owns(self, message):
+        if self.shared_group is not None:
+            return True  # the broker already picked this consumer
+        return self.shard_of(message.get("CHIP_ID"), self.count) == self.index
+
+    def subscribe(self, mb, request_topic, callback):
+        """
+        Args:
+            'mb' (obj) : message broker with subscribe_message(topic, callback)
+            'request_topic' (str) : request topic of the device, e.g. "telemetry/+/log/estimator/+/REQUEST"
+            'callback' (func) : callback(topic, message) of the consumer
+        """
+        if self.shared_group is None:
+            mb.subscribe_message(topic=request_topic, callback=self.filtered(callback))
+            return
+
+        base, _, _ = request_topic.rsplit("/", 2)
+        mb.subscribe_message(topic=f"$share/{self.shared_group}/{base}/ESTIMATE/REQUEST", callback=callback)
+        for key in self.CONTROL_KEYS:
+            mb.subscribe_message(topic=f"{base}/{key}/REQUEST", callback=callback)
+
+    def filtered(self, callback):
+        # drops the estimate requests of the other shards, and the other shards' chips of a rack request
+        def consume(topic, message):
+            if message.get("COMMAND") != "ESTIMATE-REQUEST":
+                callback(topic, message)
+                return
+            for request in self.split_by_chip(message):
+                if self.owns(request):
+                    callback(topic, request)
+        return consume
+
+    def stats(self):
+        return {"INDEX": self.index, "COUNT": self.count, "SHARED_GROUP": self.shared_group}
@@ -1,4 +1,5 @@
-from scipy.optimize import curve_fit
+import math
+import numpy as np
 
 class CurveFitting:
 
@@ -29,11 +30,51 @@ class CurveFitting:
         'polinomial_5': polinomial_5,
         'polinomial_6': polinomial_6
     }
+    CURVE_DEGREES = {
+        'parabola': 2,
+        'polinomial_3': 3,
+        'polinomial_4': 4,
+        'polinomial_5': 5,
+        'polinomial_6': 6
+    }
     @staticmethod
     def fit_curve(curve_type, x_data, y_data):
         if curve_type in CurveFitting.CURVE_FUNCTIONS:
             curve_func = CurveFitting.CURVE_FUNCTIONS[curve_type].__func__  # Access the underlying function
-            params, _ = curve_fit(curve_func, x_data, y_data)
+            degree = CurveFitting.CURVE_DEGREES[curve_type]
+            params = CurveFitting.fit_polynomials(x_data, y_data, [degree])[degree]
             return curve_func, params
         else:
-            raise ValueError(f"Invalid curve type: {curve_type}")
\ No newline at end of file
+            raise ValueError(f"Invalid curve type: {curve_type}")
+
+    @staticmethod
+    def fit_polynomials(x_data, y_data, degrees):
+        # Linear least squares for every degree from a single QR factorization of the Vandermonde
+        # matrix of x scaled to [-1, 1]: the fit of degree d only uses the first d+1 columns of Q and R.
+        # Returns {degree: coefficients, highest power first}
+        x = np.asarray(x_data, dtype=np.float64)
+        y = np.asarray(y_data, dtype=np.float64)
+        max_degree = max(degrees)
+        if len(x) <= max_degree:
+            raise ValueError(f"A degree {max_degree} polynomial needs more than {len(x)} points")
+
+        center = (x.max() + x.min()) / 2
+        scale = (x.max() - x.min()) / 2 or 1.0
+        Q, R = np.linalg.qr(np.vander((x - center) / scale, max_degree + 1, increasing=True))
+        Qty = Q.T @ y
+
+        fits = {}
+        for degree in degrees:
+            scaled_coefficients = np.linalg.solve(R[:degree + 1, :degree + 1], Qty[:degree + 1])
+            fits[degree] = CurveFitting.unscale_polynomial(scaled_coefficients, center, scale)
+        return fits
+
+    @staticmethod
+    def unscale_polynomial(scaled_coefficients, center, scale):
+        # sum a_k ((x - center) / scale)^k (lowest power first) -> coefficients of x, highest power first
+        coefficients = np.zeros(len(scaled_coefficients))
+        for k, a in enumerate(scaled_coefficients):
+            a = a / scale**k
+            for j in range(k + 1):
+                coefficients[j] += a * math.comb(k, j) * (-center)**(k - j)
+        return coefficients[::-1]
@@ -0,0 +1,71 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+class DatasetRunner:
+    """
+    Fans per-image work out over a process pool.
+
+    Work is sent to the workers in chunks and results are returned in input order,
+    so callers can keep zipping them with their file lists. Only picklable callables
+    (module-level functions or bound methods of picklable objects) can be used, and
+    plotting has to stay in the calling process. On platforms that spawn processes,
+    the calling script needs an `if __name__ == '__main__':` guard.
+    """
+    def __init__(self, max_workers=None, chunk_size=16, progress=True):
+        self.max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+    @staticmethod
+    def list_images(dataset_path, sort_by_mtime=False):
+        image_files = [file for file in os.listdir(dataset_path) if file.endswith(('.jpg', '.jpeg', '.png'))]
+        if sort_by_mtime:
+            # Sort the files by modification time, earliest first
+            image_files.sort(key=lambda x: os.path.getmtime(os.path.join(dataset_path, x)))
+        return image_files
+
+    def map(self, func, items):
+        # [func(item) for item in items], in parallel
+        results = []
+        for chunk_results in self.map_chunks(PerItem(func), items):
+            results.extend(chunk_results)
+        return results
+
+    def map_chunks(self, func, items):
+        # [func(chunk) for chunk in chunks of items], in parallel. func receives a list of items.
+        items = list(items)
+        chunks = [items[start:start + self.chunk_size] for start in range(0, len(items), self.chunk_size)]
+        start_time = time.perf_counter()
+
+        results = []
+        done = 0
+        if self.max_workers <= 1 or len(chunks) <= 1:
+            # not worth starting a pool
+            chunk_results = map(func, chunks)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=min(self.max_workers, len(chunks)))
+            chunk_results = executor.map(func, chunks)
+
+        try:
+            for chunk, chunk_result in zip(chunks, chunk_results):
+                results.append(chunk_result)
+                done += len(chunk)
+                if self.progress:
+                    print(f"Processed {done}/{len(items)} images ({time.perf_counter() - start_time:.1f} s)")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return results
+
+
+class PerItem:
+    # picklable wrapper that applies func to every item of a chunk
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, chunk):
+        return [self.func(item) for item in chunk]
@@ -1,91 +1,114 @@
 #Usage Example: 
 #conda activate bgrenv
-#python3 estimation-main.py
+#python3 estimation-main.py --workers 2 --queue-size 8 --cache-size 256 --cache-ttl 600
+#python3 estimation-main.py --online-calibration --publish-every 10
+#python3 estimation-main.py --shards 3 --shard-index 0   (and 1, 2 on other processes or hosts)
+#python3 estimation-main.py --shared-group estimators    (on every consumer, broker with shared subscriptions)
+#python3 estimation-main.py --layout rack-layout.json       (tube names of the camera, see tubeLayout.py)
+#python3 estimation-main.py --registration registration.npz (made by registration-main.py)
+#python3 estimation-main.py --subpixel
 
-import os
-import glob
 import time
 import uuid
+import argparse
 from braingeneers.iot import messaging # Assuming you have this module imported elsewhere
 from volumeEstimation import VolumeEstimation  # Assuming this class is part of a different module
+from calibrationRegistry import CalibrationRegistry
+from estimatorService import EstimatorService, response_topic
+from s3Fetcher import DEFAULT_ENDPOINT
+from meniscusTracker import MeniscusTracker
+from onlineCalibration import OnlineCalibration
+from consumerShard import ConsumerShard
+from tubeLayout import TubeLayout
 
 DEVICE_NAME = "estimator"
 MQTT_DEVICE_SUBSCRIBE_TOPIC = f"telemetry/+/log/{DEVICE_NAME}/+/REQUEST" # <-- device listens to any experiments involving DEVICE_NAME
+CALIBRATION_DIR = "calibrations" # <-- versioned calibration files written by VolumeEstimation.training_data
+ONLINE_STATE_PATH = f"{CALIBRATION_DIR}/online_state.json" # <-- recursive least squares state of --online-calibration
 
 if __name__ == '__main__':
 
-    def response_topic(recieve_topic, response_cmnd_key = None, response_cmnd_value = None):
-        topic_elements = recieve_topic.split("/")
-        topic_elements[-2] = response_cmnd_key
-        topic_elements[-1] = response_cmnd_value
-        return '/'.join(topic_elements)
-
-    def download_last_file(s3_path):
-        endpoint = '--endpoint https://s3-west.nrp-nautilus.io s3'
-        command = f'aws {endpoint} cp {s3_path} .'
-        print(f"Running: {command}")
-        os.system(command)
-        list_of_files = glob.glob("./*.jpg")
-        return max(list_of_files, key=os.path.getctime) # latest file
-
-
-    def handle_estimate(topic, message):
-        if message["COMMAND"] == 'ESTIMATE-REQUEST':
-            print("Got Estimate Request!")
-            mb.publish_message(topic=response_topic(topic, "ESTIMATE", "ACK"),message={"COMMAND":"ESTIMATE-ACK"})
+    parser = argparse.ArgumentParser(description="Volume estimator service")
+    parser.add_argument('--workers', type=int, default=2, help='Number of estimator worker processes (default: 2)')
+    parser.add_argument('--queue-size', type=int, default=8, help='Estimate requests waiting for a worker before replying ESTIMATE-OVERLOAD (default: 8)')
+    parser.add_argument('--s3-endpoint', type=str, default=DEFAULT_ENDPOINT, help=f'S3 endpoint the images are fetched from (default: {DEFAULT_ENDPOINT})')
+    parser.add_argument('--cache-size', type=int, default=256, help='Estimate results kept to answer repeated requests, 0 disables the cache (default: 256)')
+    parser.add_argument('--cache-ttl', type=float, default=600, help='Seconds a cached estimate result stays valid (default: 600)')
+    parser.add_argument('--timing-window', type=int, default=1000, help='Estimates kept for the stage timing percentiles (default: 1000)')
+    parser.add_argument('--tracking', action='store_true', help='Search each tube around its last meniscus row and smooth its volumes')
+    parser.add_argument('--online-calibration', action='store_true', help='Refine the calibration from the pump volumes sent with CALIBRATION-OBSERVATION')
+    parser.add_argument('--forgetting-factor', type=float, default=0.999, help='Weight of past observations in the online calibration, 1 never forgets (default: 0.999)')
+    parser.add_argument('--outlier-threshold', type=float, default=4.0, help='Observations further than this many standard deviations from the calibration are rejected (default: 4)')
+    parser.add_argument('--publish-every', type=int, default=10, help='Accepted observations between two online calibration versions (default: 10)')
+    parser.add_argument('--shards', type=int, default=1, help='Number of estimator consumers splitting the requests by CHIP_ID (default: 1)')
+    parser.add_argument('--shard-index', type=int, default=0, help='Which of the --shards consumers this is, from 0 (default: 0)')
+    parser.add_argument('--layout', type=str, default=None, help='Tube layout JSON of the camera (default: LEFT and RIGHT tubes)')
+    parser.add_argument('--registration', type=str, default=None, help='ROI registration file of the camera, the tube ROIs then follow camera moves')
+    parser.add_argument('--subpixel', action='store_true', help='Interpolate fractional meniscus heights, areas and volumes')
+    parser.add_argument('--reject-on-quality', action='store_true', help='Check every image for blur and panel color and answer ESTIMATE-ERROR when it fails (default: no check)')
+    parser.add_argument('--shared-group', type=str, default=None, help='Split the requests through the broker shared subscription of this group instead of CHIP_ID hashing')
+    args = parser.parse_args()
+
+    def handle_calibration(topic, message):
+        if message["COMMAND"] == 'CALIBRATION-UPDATE':
+            print("Got Calibration Update!")
+            mb.publish_message(topic=response_topic(topic, "CALIBRATION", "ACK"),message={"COMMAND":"CALIBRATION-ACK"})
 
             try:
-                if all(x not in message["TYPE"] for x in ["volume"]):
-                    mb.publish_message(topic= response_topic(topic, "ESTIMATE", "ERROR"),
-                                    message={ "COMMAND": "ESTIMATE-ERROR",
-                                            "ERROR": "Invalid message key/values'",    
-                                            "FOR": message["FROM"]})
-            
-                if message["INDEX"] not in ["RIGHT", "LEFT"]:
-                    mb.publish_message(topic= response_topic(topic, "ESTIMATE", "ERROR"),
-                                    message={ "COMMAND": "ESTIMATE-ERROR",
-                                            "ERROR": "Invalid index value, must be 'RIGHT' or 'LEFT'",    
-                                            "FOR": message["FROM"]})
-
-                # If we got this far, do the estimation
-                response_message= {"COMMAND": "FEEDBACK-REQUEST",
-                                    "CHIP_ID": message["CHIP_ID"],
-                                    "INDEX": message["INDEX"], 
-                                    "FROM": "estimator"}
-
-
-                if ("volume" in message["TYPE"]):
-                    print("Estimating volume...")
-                    # Download image from AWS
-                    s3_path = message["PICTURE"]["VOL"][0]
-                    im_path = download_last_file(s3_path)
-                    # Initiate object by defining which side will be evaluated. Enter "right" or "left"
-                    obj_vol = VolumeEstimation(message["INDEX"])
-                    vol = obj_vol.volume_estimation(im_path) #returns single value of "RIGHT" or "LEFT" volume
-                    response_message["VOL"] = str(vol)
-                    response_message["IMAGE"] = str(im_path)
-
-                if ("well" in message["TYPE"]):
-                    print("Estimating well...")
-
-    
-
-                # Publish task COMPLETE
-                mb.publish_message(topic=response_topic(topic, "ESTIMATE", "COMPLETE"),message={"COMMAND":"ESTIMATE-COMPLETE"})
-                
-                # Publish estimation results
-                mb.publish_message(topic=f'telemetry/{message["UUID"]}/log/{message["FOR"]}/FEEDBACK/REQUEST', message=response_message)
-            
-            except (ValueError, IndexError) as e:
-                print("Error occurred: {e}")
-                # Publish task OUTOFBOUNDS
-                mb.publish_message(topic=response_topic(topic, "ESTIMATE", "OUTOFBOUNDS"), message={"COMMAND": "ESTIMATE-OUTOFBOUNDS"})
-
+                if "CALIBRATION" in message:
+                    # new coefficients sent inline, check them before storing a new version
+                    VolumeEstimation("LEFT").apply_calibration(message["CALIBRATION"])
+                    calibrations.current = calibrations.save(message["CALIBRATION"])
+                elif calibrations.activate(message.get("VERSION")) is None:
+                    raise FileNotFoundError(f"No calibration files in {CALIBRATION_DIR}")
+
+                print(f"Using calibration version {calibrations.current['version']}")
+                if service.tracker is not None:
+                    service.tracker.reset()  # volumes of the new calibration are not comparable
+                if online is not None:
+                    online.rebase(calibrations.current)  # refine the new calibration from now on
+                mb.publish_message(topic=response_topic(topic, "CALIBRATION", "COMPLETE"),
+                                message={"COMMAND": "CALIBRATION-COMPLETE",
+                                        "VERSION": calibrations.current["version"],
+                                        "FROM": DEVICE_NAME})
+
+            except (OSError, KeyError, TypeError, ValueError) as e:
+                print(f"Error occurred: {e}")
+                mb.publish_message(topic=response_topic(topic, "CALIBRATION", "ERROR"),
+                                message={"COMMAND": "CALIBRATION-ERROR",
+                                        "ERROR": str(e),
+                                        "FROM": DEVICE_NAME})
 
     def handle_ping(topic, message):
         if message["COMMAND"] == 'PING-REQUEST':
             mb.publish_message(topic=response_topic(topic, "PING", "RESPONSE"), message={"COMMAND":"PING-RESPONSE", "FROM": DEVICE_NAME})
 
+    def handle_stats(topic, message):
+        if message["COMMAND"] == 'STATS-REQUEST':
+            mb.publish_message(topic=response_topic(topic, "STATS", "RESPONSE"),
+                               message={"COMMAND": "STATS-RESPONSE",
+                                        "CACHE": service.cache.stats(),
+                                        "TIMING": service.timer.percentiles(),
+                                        "SHARD": shard.stats(),
+                                        "FROM": DEVICE_NAME})
+
+    def handle_observation(topic, message):
+        if message["COMMAND"] == 'CALIBRATION-OBSERVATION':
+            if online is None:
+                print("Online calibration is disabled, ignoring observation")
+                return
+            try:
+                accepted, residual = online.observe(float(message["AREA"]), float(message["VOL"]))
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Invalid calibration observation: {e}")
+                return
+
+            print(f"Calibration observation {'accepted' if accepted else 'rejected'}, residual {residual:.1f} uL")
+            if accepted and online.observations % args.publish_every == 0:
+                # new version for the workers, the tracked volumes stay comparable
+                calibrations.current = calibrations.save(online.get_calibration())
+                print(f"Using calibration version {calibrations.current['version']} ({online.observations} observations)")
+
     def consume_mqtt_message(topic, message):
         print(f"New unsorted message: {topic}\n{message}")
 
@@ -93,12 +116,57 @@ if __name__ == '__main__':
             handle_ping(topic, message)
 
         if "COMMAND" in message.keys() and message["COMMAND"] == "ESTIMATE-REQUEST":
-            handle_estimate(topic, message)
+            service.handle_estimate(topic, message) # <-- only validates, enqueues and ACKs
+
+        if "COMMAND" in message.keys() and message["COMMAND"] == "CALIBRATION-UPDATE":
+            handle_calibration(topic, message)
+
+        if "COMMAND" in message.keys() and message["COMMAND"] == "STATS-REQUEST":
+            handle_stats(topic, message)
 
+        if "COMMAND" in message.keys() and message["COMMAND"] == "CALIBRATION-OBSERVATION":
+            handle_observation(topic, message)
+
+        if "COMMAND" in message.keys() and message["COMMAND"] == "TRACK-RESET":
+            service.handle_track_reset(topic, message)
+
+
+    # Load the latest calibration once, CALIBRATION-UPDATE swaps it at runtime
+    calibrations = CalibrationRegistry(CALIBRATION_DIR)
+    if calibrations.activate() is None:
+        print(f"No calibration files in {CALIBRATION_DIR}, using the built-in coefficients")
+    else:
+        print(f"Using calibration version {calibrations.current['version']}")
+
+    layout = TubeLayout.load(args.layout) if args.layout is not None else None
+    if layout is not None:
+        print(f"Estimating tubes {layout.names}")
+
+    # Recursive least squares refinement of the active calibration
+    online = None
+    if args.online_calibration:
+        estimator = VolumeEstimation("LEFT")
+        if layout is not None:
+            estimator.apply_layout(layout)
+        base = calibrations.current if calibrations.current is not None else estimator.get_calibration()
+        online = OnlineCalibration(base, scale=estimator.max_tube_area(), state_path=ONLINE_STATE_PATH,
+                                   forgetting_factor=args.forgetting_factor, outlier_threshold=args.outlier_threshold)
+
+    # Which estimate requests this consumer handles, online calibration belongs on one consumer only
+    shard = ConsumerShard(args.shard_index, args.shards, args.shared_group)
 
     # Initialize message broker
     mb = messaging.MessageBroker(str(DEVICE_NAME + str(uuid.uuid4()))) 
-    mb.subscribe_message(topic=MQTT_DEVICE_SUBSCRIBE_TOPIC,callback=consume_mqtt_message)
+
+    # Warm worker processes with a bounded job queue
+    service = EstimatorService(mb, calibrations, device_name=DEVICE_NAME, max_workers=args.workers, max_queue=args.queue_size, s3_endpoint=args.s3_endpoint,
+                               cache_size=args.cache_size, cache_ttl=args.cache_ttl, timing_window=args.timing_window,
+                               tracker=MeniscusTracker() if args.tracking else None, layout=layout,
+                               registration_path=args.registration,
+                               segmentation={"subpixel_meniscus": args.subpixel},
+                               reject_on_quality=args.reject_on_quality)
+
+    shard.subscribe(mb, MQTT_DEVICE_SUBSCRIBE_TOPIC, consume_mqtt_message)
 
     while True:
         time.sleep(1)
@@ -0,0 +1,397 @@
+import os
+import time
+import queue
+import functools
+import threading
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from volumeEstimation import VolumeEstimation
+from s3Fetcher import S3Fetcher
+from resultCache import ResultCache
+from stageTimer import StageTimer
+from consumerShard import ConsumerShard
+
+# Per-process state of the pool workers, kept between jobs
+worker_estimator = None
+worker_fetcher = None
+
+
+def init_worker(s3_endpoint, fetcher=None, layout=None, registration_path=None, segmentation=None, reject_on_quality=False):
+    global worker_estimator, worker_fetcher
+    worker_estimator = VolumeEstimation("LEFT")
+    for name, value in (segmentation or {}).items():
+        setattr(worker_estimator, name, value)  # e.g. meniscus_search, pyramid_factor, subpixel_meniscus
+    if layout is not None:
+        worker_estimator.apply_layout(layout)
+    if registration_path is not None:
+        worker_estimator.enable_registration(registration_path)  # every worker re-registers on its own
+    # blur and panel color check, only when a failed check rejects the image: its blur threshold is not
+    # tuned on real frames yet, and it decodes the tube bounding box and the panel instead of the tube
+    # ROIs alone. Without it QUALITY is None.
+    worker_estimator.check_quality = reject_on_quality
+    worker_estimator.reject_on_quality = reject_on_quality
+    worker_estimator.enable_timing()
+    worker_fetcher = fetcher if fetcher is not None else S3Fetcher(s3_endpoint)
+
+
+def warm_up():
+    # builds the volume table so the first real job only pays for its own image
+    worker_estimator.get_volume_lut()
+    return os.getpid()
+
+
+def estimate_volume(s3_path, indexes, calibration, height_hints=None):
+    """
+    Runs in a pool worker: fetches the image into memory once and estimates the volume of every requested tube
+
+        Args:
+            's3_path' (str) : S3 path of the image
+            'indexes' (list) : tubes to estimate ("RIGHT", "LEFT" or the names of the tube layout)
+            'calibration' (dict) : calibration to apply, None keeps the built-in coefficients
+            'height_hints' (dict) : {index: expected meniscus row} from the tubes' tracker, other tubes scan the whole strip
+    """
+    if calibration is not None and calibration["version"] != worker_estimator.calibration_version:
+        worker_estimator.apply_calibration(calibration)
+
+    worker_estimator.timer.begin()
+    with worker_estimator.stage("s3_fetch"):
+        image_bytes = worker_fetcher.fetch(s3_path)
+    worker_estimator.height_hints = height_hints or {}
+    volumes = worker_estimator.volume_estimation_all(image_bytes, indexes)  # None per tube when the quality check fails
+
+    tubes = {}
+    for index, vol in volumes.items():
+        area, height, full_scan = worker_estimator.tube_features[index] if vol is not None else (None, None, None)
+        tubes[index] = {"VOL": vol,
+                        "AREA": (area if isinstance(area, float) else int(area)) if vol is not None else None,  # fractional with subpixel_meniscus
+                        "HEIGHT": height,
+                        "FULL_SCAN": full_scan}
+
+    return {"TUBES": tubes,
+            "IMAGE": s3_path,
+            "QUALITY": worker_estimator.quality,
+            "CALIBRATION_VERSION": worker_estimator.calibration_version,
+            "ROI_OFFSET": list(worker_estimator.roi_offset),
+            "TIMING": worker_estimator.timer.breakdown()}
+
+
+def response_topic(recieve_topic, response_cmnd_key = None, response_cmnd_value = None):
+    topic_elements = recieve_topic.split("/")
+    topic_elements[-2] = response_cmnd_key
+    topic_elements[-1] = response_cmnd_value
+    return '/'.join(topic_elements)
+
+
+class EstimatorService:
+    """
+    Bounded job queue in front of a pool of warm estimator processes.
+
+    The MQTT callback only validates, enqueues and ACKs an ESTIMATE-REQUEST (or replies
+    ESTIMATE-OVERLOAD when the queue is full). A dispatcher thread hands queued jobs to
+    the pool, never more than one per worker, and results are published from the
+    completion callbacks. Repeated requests for an image already estimated with the
+    current calibration are answered from the result cache without touching the pool.
+    Stage timings measured by the workers, the queue wait and the total latency are
+    kept in `timer` for the stats. With a MeniscusTracker, every (CHIP_ID, INDEX) tube
+    is searched around its last meniscus row and the published volume is smoothed.
+    A fluid action moves the level past the smoothing gate, so TRACK-RESET (or an
+    ESTIMATE-REQUEST with RESET_TRACK) restarts the tube's track; estimates requested
+    before the reset skip the tracker and publish their own volume.
+
+    Requests of one CHIP_ID are estimated one at a time, in arrival order: a job whose chip
+    already has an estimate in flight waits in `chip_jobs` and is submitted, on the same
+    worker slot, when that estimate is published. Other chips keep every worker busy.
+    `fetcher` replaces the S3Fetcher of the workers (e.g. a local stand-in for benchmarks).
+    With `registration_path` (see roiRegistration.py) the workers follow the tubes when the
+    camera moves, and every result carries the ROI_OFFSET it was estimated with.
+    `segmentation` sets VolumeEstimation attributes of the workers (meniscus_search,
+    pyramid_factor, subpixel_meniscus).
+    Only with `reject_on_quality` are the images checked for blur and panel color (QUALITY
+    of every result), and a failed check replaces the volumes with ESTIMATE-ERROR.
+
+    With a TubeLayout, INDEX names its tubes. A request may list several tubes (or "ALL")
+    with a {INDEX: CHIP_ID} map. It is split into one request per chip (ConsumerShard.
+    split_by_chip), each acknowledged and ordered with that chip's other requests; the tubes
+    of a chip are fetched, decoded and segmented once and answered with one feedback request
+    per tube.
+    """
+    def __init__(self, mb, calibrations, device_name="estimator", max_workers=2, max_queue=8, s3_endpoint=None,
+                 cache_size=256, cache_ttl=600, timing_window=1000, tracker=None, fetcher=None, layout=None,
+                 registration_path=None, segmentation=None, reject_on_quality=False):
+        self.mb = mb
+        self.s3_endpoint = s3_endpoint
+        self.fetcher = fetcher
+        self.calibrations = calibrations
+        self.cache = ResultCache(max_entries=cache_size, ttl=cache_ttl)
+        self.timer = StageTimer(timing_window)
+        self.tracker = tracker
+        self.track_lock = threading.Lock()
+        self.track_resets = {}  # (CHIP_ID, INDEX) -> perf_counter() of its last reset
+        self.device_name = device_name
+        self.max_workers = max_workers
+        self.layout = layout
+        self.registration_path = registration_path
+        self.segmentation = segmentation
+        self.reject_on_quality = reject_on_quality
+        self.indexes = layout.names if layout is not None else ["RIGHT", "LEFT"]
+
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.in_flight = threading.BoundedSemaphore(max_workers)
+        self.chip_lock = threading.Lock()
+        self.chip_pending = collections.Counter()  # CHIP_ID -> requests queued or in flight
+        self.chip_jobs = {}  # CHIP_ID with an estimate in flight -> jobs waiting for it
+        self.pool = self.start_pool()
+
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def start_pool(self):
+        pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker, initargs=(self.s3_endpoint, self.fetcher, self.layout, self.registration_path, self.segmentation, self.reject_on_quality))
+        # start every worker now so requests do not pay for the imports
+        for _ in range(self.max_workers):
+            pool.submit(warm_up)
+        return pool
+
+    def handle_estimate(self, topic, message):
+        if message["COMMAND"] != 'ESTIMATE-REQUEST':
+            return
+        requests = ConsumerShard.split_by_chip(message)
+        if len(requests) > 1:
+            for request in requests:
+                self.handle_estimate(topic, request)
+            return
+        message = requests[0]  # a map of a single chip becomes that chip
+        print("Got Estimate Request!")
+
+        if all(x not in message["TYPE"] for x in ["volume"]):
+            self.publish_error(topic, message, "Invalid message key/values'")
+            return
+
+        try:
+            tubes = self.request_tubes(message)
+        except (KeyError, TypeError, ValueError) as e:
+            self.publish_error(topic, message, str(e))
+            return
+
+        try:
+            s3_path = message["PICTURE"]["VOL"][0]
+        except (KeyError, IndexError, TypeError):
+            self.publish_error(topic, message, "Missing PICTURE VOL s3 path")
+            return
+
+        if message.get("RESET_TRACK"):
+            for index, tube_chip in tubes:
+                self.reset_track(tube_chip, index)
+
+        chip = self.order_key(message)
+        queued = False
+        with self.chip_lock:
+            # a cached answer must not overtake an earlier request of the same chip
+            result = None if self.chip_pending[chip] else self.cache.get(self.cache_key(s3_path, tubes, self.calibrations.current))
+            # jobs waiting behind their chip count against the queue size too
+            waiting = sum(len(jobs) for jobs in self.chip_jobs.values())
+            if result is None and self.jobs.qsize() + waiting < self.jobs.maxsize:
+                self.jobs.put_nowait((topic, message, s3_path, tubes, time.perf_counter()))
+                self.chip_pending[chip] += 1
+                queued = True
+
+        if result is not None:
+            print("Answering estimate request from the result cache")
+            self.mb.publish_message(topic=response_topic(topic, "ESTIMATE", "ACK"),message={"COMMAND":"ESTIMATE-ACK"})
+            self.publish_result(topic, message, result, tubes, cached=True)
+            return
+
+        if not queued:
+            print("Estimator overloaded, rejecting request")
+            self.mb.publish_message(topic=response_topic(topic, "ESTIMATE", "OVERLOAD"),
+                                    message={"COMMAND": "ESTIMATE-OVERLOAD",
+                                             "QUEUED": self.jobs.qsize(),
+                                             "FOR": message["FROM"],
+                                             "FROM": self.device_name})
+            return
+
+        self.mb.publish_message(topic=response_topic(topic, "ESTIMATE", "ACK"),message={"COMMAND":"ESTIMATE-ACK"})
+
+    def handle_track_reset(self, topic, message):
+        # TRACK-RESET: a fluid action changed the volume of the tube (CHIP_ID, INDEX)
+        if message["COMMAND"] != 'TRACK-RESET':
+            return
+        if self.tracker is None:
+            return
+        try:
+            tubes = self.request_tubes(message)
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Invalid track reset: {e}")
+            return
+        for index, chip in tubes:
+            self.reset_track(chip, index)
+        print(f"Reset the tracks of {tubes}")
+
+    def reset_track(self, chip, index):
+        # the next estimate starts the track from its own volume and scans the whole strip
+        if self.tracker is None:
+            return
+        with self.track_lock:
+            self.tracker.reset((chip, index))
+            self.track_resets[(chip, index)] = time.perf_counter()
+
+    def dispatch(self):
+        while True:
+            job = self.jobs.get()
+            chip = self.order_key(job[1])
+            with self.chip_lock:
+                if chip in self.chip_jobs:
+                    self.chip_jobs[chip].append(job)  # submitted once the chip's estimate in flight is published
+                    continue
+                self.chip_jobs[chip] = collections.deque()
+            self.in_flight.acquire()  # wait for a free worker, the backlog stays in the bounded queue
+            self.submit(*job)
+
+    def submit(self, topic, message, s3_path, tubes, enqueued):
+        queue_ms = (time.perf_counter() - enqueued) * 1000
+        print("Estimating volume...")
+        calibration = self.calibrations.current
+        key = self.cache_key(s3_path, tubes, calibration)
+        indexes = [index for index, _ in tubes]
+        height_hints = {}
+        if self.tracker is not None:
+            height_hints = {index: self.tracker.height_hint((chip, index)) for index, chip in tubes}
+        try:
+            future = self.pool.submit(estimate_volume, s3_path, indexes, calibration, height_hints)
+        except BrokenProcessPool:
+            print("Estimator pool crashed, restarting it")
+            self.pool = self.start_pool()
+            future = self.pool.submit(estimate_volume, s3_path, indexes, calibration, height_hints)
+        future.add_done_callback(functools.partial(self.complete, topic, message, tubes, key, enqueued, queue_ms))
+
+    def next_chip_job(self, chip):
+        # hands the worker slot to the chip's next waiting job, or frees it
+        with self.chip_lock:
+            self.chip_pending[chip] -= 1
+            if self.chip_pending[chip] <= 0:
+                del self.chip_pending[chip]
+            waiting = self.chip_jobs[chip]
+            job = waiting.popleft() if waiting else None
+            if job is None:
+                del self.chip_jobs[chip]
+        if job is None:
+            self.in_flight.release()
+        else:
+            self.submit(*job)
+
+    def request_tubes(self, message):
+        # [(INDEX, CHIP_ID)] of a request. INDEX is a tube, a list of tubes or "ALL";
+        # CHIP_ID is the chip of every tube or a {INDEX: CHIP_ID} map
+        indexes = message["INDEX"]
+        if indexes == "ALL":
+            indexes = self.indexes
+        elif isinstance(indexes, str):
+            indexes = [indexes]
+        if not indexes or any(index not in self.indexes for index in indexes):
+            raise ValueError(f"Invalid index value, must be one of {self.indexes} or \"ALL\"")
+
+        chips = message.get("CHIP_ID")
+        if isinstance(chips, dict):
+            missing = [index for index in indexes if index not in chips]
+            if missing:
+                raise ValueError(f"Missing CHIP_ID of index {missing}")
+            return [(index, chips[index]) for index in indexes]
+        return [(index, chips) for index in indexes]
+
+    @staticmethod
+    def order_key(message):
+        # requests with the same key are estimated in arrival order. Rack requests are split by
+        # chip (ConsumerShard.split_by_chip) before they are queued, so this is a single chip
+        return message.get("CHIP_ID")
+
+    def cache_key(self, s3_path, tubes, calibration):
+        # workers without a calibration keep the built-in coefficients ("default")
+        version = calibration["version"] if calibration is not None else "default"
+        return self.cache.key(s3_path, tuple(index for index, _ in tubes), version)
+
+    def complete(self, topic, message, tubes, key, enqueued, queue_ms, future):
+        try:
+            self.publish_completed(topic, message, tubes, key, enqueued, queue_ms, future)
+        finally:
+            self.next_chip_job(self.order_key(message))
+
+    def publish_completed(self, topic, message, tubes, key, enqueued, queue_ms, future):
+        try:
+            result = future.result()
+        except (ValueError, IndexError) as e:
+            print(f"Error occurred: {e}")
+            # Publish task OUTOFBOUNDS
+            self.mb.publish_message(topic=response_topic(topic, "ESTIMATE", "OUTOFBOUNDS"), message={"COMMAND": "ESTIMATE-OUTOFBOUNDS"})
+            return
+        except Exception as e:
+            # anything else raised by the worker (or a crashed worker) must not kill the service
+            print(f"Error occurred: {e}")
+            self.publish_error(topic, message, str(e))
+            return
+
+        timing = dict(result["TIMING"], queue=round(queue_ms, 2), total=round((time.perf_counter() - enqueued) * 1000, 2))
+        self.timer.record_many(timing)
+
+        if self.tracker is not None:
+            # a single bad frame is reported as the prediction instead of its own volume. Photos
+            # requested before a reset of their tube show the level before the fluid action, they
+            # keep their own volume and do not restart the track
+            tracked_tubes = dict(result["TUBES"])
+            for index, chip in tubes:
+                tube = tracked_tubes[index]
+                with self.track_lock:
+                    if tube["VOL"] is None or enqueued < self.track_resets.get((chip, index), float("-inf")):
+                        continue
+                    tracked = self.tracker.update((chip, index), tube["VOL"], tube["HEIGHT"], time.time(), tube["FULL_SCAN"])
+                    tracked_tubes[index] = dict(tube, VOL=tracked["VOLUME"], RAW_VOL=tracked["RAW_VOLUME"],
+                                                CONFIDENCE=tracked["CONFIDENCE"], REJECTED=tracked["REJECTED"])
+            result = dict(result, TUBES=tracked_tubes)
+
+        # quality failures are cached too, the same image fails the same way
+        self.cache.put(key, result)
+        self.publish_result(topic, message, result, tubes, timing=timing)
+
+    def publish_result(self, topic, message, result, tubes, cached=False, timing=None):
+        if all(tube["VOL"] is None for tube in result["TUBES"].values()):
+            self.mb.publish_message(topic= response_topic(topic, "ESTIMATE", "ERROR"),
+                                    message={ "COMMAND": "ESTIMATE-ERROR",
+                                            "ERROR": "Image failed quality check",
+                                            "QUALITY": result["QUALITY"],
+                                            "FOR": message["FROM"]})
+            return
+
+        # Publish task COMPLETE
+        complete_message = {"COMMAND": "ESTIMATE-COMPLETE"}
+        if timing is not None:
+            complete_message["TIMING"] = timing  # ms per stage of this estimate
+        if result.get("ROI_OFFSET") is not None:
+            complete_message["ROI_OFFSET"] = result["ROI_OFFSET"]
+        self.mb.publish_message(topic=response_topic(topic, "ESTIMATE", "COMPLETE"),message=complete_message)
+
+        # Publish estimation results, one feedback request per tube
+        for index, chip in tubes:
+            tube = result["TUBES"][index]
+            response_message= {"COMMAND": "FEEDBACK-REQUEST",
+                                "CHIP_ID": chip,
+                                "INDEX": index,
+                                "FROM": self.device_name,
+                                "VOL": str(tube["VOL"]),
+                                "AREA": tube["AREA"],
+                                "IMAGE": str(result["IMAGE"]),
+                                "QUALITY": result["QUALITY"],
+                                "CALIBRATION_VERSION": result["CALIBRATION_VERSION"],
+                                "CACHED": cached}
+            if "CONFIDENCE" in tube:
+                response_message["RAW_VOL"] = str(tube["RAW_VOL"])
+                response_message["CONFIDENCE"] = tube["CONFIDENCE"]
+                response_message["REJECTED"] = tube["REJECTED"]
+
+            self.mb.publish_message(topic=f'telemetry/{message["UUID"]}/log/{message["FOR"]}/FEEDBACK/REQUEST', message=response_message)
+
+    def publish_error(self, topic, message, error):
+        self.mb.publish_message(topic= response_topic(topic, "ESTIMATE", "ERROR"),
+                                message={ "COMMAND": "ESTIMATE-ERROR",
+                                        "ERROR": error,
+                                        "FOR": message.get("FROM")})
@@ -0,0 +1,77 @@
+import time
+import hashlib
+import json
+import sqlite3
+
+
+class FeatureCache:
+    """
+    On-disk cache (SQLite) of per-image, per-side segmentation results.
+
+    Rows are keyed by the SHA-1 of the image file content and by a hash of the crop
+    geometry and segmentation thresholds, so changing any of them makes the old rows
+    unreachable. They are kept, switching back to earlier settings finds them again;
+    prune() deletes the rows of other settings, all of them or the ones unused for a while.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS features (
+                                    content_hash TEXT NOT NULL,
+                                    params_hash TEXT NOT NULL,
+                                    side TEXT NOT NULL,
+                                    area INTEGER NOT NULL,
+                                    meniscus_height INTEGER NOT NULL,
+                                    meniscus_area INTEGER NOT NULL,
+                                    used_at REAL NOT NULL DEFAULT 0,
+                                    PRIMARY KEY (content_hash, params_hash, side))""")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(features)")]
+        if "used_at" not in columns:
+            # caches written before rows had a last use time, they count as unused since 1970
+            self.connection.execute("ALTER TABLE features ADD COLUMN used_at REAL NOT NULL DEFAULT 0")
+        self.connection.commit()
+
+    @staticmethod
+    def params_hash(params):
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def content_hash(image_path):
+        digest = hashlib.sha1()
+        with open(image_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get(self, content_hash, params_hash, side):
+        # (area, meniscus_height, meniscus_area) or None
+        return self.connection.execute("SELECT area, meniscus_height, meniscus_area FROM features "
+                                       "WHERE content_hash = ? AND params_hash = ? AND side = ?",
+                                       (content_hash, params_hash, side)).fetchone()
+
+    def put_many(self, rows):
+        # rows of (content_hash, params_hash, side, area, meniscus_height, meniscus_area). Sub-pixel areas
+        # and heights are fractional, SQLite still stores whole numbers in the INTEGER columns as integers
+        now = time.time()
+        self.connection.executemany("INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    [(c, p, s, float(a), float(h), int(m), now) for c, p, s, a, h, m in rows])
+        self.connection.commit()
+
+    def touch(self, params_hash):
+        # marks every row of these parameters as used now, once per run rather than per get()
+        self.connection.execute("UPDATE features SET used_at = ? WHERE params_hash = ?", (time.time(), params_hash))
+        self.connection.commit()
+
+    def prune(self, params_hash, max_age=None):
+        # drop the rows computed with other crop/segmentation parameters: all of them, or with
+        # max_age (seconds) only those not used for that long. Returns the number of rows deleted
+        if max_age is None:
+            deleted = self.connection.execute("DELETE FROM features WHERE params_hash != ?", (params_hash,)).rowcount
+        else:
+            deleted = self.connection.execute("DELETE FROM features WHERE params_hash != ? AND used_at < ?",
+                                              (params_hash, time.time() - max_age)).rowcount
+        self.connection.commit()
+        return deleted
+
+    def close(self):
+        self.connection.close()
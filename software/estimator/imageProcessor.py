@@ -1,7 +1,9 @@
 import cv2
 import os
 import numpy as np
+import functools
 from volumeEstimation import VolumeEstimation
+from maskDataset import MaskDataset, MaskDatasetWriter
 import csv
 
 class ImageProcessor:
@@ -10,25 +12,36 @@ class ImageProcessor:
 
     def prepare_data(self, dataset_path, output_binary_image_path, output_binary_image_meniscus_path, output_binary_image_edge_path):
             image_files = [file for file in os.listdir(dataset_path) if file.endswith(('.jpg', '.jpeg', '.png'))]
+            image_paths = [os.path.join(dataset_path, image_file) for image_file in image_files]
 
-            for image_file in image_files:
-                image_path = os.path.join(dataset_path, image_file)
+            # masks are processed and written by the workers, data.txt is appended here in file order
+            prepare_image = functools.partial(self.prepare_image, output_binary_image_path=output_binary_image_path,
+                                              output_binary_image_meniscus_path=output_binary_image_meniscus_path,
+                                              output_binary_image_edge_path=output_binary_image_edge_path)
+            for rows in self.obj.runner.map(prepare_image, image_paths):
+                for row in rows:
+                    self.save_data_txt(*row)
 
-                volume_gt = VolumeEstimation.get_gt_volume(image_file)
+    def prepare_image(self, image_path, output_binary_image_path, output_binary_image_meniscus_path, output_binary_image_edge_path):
+            image_file = os.path.basename(image_path)
+            volume_gt = VolumeEstimation.get_gt_volume(image_file)
 
-                full_image = cv2.imread(image_path)
-                for side in ['left', 'right']:
-                    binary_image, binary_image_meniscus, binary_edge, area, area_meniscus = self.prepare_data_by_side(full_image, side, volume_gt)
-                    binary_image_path = os.path.join(output_binary_image_path, f"{side}_" + image_file)
-                    cv2.imwrite(binary_image_path, binary_image)
+            rows = []
+            full_image = cv2.imread(image_path)
+            for side in ['left', 'right']:
+                binary_image, binary_image_meniscus, binary_edge, area, area_meniscus = self.prepare_data_by_side(full_image, side, volume_gt)
+                binary_image_path = os.path.join(output_binary_image_path, f"{side}_" + image_file)
+                cv2.imwrite(binary_image_path, binary_image)
 
-                    binary_image_meniscus_path = os.path.join(output_binary_image_meniscus_path, f"{side}_" + image_file) 
-                    cv2.imwrite(binary_image_meniscus_path, binary_image_meniscus)
+                binary_image_meniscus_path = os.path.join(output_binary_image_meniscus_path, f"{side}_" + image_file) 
+                cv2.imwrite(binary_image_meniscus_path, binary_image_meniscus)
 
-                    binary_image_edge_path = os.path.join(output_binary_image_edge_path, f"{side}_" + image_file)
-                    cv2.imwrite(binary_image_edge_path, binary_edge)
+                binary_image_edge_path = os.path.join(output_binary_image_edge_path, f"{side}_" + image_file)
+                cv2.imwrite(binary_image_edge_path, binary_edge)
 
-                    self.save_data_txt(binary_image_path, binary_image_meniscus_path, binary_image_edge_path, area, area_meniscus, volume_gt)
+                rows.append((binary_image_path, binary_image_meniscus_path, binary_image_edge_path, area, area_meniscus, volume_gt))
+
+            return rows
                 
     def prepare_data_by_side(self, full_image, side, volume_gt):
         rect_image = VolumeEstimation.image_crop(self.obj, full_image, side)
@@ -51,6 +64,21 @@ class ImageProcessor:
             writer = csv.writer(f)
             writer.writerow(content)
 
+    def read_mask_line(self, line):
+        # one data.txt row: the H, M and E masks at half their original size, the areas as the
+        # loaders return them and the volume. None when a mask cannot be read
+        img_path_H, img_path_M, img_path_E, H_area, M_area, volume = line.strip().split(',')
+        images = []
+        for img_path in (img_path_H, img_path_M, img_path_E):
+            img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                print(f"Could not read mask {img_path}")
+                return None
+            # Resize the images to half of their original size
+            height, width = img.shape[:2]
+            images.append(cv2.resize(img, (width // 2, height // 2)))
+        return images[0], images[1], images[2], float(H_area)/8, float(M_area)/8, float(volume)
+
     def load_images_and_areas_from_file(self, txt_filepath):
         with open(txt_filepath, 'r') as f:
             lines = f.readlines()
@@ -63,27 +91,15 @@ class ImageProcessor:
         volumes = []
 
         for line in lines:
-            img_path_H, img_path_M, img_path_E, H_area, M_area, volume = line.strip().split(',')
-            img_H = cv2.imread(img_path_H, cv2.IMREAD_GRAYSCALE)
-            img_M = cv2.imread(img_path_M, cv2.IMREAD_GRAYSCALE)
-            img_E = cv2.imread(img_path_E, cv2.IMREAD_GRAYSCALE)
-            # Get the original image dimensions
-            height_H, width_H = img_H.shape[:2]
-            height_M, width_M = img_M.shape[:2]
-            height_E, width_E = img_E.shape[:2]
-
-            # Resize the images to half of their original size
-            img_H = cv2.resize(img_H, (width_H // 2, height_H // 2))
-            img_M = cv2.resize(img_M, (width_M // 2, height_M // 2))
-            img_E = cv2.resize(img_E, (width_E // 2, height_E // 2))
-
-            if img_H is not None and img_M is not None:
+            sample = self.read_mask_line(line)
+            if sample is not None:
+                img_H, img_M, img_E, H_area, M_area, volume = sample
                 images_H.append(img_H)
                 images_M.append(img_M)
                 images_E.append(img_E)
-                H_areas.append(float(H_area)/8)
-                M_areas.append(float(M_area)/8)
-                volumes.append(float(volume))
+                H_areas.append(H_area)
+                M_areas.append(M_area)
+                volumes.append(volume)
 
         image_size = (images_H[0].shape[0], images_H[0].shape[1])
         images_H_array = np.array(images_H)
@@ -93,4 +109,30 @@ class ImageProcessor:
         M_areas_array = np.array(M_areas)
         volumes_array = np.array(volumes)
 
-        return images_H_array, images_M_array, images_E_array, H_areas_array, M_areas_array, volumes_array, image_size
\ No newline at end of file
+        return images_H_array, images_M_array, images_E_array, H_areas_array, M_areas_array, volumes_array, image_size
+
+    def pack_images_and_areas_from_file(self, txt_filepath, dataset_path):
+        # Writes the samples of data.txt as a bit-packed MaskDataset folder, one line at a time,
+        # so only one sample is in memory. Masks are stored binarized (above 127) at half size, so
+        # the grey edges of the resized masks are lost (see MaskDataset).
+        # Returns the number of samples written
+        with open(txt_filepath, 'r') as f, MaskDatasetWriter(dataset_path) as writer:
+            for line in f:
+                if not line.strip():
+                    continue
+                sample = self.read_mask_line(line)
+                if sample is not None:
+                    writer.append(*sample)
+            return len(writer.volumes)
+
+    def load_packed_images_and_areas(self, dataset_path):
+        """
+        Args:
+            'dataset_path' (str) : folder written by pack_images_and_areas_from_file
+        Returns:
+            MaskDataset: memmap views of the masks, areas and volumes; dataset.batches(batch_size)
+            decodes the images_H, images_M, images_E, H_areas, M_areas, volumes arrays of
+            load_images_and_areas_from_file a batch at a time, with the masks thresholded at 127,
+            dataset.image_size is the mask size
+        """
+        return MaskDataset(dataset_path)
@@ -0,0 +1,46 @@
+import threading
+import itertools
+
+
+class LocalBroker:
+    """
+    In-process stand-in for braingeneers' MessageBroker (publish_message / subscribe_message)
+    to run estimator consumers without an MQTT server.
+
+    Topic filters support the `+` and `#` wildcards, and `$share/<group>/<filter>`
+    subscriptions deliver each message to one member of the group, round robin. Callbacks
+    run in the publishing thread.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = []  # (filter, callback)
+        self.groups = {}  # (group, filter) -> [callbacks], cycle
+        self.published = 0
+
+    @staticmethod
+    def matches(topic_filter, topic):
+        filter_levels = topic_filter.split("/")
+        topic_levels = topic.split("/")
+        for k, level in enumerate(filter_levels):
+            if level == "#":
+                return True
+            if k >= len(topic_levels) or (level != "+" and level != topic_levels[k]):
+                return False
+        return len(filter_levels) == len(topic_levels)
+
+    def subscribe_message(self, topic, callback):
+        with self.lock:
+            if topic.startswith("$share/"):
+                _, group, topic_filter = topic.split("/", 2)
+                members = self.groups.get((group, topic_filter), ([], None))[0] + [callback]
+                self.groups[(group, topic_filter)] = (members, itertools.cycle(members))
+            else:
+                self.subscriptions.append((topic, callback))
+
+    def publish_message(self, topic, message):
+        with self.lock:
+            self.published += 1
+            callbacks = [callback for topic_filter, callback in self.subscriptions if self.matches(topic_filter, topic)]
+            callbacks += [next(members) for (_, topic_filter), (_, members) in self.groups.items() if self.matches(topic_filter, topic)]
+        for callback in callbacks:
+            callback(topic, dict(message))
@@ -0,0 +1,133 @@
+import os
+import json
+import numpy as np
+
+
+class MaskDataset:
+    """
+    Bit-packed H/M/E mask dataset of ImageProcessor, read through memory maps.
+
+    A dataset folder holds
+
+        masks.bin    : the binary masks, one bit per pixel (np.packbits of every flattened
+                       mask), (n, 3, ceil(rows * cols / 8)) uint8 in H, M, E order
+        areas.npy    : (n, 2) float64 H and M areas
+        volumes.npy  : (n,) float64 ground truth volumes
+        dataset.json : count, mask shape and the number of binarized grey pixels
+
+    Nothing is read when the dataset is opened: `masks`, `areas` and `volumes` are memmap
+    views, and `batch`/`batches` decode only the requested samples to 0/255 uint8 masks.
+    The masks take 8 times less disk and page cache than the dense arrays, and peak memory
+    is one decoded batch. MaskDatasetWriter builds the folder one sample at a time.
+
+    The format is lossy. ImageProcessor.load_images_and_areas_from_file keeps the grey edges
+    that resizing leaves on the masks; here every pixel is stored as above 127 or not, so the
+    decoded masks equal the dense ones thresholded at 127 (np.where(dense > 127, 255, 0)).
+    `binarized_pixels` counts the grey pixels that were rounded that way.
+    """
+    CHANNELS = ("H", "M", "E")
+
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        with open(os.path.join(dataset_path, "dataset.json"), 'r') as f:
+            meta = json.load(f)
+        self.count = int(meta["count"])
+        self.image_size = tuple(int(v) for v in meta["image_size"])  # (rows, cols) of one mask
+        self.binarized_pixels = int(meta.get("binarized_pixels", 0))  # neither 0 nor 255 before packing
+        self.pixels = self.image_size[0] * self.image_size[1]
+        packed_size = -(-self.pixels // 8)
+        if self.count:
+            self.masks = np.memmap(os.path.join(dataset_path, "masks.bin"), dtype=np.uint8, mode='r',
+                                   shape=(self.count, len(self.CHANNELS), packed_size))
+        else:
+            self.masks = np.zeros((0, len(self.CHANNELS), packed_size), dtype=np.uint8)  # np.memmap cannot map an empty file
+        self.areas = np.load(os.path.join(dataset_path, "areas.npy"), mmap_mode='r')
+        self.volumes = np.load(os.path.join(dataset_path, "volumes.npy"), mmap_mode='r')
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def pack(mask):
+        # one bit per pixel of a mask, set where it is above 127: resized masks have grey edges,
+        # which are rounded to 0 or 255
+        return np.packbits(np.asarray(mask).reshape(-1) > 127)
+
+    def unpack(self, packed):
+        # (..., packed_size) bits -> (..., rows, cols) uint8 masks of 0 and 255
+        bits = np.unpackbits(packed, axis=-1, count=self.pixels)
+        bits *= 255
+        return bits.reshape(packed.shape[:-1] + self.image_size)
+
+    def batch(self, indices):
+        """
+        Args:
+            'indices' (slice, list or np.ndarray) : samples to decode
+        Returns:
+            images_H, images_M, images_E : (len(indices), rows, cols) uint8 masks
+        """
+        masks = self.unpack(np.asarray(self.masks[indices]))
+        return masks[:, 0], masks[:, 1], masks[:, 2]
+
+    def batches(self, batch_size, indices=None):
+        # yields (images_H, images_M, images_E, H_areas, M_areas, volumes) of batch_size samples,
+        # in the order of `indices` (default all, e.g. a shuffled permutation for training)
+        if indices is None:
+            indices = np.arange(self.count)
+        indices = np.asarray(indices)
+        for start in range(0, len(indices), batch_size):
+            chunk = indices[start:start + batch_size]
+            if np.all(np.diff(chunk) == 1):
+                chunk = slice(int(chunk[0]), int(chunk[-1]) + 1)  # contiguous rows are read as one slice
+            images_H, images_M, images_E = self.batch(chunk)
+            areas = np.asarray(self.areas[chunk])
+            yield images_H, images_M, images_E, areas[:, 0], areas[:, 1], np.asarray(self.volumes[chunk])
+
+    def nbytes(self):
+        # (packed, dense) bytes of the masks
+        return self.masks.nbytes, self.count * len(self.CHANNELS) * self.pixels
+
+
+class MaskDatasetWriter:
+    """
+    Appends samples to a MaskDataset folder without keeping them in memory: every mask is
+    packed and written to masks.bin as it arrives, only the areas and volumes are kept until
+    close() writes the sidecar arrays. All masks must have the shape of the first one.
+    Grey pixels are binarized (see MaskDataset) and counted in `binarized_pixels`.
+    """
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        os.makedirs(dataset_path, exist_ok=True)
+        self.file = open(os.path.join(dataset_path, "masks.bin"), 'wb')
+        self.image_size = None
+        self.binarized_pixels = 0
+        self.areas = []
+        self.volumes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, img_H, img_M, img_E, H_area, M_area, volume):
+        for mask in (img_H, img_M, img_E):
+            if self.image_size is None:
+                self.image_size = mask.shape[:2]
+            elif mask.shape[:2] != self.image_size:
+                raise ValueError(f"Mask of shape {mask.shape[:2]} in a dataset of {self.image_size} masks")
+            self.binarized_pixels += int(np.count_nonzero((mask != 0) & (mask != 255)))
+            self.file.write(MaskDataset.pack(mask).tobytes())
+        self.areas.append((float(H_area), float(M_area)))
+        self.volumes.append(float(volume))
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        np.save(os.path.join(self.dataset_path, "areas.npy"), np.array(self.areas, dtype=np.float64).reshape(-1, 2))
+        np.save(os.path.join(self.dataset_path, "volumes.npy"), np.array(self.volumes, dtype=np.float64))
+        # written last: a folder without it is an interrupted dataset
+        with open(os.path.join(self.dataset_path, "dataset.json"), 'w') as f:
+            json.dump({"count": len(self.volumes), "image_size": list(self.image_size or (0, 0)),
+                       "binarized_pixels": self.binarized_pixels}, f, indent=4)
@@ -0,0 +1,108 @@
+import math
+import time
+from collections import deque
+import numpy as np
+
+
+class MeniscusTracker:
+    """
+    Per-tube meniscus row and smoothed volume across consecutive photos.
+
+    Every tube (any hashable key, e.g. (CHIP_ID, INDEX)) keeps the last accepted
+    meniscus row, used as the search hint of the next frame, and a constant-velocity
+    Kalman state [volume (uL), rate (uL/s)]. A measurement further than `gate` standard
+    deviations from the prediction is rejected and the prediction is reported instead;
+    after `max_rejections` rejections in a row the state restarts from the measurement,
+    since the level really moved (e.g. after a feed). Call reset() after fluid actions
+    to skip that wait (EstimatorService does on TRACK-RESET, sent by autoculture).
+    """
+    def __init__(self, process_noise=1e-8, measurement_noise=20.0, gate=3.0, max_rejections=2, history=10000):
+        self.process_noise = process_noise  # volume acceleration spectral density (uL^2/s^3)
+        self.measurement_noise = measurement_noise  # standard deviation of one estimate (uL)
+        self.gate = gate
+        self.max_rejections = max_rejections
+        self.history = history
+        self.tubes = {}  # key -> state
+        self.series = {}  # key -> deque of (timestamp, smoothed volume)
+
+    def height_hint(self, key):
+        # last accepted meniscus row of the tube, None when it is not tracked yet
+        state = self.tubes.get(key)
+        return None if state is None else state["height"]
+
+    def reset(self, key=None):
+        if key is None:
+            self.tubes.clear()
+        else:
+            self.tubes.pop(key, None)
+
+    def start(self, key, volume, height, timestamp):
+        self.tubes[key] = {"x": np.array([volume, 0.0]),
+                           "P": np.diag([self.measurement_noise ** 2, 1.0]),
+                           "height": height,
+                           "timestamp": timestamp,
+                           "rejections": 0}
+
+    def update(self, key, volume, height, timestamp=None, full_scan=True):
+        """
+        Args:
+            'key' : tube identifier
+            'volume' (float) : estimated volume of this frame (uL)
+            'height' (float) : meniscus row measured in this frame (fractional with sub-pixel heights)
+            'timestamp' (float) : capture time in seconds, None uses the current time
+            'full_scan' (bool) : whether the whole strip was searched
+        Returns:
+            dict with the smoothed "VOLUME", the "RAW_VOLUME", the "RATE" (uL/s), a
+            "CONFIDENCE" in [0, 1] and whether the measurement was "REJECTED"
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        state = self.tubes.get(key)
+        if state is None:
+            self.start(key, volume, height, timestamp)
+            return self.output(key, volume, timestamp, 1.0, False, full_scan)
+
+        # predict
+        dt = max(timestamp - state["timestamp"], 0.0)
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        Q = self.process_noise * np.array([[dt ** 3 / 3, dt ** 2 / 2], [dt ** 2 / 2, dt]])
+        x = F @ state["x"]
+        P = F @ state["P"] @ F.T + Q
+
+        # gate the measurement on its normalized innovation
+        innovation = volume - x[0]
+        S = P[0, 0] + self.measurement_noise ** 2
+        nis = innovation ** 2 / S
+        confidence = math.exp(-0.5 * nis)
+
+        if nis > self.gate ** 2:
+            state["rejections"] += 1
+            if state["rejections"] > self.max_rejections:
+                print(f"Level of {key} moved to {volume:.1f} uL, restarting its track")
+                self.start(key, volume, height, timestamp)
+                return self.output(key, volume, timestamp, confidence, False, full_scan)
+            state["x"], state["P"], state["timestamp"] = x, P, timestamp
+            return self.output(key, volume, timestamp, confidence, True, full_scan)
+
+        # correct
+        K = P[:, 0] / S
+        state["x"] = x + K * innovation
+        state["P"] = P - np.outer(K, P[0, :])
+        state["height"] = height
+        state["timestamp"] = timestamp
+        state["rejections"] = 0
+        return self.output(key, volume, timestamp, confidence, False, full_scan)
+
+    def output(self, key, raw_volume, timestamp, confidence, rejected, full_scan):
+        volume, rate = self.tubes[key]["x"]
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = deque(maxlen=self.history)
+        series.append((timestamp, float(volume)))
+        return {"VOLUME": float(volume),
+                "RAW_VOLUME": float(raw_volume),
+                "RATE": float(rate),
+                "CONFIDENCE": round(confidence, 3),
+                "REJECTED": rejected,
+                "FULL_SCAN": full_scan}
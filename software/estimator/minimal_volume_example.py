@@ -12,6 +12,9 @@ print(vol)
 #img = cv2.imread(img_path)
 #obj_visu.visualization(img)
 
+#OR estimate every tube from a single decode
+#vols = obj.volume_estimation_all(img_path)  # {"LEFT": ..., "RIGHT": ...}
+
 #OR
 #obj.vol_right
 #obj.vol_left
\ No newline at end of file
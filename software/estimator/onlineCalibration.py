@@ -0,0 +1,128 @@
+import os
+import json
+import numpy as np
+
+
+class OnlineCalibration:
+    """
+    Recursive least squares update of the area -> volume calibration from (area, volume) pairs.
+
+    The cone (area < ref_area) and cylinder polynomials keep their degree and ref_area;
+    each observation updates the coefficients of its regime in O(degree^2), so the
+    calibration follows tube and lighting drift without offline training runs. Areas are
+    scaled by `scale` (the largest strip area) so the regressors stay near 1.
+
+    Knobs:
+        forgetting_factor : weight of the past per observation (1 never forgets)
+        outlier_threshold : observations with a residual above this many predicted
+                            standard deviations are rejected
+        measurement_noise : standard deviation (uL) of one observation
+    The state is written to `state_path` after every accepted observation and reloaded
+    on start, as long as it was built on the same base calibration.
+    """
+    def __init__(self, calibration, scale, state_path=None, forgetting_factor=0.999, outlier_threshold=4.0,
+                 measurement_noise=50.0, prior_std=100.0):
+        self.scale = float(scale)
+        self.state_path = state_path
+        self.forgetting_factor = forgetting_factor
+        self.outlier_threshold = outlier_threshold
+        self.measurement_noise = measurement_noise
+        self.prior_std = prior_std
+
+        if state_path is not None and os.path.exists(state_path):
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+            if state.get("base_version") == self.base_of(calibration) and state.get("scale") == self.scale:
+                self.load_state(state)
+                print(f"Resumed online calibration from {state_path} ({self.observations} observations)")
+                return
+        self.rebase(calibration)
+
+    @staticmethod
+    def base_of(calibration):
+        # versions written from this module keep the version they started from
+        return calibration.get("online", {}).get("base_version", calibration.get("version"))
+
+    def rebase(self, calibration):
+        # restart from a calibration (e.g. after CALIBRATION-UPDATE)
+        self.base_version = self.base_of(calibration)
+        self.calibration = dict(calibration)
+        self.ref_area = calibration["ref_area"]
+        self.regimes = {name: self.initial_regime(calibration[name]) for name in ("cone", "cylinder")}
+        self.observations = 0
+        self.rejected = 0
+
+    def initial_regime(self, coefficients):
+        # theta_k = coefficient of area^k * scale^k, lowest power first
+        coefficients = np.asarray(coefficients, dtype=np.float64)[::-1]
+        theta = coefficients * self.scale ** np.arange(len(coefficients))
+        return {"theta": theta, "P": np.eye(len(theta)) * self.prior_std ** 2}
+
+    def regressors(self, area, length):
+        return (area / self.scale) ** np.arange(length)
+
+    def observe(self, area, volume):
+        """
+        Args:
+            'area' (float) : segmented area of the tube (pixels, fractional with sub-pixel heights)
+            'volume' (float) : volume (uL) expected in the tube from the pumps
+        Returns:
+            (accepted, residual in uL)
+        """
+        name = "cone" if area < self.ref_area else "cylinder"
+        regime = self.regimes[name]
+        theta, P = regime["theta"], regime["P"]
+        x = self.regressors(area, len(theta))
+
+        residual = volume - x @ theta
+        Px = P @ x
+        innovation_var = x @ Px + self.measurement_noise ** 2
+        if residual ** 2 > self.outlier_threshold ** 2 * innovation_var:
+            self.rejected += 1
+            return False, float(residual)
+
+        gain = Px / (self.forgetting_factor * self.measurement_noise ** 2 + x @ Px)
+        regime["theta"] = theta + gain * residual
+        regime["P"] = (P - np.outer(gain, Px)) / self.forgetting_factor
+        self.observations += 1
+        self.save_state()
+        return True, float(residual)
+
+    def get_calibration(self):
+        # current coefficients as a calibration dict for CalibrationRegistry.save / apply_calibration
+        calibration = dict(self.calibration)
+        calibration.pop("version", None)
+        calibration.pop("created", None)
+        for name, regime in self.regimes.items():
+            theta = regime["theta"]
+            calibration[name] = [float(c) for c in (theta / self.scale ** np.arange(len(theta)))[::-1]]
+        calibration["online"] = {"base_version": self.base_version,
+                                 "observations": self.observations,
+                                 "rejected": self.rejected,
+                                 "forgetting_factor": self.forgetting_factor}
+        return calibration
+
+    def state(self):
+        return {"base_version": self.base_version,
+                "calibration": self.calibration,
+                "scale": self.scale,
+                "observations": self.observations,
+                "rejected": self.rejected,
+                "regimes": {name: {"theta": regime["theta"].tolist(), "P": regime["P"].tolist()} for name, regime in self.regimes.items()}}
+
+    def load_state(self, state):
+        self.base_version = state["base_version"]
+        self.calibration = state["calibration"]
+        self.ref_area = self.calibration["ref_area"]
+        self.observations = state["observations"]
+        self.rejected = state["rejected"]
+        self.regimes = {name: {"theta": np.array(regime["theta"]), "P": np.array(regime["P"])} for name, regime in state["regimes"].items()}
+
+    def save_state(self):
+        if self.state_path is None:
+            return
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state(), f)
+        os.replace(tmp_path, self.state_path)  # a crash never leaves a partial state
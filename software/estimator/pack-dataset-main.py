@@ -0,0 +1,115 @@
+#Usage Example:
+#conda activate bgrenv
+#python3 pack-dataset-main.py --data /home/ella/NEW_TUBE/calib_2/data.txt --output /home/ella/NEW_TUBE/calib_2/packed
+#python3 pack-dataset-main.py --data data.txt --output packed --check
+#python3 pack-dataset-main.py --synthetic 200 --check
+#
+#Packs the H/M/E masks listed in an ImageProcessor data.txt into a bit-packed, memory-mapped
+#dataset folder (maskDataset.py) and reports its size next to the dense arrays of
+#ImageProcessor.load_images_and_areas_from_file. The packed masks are binary: the grey edges the
+#half-size resize leaves are rounded at 127, and their count is reported. --check also loads the
+#dense arrays, compares them thresholded at 127 with the packed batches and reports the peak
+#memory of both loaders. --synthetic writes a data.txt of masks segmented from synthetic frames
+#first. Exits with 1 when the packed dataset does not match.
+
+import os
+import sys
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import cv2
+from volumeEstimation import VolumeEstimation
+from syntheticTubes import SyntheticTubes
+from imageProcessor import ImageProcessor
+
+
+def synthetic_data_txt(obj, n_images, output_dir, seed):
+    # H (liquid below the meniscus), M (meniscus band) and E (liquid line) masks of synthetic
+    # frames, found with the estimator's own segmentation, in the data.txt format
+    generator = SyntheticTubes(obj, seed=seed)
+    os.makedirs(output_dir, exist_ok=True)
+    lines = []
+    for k in range(n_images):
+        image, truth = generator.render(generator.random_heights())
+        for side in obj.sides:
+            rect_image = obj.image_crop(image, side)
+            area, height, meniscus_area = obj.fused_segmentation(rect_image)
+            height = int(round(height))
+            rows, cols = rect_image.shape[:2]
+            masks = np.zeros((3, rows, cols), dtype=np.uint8)
+            masks[0, height:] = 255
+            masks[1, max(height - obj.meniscus_band_rows, 0):height] = 255
+            masks[2, height] = 255
+            paths = []
+            for name, mask in zip("HME", masks):
+                paths.append(os.path.join(output_dir, f"{name}-{side}-{k:04d}.png"))
+                cv2.imwrite(paths[-1], mask)
+            lines.append(",".join(paths + [str(area), str(meniscus_area), str(truth[side]["VOLUME"])]))
+    txt_path = os.path.join(output_dir, "data.txt")
+    with open(txt_path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    return txt_path
+
+
+def peak_memory(func):
+    # (result, peak MB of the numpy/python allocations made by func)
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak / 1e6
+
+
+def check(processor, data_path, dataset, batch_size):
+    dense, dense_peak = peak_memory(lambda: processor.load_images_and_areas_from_file(data_path))
+    images_H, images_M, images_E, H_areas, M_areas, volumes, image_size = dense
+
+    def read_all():
+        # what a training loop keeps: one decoded batch at a time
+        return sum(len(batch[0]) for batch in dataset.batches(batch_size))
+    _, packed_peak = peak_memory(read_all)
+
+    mismatches = 0
+    for start, batch in zip(range(0, len(dataset), batch_size), dataset.batches(batch_size)):
+        end = start + len(batch[0])
+        for dense_images, packed_images in zip((images_H, images_M, images_E), batch[:3]):
+            mismatches += int(np.count_nonzero(np.where(dense_images[start:end] > 127, 255, 0) != packed_images))
+        for dense_values, packed_values in zip((H_areas, M_areas, volumes), batch[3:]):
+            mismatches += int(np.count_nonzero(dense_values[start:end] != packed_values))
+    failed = mismatches > 0 or image_size != dataset.image_size or len(volumes) != len(dataset)
+    print(f"peak memory: dense loader {dense_peak:.1f} MB, packed batches of {batch_size} {packed_peak:.1f} MB")
+    print(f"{len(dataset)} samples, {mismatches} mismatching values" + ("  MISMATCH" if failed else ""))
+    return failed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Pack an ImageProcessor mask dataset into a bit-packed memory-mapped folder")
+    parser.add_argument('--data', type=str, default=None, help='data.txt of the masks, areas and volumes')
+    parser.add_argument('--output', type=str, default=None, help='Packed dataset folder (default: a temporary folder)')
+    parser.add_argument('--check', action='store_true', help='Compare with the dense loader and report peak memory')
+    parser.add_argument('--batch-size', type=int, default=64, help='Samples decoded at a time by --check (default: 64)')
+    parser.add_argument('--synthetic', type=int, default=0, help='Write a data.txt of this many synthetic frames first')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic frames (default: 0)')
+    args = parser.parse_args()
+
+    obj = VolumeEstimation("LEFT")
+    processor = ImageProcessor(obj)
+    workdir = tempfile.mkdtemp(prefix="mask-dataset-")
+    if args.synthetic:
+        args.data = synthetic_data_txt(obj, args.synthetic, os.path.join(workdir, "masks"), args.seed)
+    if args.data is None:
+        print("Give a --data file or --synthetic frames")
+        sys.exit(1)
+    output = args.output or os.path.join(workdir, "packed")
+
+    count = processor.pack_images_and_areas_from_file(args.data, output)
+    dataset = processor.load_packed_images_and_areas(output)
+    packed_bytes, dense_bytes = dataset.nbytes()
+    print(f"{count} samples of {dataset.image_size} masks packed to {output}: "
+          f"{packed_bytes / 1e6:.2f} MB of masks, {dense_bytes / 1e6:.2f} MB dense ({dense_bytes / max(packed_bytes, 1):.1f}x), "
+          f"{dataset.binarized_pixels} grey pixels binarized")
+
+    if args.check:
+        sys.exit(1 if check(processor, args.data, dataset, args.batch_size) else 0)
@@ -0,0 +1,78 @@
+import time
+import cv2
+
+
+class QualityGate:
+    """
+    Image quality check (blur and panel color) computed from one decoded frame.
+
+    Blur is the variance of the Laplacian of a downsampled grayscale crop around the
+    tubes, the panel color is the mean BGR value of the same square used by
+    VolumeEstimation.is_red. Both come from the same buffer, so the gate costs a few
+    milliseconds and can run on every estimate.
+    """
+    def __init__(self, volume_estimation_obj, downsample=2, margin=20):
+        self.obj = volume_estimation_obj
+        self.downsample = downsample  # integer downsampling factor of the blur region
+        self.margin = margin  # pixels around the tube strips included in the blur region
+
+        # Laplacian variance of the downsampled grayscale tube region. This is not the same
+        # scale as is_blur (full 3-channel frame) and should be tuned on a reference set.
+        self.blur_threshold = volume_estimation_obj.BLUR_THRESHOLD
+
+        # panel color square (rows, columns), same as is_red
+        self.panel_region = (1600, 1630, 650, 700)
+        self.color_threshold = 20
+
+    def tube_region(self, sides=None):
+        # (y_start, y_end, x_start, x_end) bounding box of the tube strips plus margin
+        if sides is None:
+            sides = self.obj.sides
+        rois = [self.obj.tube_roi(side) for side in sides]
+        y_start = max(min(roi[0] for roi in rois) - self.margin, 0)
+        y_end = max(roi[1] for roi in rois) + self.margin
+        x_start = max(min(roi[2] for roi in rois) - self.margin, 0)
+        x_end = max(roi[3] for roi in rois) + self.margin
+        return (y_start, y_end, x_start, x_end)
+
+    def panel_roi(self):
+        # panel square in the frame, it moves with the tubes when the ROIs are registered
+        y_start, y_end, x_start, x_end = self.panel_region
+        dy, dx = self.obj.roi_offset
+        return (y_start + dy, y_end + dy, x_start + dx, x_end + dx)
+
+    def regions(self, sides=None):
+        # regions of the frame the gate needs, in the order expected by evaluate_regions
+        return [self.tube_region(sides), self.panel_roi()]
+
+    def evaluate(self, image, sides=None):
+        tube_image, panel_image = [image[y_start:y_end, x_start:x_end] for y_start, y_end, x_start, x_end in self.regions(sides)]
+        return self.evaluate_regions(tube_image, panel_image)
+
+    def evaluate_regions(self, tube_image, panel_image):
+        """
+        Args:
+            'tube_image' (np.ndarray) : BGR crop returned for tube_region()
+            'panel_image' (np.ndarray) : BGR crop returned for panel_region
+        Returns:
+            dict with the blur measure, the mean panel color, the individual verdicts and "PASS"
+        """
+        start = time.perf_counter()
+
+        gray = cv2.cvtColor(tube_image, cv2.COLOR_BGR2GRAY)
+        if self.downsample > 1:
+            gray = cv2.resize(gray, (gray.shape[1] // self.downsample, gray.shape[0] // self.downsample), interpolation=cv2.INTER_AREA)
+        _, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_32F))
+        blur = float(std[0, 0] ** 2)
+
+        B, G, R = cv2.mean(panel_image)[:3]
+
+        is_blur = blur < self.blur_threshold
+        is_red = R > self.color_threshold and G > self.color_threshold and B > self.color_threshold
+
+        return {"BLUR": blur,
+                "IS_BLUR": bool(is_blur),
+                "COLOR": (R, G, B),
+                "IS_RED": bool(is_red),
+                "PASS": not (is_blur or is_red),
+                "TIME_MS": (time.perf_counter() - start) * 1000}
@@ -0,0 +1,109 @@
+#Usage Example:
+#conda activate bgrenv
+#python3 registration-main.py --reference reference.jpg --output registration.npz
+#python3 registration-main.py --output registration.npz --check new-frame-1.jpg new-frame-2.jpg
+#python3 registration-main.py --synthetic --shifts "0,0 1,0 2,0 3,0 0,3 5,5 15,-9 -40,60"
+#
+#Builds the ROI registration file of a camera (roiRegistration.py) from a reference image
+#whose tubes are on their ROIs, and reports the tube offset found in other frames.
+#--synthetic renders frames with known fill heights (syntheticTubes.py), moves them by
+#--shifts (rows,columns) and checks that every offset is recovered, that the volumes match
+#the unmoved frame and how long the per-frame verification takes. Exits with 1 on a miss.
+
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import cv2
+from volumeEstimation import VolumeEstimation
+from syntheticTubes import SyntheticTubes
+from tubeLayout import TubeLayout
+
+
+def shift(image, dy, dx):
+    # the camera moved by (dy, dx): the whole scene moves, the border repeats the edge
+    matrix = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(image, matrix, (image.shape[1], image.shape[0]), borderMode=cv2.BORDER_REPLICATE)
+
+
+def verification_time(registration, frame, repeats=1000):
+    # ms per verify() on the window of the current offset
+    y_start, y_end, x_start, x_end = registration.window()
+    window_image = frame[y_start:y_end, x_start:x_end]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        registration.verify(window_image)
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def synthetic_check(obj, args, settings):
+    generator = SyntheticTubes(obj, seed=args.seed)
+    reference, _ = generator.render(generator.random_heights())
+    registration = obj.enable_registration(args.output or f"{tempfile.mkdtemp(prefix='registration-')}/registration.npz", reference=reference, **settings)
+    static = VolumeEstimation("LEFT")  # fixed ROIs, estimates the unmoved frames
+    if obj.layout is not None:
+        static.apply_layout(obj.layout)
+
+    failed = False
+    print(f"{'shift':>10} {'offset':>10} {'volume error (uL)':>18}")
+    for dy, dx in [tuple(int(v) for v in pair.split(',')) for pair in args.shifts.split()]:
+        image, _ = generator.render(generator.random_heights())
+        expected = static.volume_estimation_all(image)
+        volumes = obj.volume_estimation_all(shift(image, dy, dx))
+        if any(volumes[side] is None for side in obj.sides):
+            error = None
+        else:
+            error = max(abs(float(volumes[side] - expected[side])) for side in obj.sides)
+        # drifts within tolerance are not re-registered
+        missed = max(abs(obj.roi_offset[0] - dy), abs(obj.roi_offset[1] - dx)) > registration.tolerance
+        failed = failed or missed or error is None
+        print(f"{str((dy, dx)):>10} {str(obj.roi_offset):>10} {'rejected' if error is None else f'{error:.1f}':>18}" + ("  MISSED" if missed else ""))
+
+    print(f"verification: {verification_time(registration, shift(reference, *obj.roi_offset)):.3f} ms per frame, "
+          f"{registration.registrations} registration(s)")
+    return failed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Build and check the ROI registration of a camera")
+    parser.add_argument('--reference', type=str, default=None, help='Image with the tubes exactly on their ROIs')
+    parser.add_argument('--output', type=str, default=None, help='Registration file (.npz) written from --reference or read for --check')
+    parser.add_argument('--layout', type=str, default=None, help='Tube layout JSON of the camera (default: LEFT and RIGHT tubes)')
+    parser.add_argument('--check', type=str, nargs='*', default=[], help='Frames to register against the file')
+    parser.add_argument('--tolerance', type=int, default=1, help='Drift in pixels accepted before re-registering (default: 1)')
+    parser.add_argument('--search-margin', type=int, default=120, help='Largest camera move in pixels that can be recovered (default: 120)')
+    parser.add_argument('--synthetic', action='store_true', help='Check the registration on moved synthetic frames')
+    parser.add_argument('--shifts', type=str, default="0,0 1,0 2,0 3,0 0,3 5,5 15,-9 -40,60 2,2",
+                        help='Camera moves "rows,columns ..." of the --synthetic frames (default: "0,0 1,0 2,0 3,0 0,3 5,5 15,-9 -40,60 2,2")')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic frames (default: 0)')
+    args = parser.parse_args()
+
+    obj = VolumeEstimation("LEFT")
+    obj.check_quality = True
+    if args.layout is not None:
+        obj.apply_layout(TubeLayout.load(args.layout))
+    settings = {"tolerance": args.tolerance, "search_margin": args.search_margin}
+
+    if args.synthetic:
+        sys.exit(1 if synthetic_check(obj, args, settings) else 0)
+
+    registration = obj.enable_registration(args.output, reference=args.reference, **settings)
+    if registration is None:
+        print("Give a --reference image or an existing --output file")
+        sys.exit(1)
+    if args.reference is not None:
+        print(f"Reference saved to {args.output}, verification patch at {registration.patch_origin}")
+
+    failed = False
+    for path in args.check:
+        frame = obj.read_image(path)
+        y_start, y_end, x_start, x_end = registration.window()
+        if registration.verify(frame[y_start:y_end, x_start:x_end]):
+            print(f"{path}: tubes within {registration.tolerance} px of offset {obj.roi_offset} (correlation {registration.correlation:.2f})")
+        elif registration.register(frame):
+            print(f"{path}: tubes moved to offset {obj.roi_offset} (correlation {registration.correlation:.2f})")
+        else:
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,69 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of estimate results with a time-to-live.
+
+    Keys are (S3 path, INDEX, calibration version): the camera never overwrites an
+    image object, so a repeated request for the same path, tube and calibration has
+    the same answer. Entries older than `ttl` seconds are dropped on lookup, the least
+    recently used one is evicted when the cache is full. Safe to share between the
+    MQTT callback and the pool completion callbacks.
+    """
+    def __init__(self, max_entries=256, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (stored_at, result)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(s3_path, index, calibration_version):
+        return (s3_path, index, str(calibration_version))
+
+    def get(self, key):
+        # cached result or None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"SIZE": len(self.entries),
+                    "MAX_ENTRIES": self.max_entries,
+                    "TTL": self.ttl,
+                    "HITS": self.hits,
+                    "MISSES": self.misses,
+                    "HIT_RATE": round(self.hits / lookups, 3) if lookups else 0.0,
+                    "EVICTIONS": self.evictions,
+                    "EXPIRATIONS": self.expirations}
@@ -0,0 +1,104 @@
+import cv2
+import numpy as np
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, tjMCUWidth, tjMCUHeight
+except ImportError:
+    TurboJPEG = None
+
+
+class RoiDecoder:
+    """
+    Decodes only the parts of a JPEG frame that cover a list of regions of interest.
+
+    Each region is cropped losslessly from the JPEG bitstream along MCU boundaries
+    (libjpeg-turbo through PyTurboJPEG) and only the cropped MCUs are decoded.
+    When PyTurboJPEG or libturbojpeg is not available, or the file is not a JPEG,
+    the whole frame is decoded with OpenCV and the regions are sliced from it.
+    """
+    def __init__(self, margin=16):
+        # extra pixels decoded around each region so that chroma upsampling at the
+        # crop border gives the same pixels as a full decode
+        self.margin = margin
+        self.jpeg = self.load_turbojpeg()
+
+    @staticmethod
+    def load_turbojpeg():
+        if TurboJPEG is None:
+            return None
+        try:
+            return TurboJPEG()
+        except (OSError, RuntimeError):
+            # python wrapper installed but the shared library is missing
+            return None
+
+    def __getstate__(self):
+        # the libturbojpeg handle cannot be pickled, reload it in the new process
+        state = self.__dict__.copy()
+        state['jpeg'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.jpeg = self.load_turbojpeg()
+
+    def decode_regions(self, image_source, regions):
+        """
+        Args:
+            'image_source' (str, bytes or np.ndarray) : image path, encoded image bytes or an already decoded frame
+            'regions' (list) : (y_start, y_end, x_start, x_end) tuples in full-frame pixel coordinates
+        Returns:
+            list of BGR arrays, one per region
+        """
+        if isinstance(image_source, np.ndarray):
+            return self.slice_regions(image_source, regions)
+
+        if self.jpeg is None:
+            return self.slice_regions(self.decode_full(image_source), regions)
+
+        if isinstance(image_source, str):
+            with open(image_source, 'rb') as f:
+                jpeg_buf = f.read()
+        else:
+            jpeg_buf = image_source
+
+        if jpeg_buf[:2] == b'\xff\xd8':  # JPEG SOI marker
+            try:
+                return self.decode_jpeg_regions(jpeg_buf, regions)
+            except (OSError, ValueError) as e:
+                print(f"Partial decode failed ({e}), decoding full frame")
+
+        return self.slice_regions(self.decode_full(jpeg_buf), regions)
+
+    def decode_jpeg_regions(self, jpeg_buf, regions):
+        width, height, jpeg_subsample, _ = self.jpeg.decode_header(jpeg_buf)
+        mcu_width = tjMCUWidth[jpeg_subsample]
+        mcu_height = tjMCUHeight[jpeg_subsample]
+
+        decoded = []
+        for y_start, y_end, x_start, x_end in regions:
+            # crop origin must sit on an MCU boundary
+            x0 = (max(x_start - self.margin, 0) // mcu_width) * mcu_width
+            y0 = (max(y_start - self.margin, 0) // mcu_height) * mcu_height
+            x1 = min(x_end + self.margin, width)
+            y1 = min(y_end + self.margin, height)
+
+            cropped = self.jpeg.crop(jpeg_buf, x0, y0, x1 - x0, y1 - y0)
+            region = self.jpeg.decode(cropped, pixel_format=TJPF_BGR)
+            decoded.append(region[y_start - y0:y_end - y0, x_start - x0:x_end - x0])
+
+        return decoded
+
+    @staticmethod
+    def decode_full(image_source):
+        if isinstance(image_source, str):
+            image = cv2.imread(image_source)
+        else:
+            image = cv2.imdecode(np.frombuffer(image_source, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Could not decode image")
+        return image
+
+    @staticmethod
+    def slice_regions(image, regions):
+        return [image[y_start:y_end, x_start:x_end] for y_start, y_end, x_start, x_end in regions]
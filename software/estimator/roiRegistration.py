@@ -0,0 +1,195 @@
+import os
+import time
+import tempfile
+import cv2
+import numpy as np
+
+
+class RoiRegistration:
+    """
+    Keeps the tube ROIs of VolumeEstimation on the tubes when the camera holder moves.
+
+    A reference frame, taken when the ROIs were measured, gives two templates: the
+    downsampled grayscale region around the tubes (`context` pixels beyond them), and the
+    most textured `patch_size` square of it at full resolution. The tube strips themselves
+    (plus `strip_margin` columns) change with the fill level, so they are masked out of
+    the first template and the patch is taken outside them. `register` matches the first one on a downsampled
+    frame (search_margin pixels around the expected place), refines the offset with the
+    patch at full resolution and stores it in VolumeEstimation.roi_offset. `verify` only
+    correlates the patch inside a window of tolerance + 1 pixels around its expected
+    place, a few microseconds, so it can run on every frame; the frame is re-registered
+    when the correlation peak is weak or more than tolerance pixels from that place.
+
+    The templates and the last offset are kept in `cache_path` (.npz), so a new session
+    starts from the last registration.
+    """
+    def __init__(self, volume_estimation_obj, cache_path=None, downsample=4, search_margin=120, patch_size=32,
+                 tolerance=1, min_correlation=0.7, context=100, strip_margin=8):
+        self.obj = volume_estimation_obj
+        self.cache_path = cache_path
+        self.downsample = downsample
+        self.search_margin = search_margin  # largest camera move (pixels) register can recover
+        self.patch_size = patch_size
+        self.tolerance = tolerance  # drift (pixels) accepted before re-registering
+        self.min_correlation = min_correlation
+        self.context = context
+        self.strip_margin = strip_margin
+
+        self.reference = None  # downsampled grayscale region around the tubes
+        self.reference_mask = None  # 0 on the tube strips
+        self.reference_origin = None  # (y, x) of the region in the reference frame
+        self.patch = None  # full resolution verification patch
+        self.patch_origin = None  # (y, x) of the patch in the reference frame
+
+        self.registrations = 0
+        self.verifications = 0
+        self.correlation = None  # last verification or registration peak
+
+        if cache_path is not None and os.path.exists(cache_path):
+            self.load(cache_path)
+
+    @staticmethod
+    def gray(frame):
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+    def set_reference(self, frame):
+        # frame in which the tubes are exactly where the ROIs say (offset 0)
+        self.obj.roi_offset = (0, 0)
+        gray = self.gray(frame)
+        rois = [self.obj.tube_roi(side) for side in self.obj.sides]
+        y_start = max(min(roi[0] for roi in rois) - self.context, 0)
+        y_end = min(max(roi[1] for roi in rois) + self.context, gray.shape[0])
+        x_start = max(min(roi[2] for roi in rois) - self.context, 0)
+        x_end = min(max(roi[3] for roi in rois) + self.context, gray.shape[1])
+        region = gray[y_start:y_end, x_start:x_end]
+
+        mask = np.full(region.shape, 255, dtype=np.uint8)
+        for y0, y1, x0, x1 in rois:
+            mask[max(y0 - y_start, 0):y1 - y_start, max(x0 - x_start - self.strip_margin, 0):x1 - x_start + self.strip_margin] = 0
+
+        size = (region.shape[1] // self.downsample, region.shape[0] // self.downsample)
+        self.reference = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+        self.reference_mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+        self.reference_origin = (y_start, x_start)
+
+        # most textured square of the static part of the region (largest gradient energy), e.g. a tube wall end
+        gradient = cv2.magnitude(cv2.Sobel(region, cv2.CV_32F, 1, 0), cv2.Sobel(region, cv2.CV_32F, 0, 1))
+        energy = cv2.boxFilter(gradient, -1, (self.patch_size, self.patch_size), normalize=False, anchor=(0, 0))
+        masked = cv2.boxFilter((mask == 0).astype(np.float32), -1, (self.patch_size, self.patch_size), normalize=False, anchor=(0, 0))
+        energy[masked > 0] = 0
+        half_margin = self.verify_margin()  # the verification window must stay inside the region
+        energy = energy[half_margin:region.shape[0] - self.patch_size - half_margin, half_margin:region.shape[1] - self.patch_size - half_margin]
+        y, x = np.unravel_index(np.argmax(energy), energy.shape)
+        y, x = y + half_margin, x + half_margin
+        self.patch = region[y:y + self.patch_size, x:x + self.patch_size].copy()
+        self.patch_origin = (int(y_start + y), int(x_start + x))
+        self.save()
+
+    def verify_margin(self):
+        # pixels searched around the expected patch: one more than tolerance, so a larger drift
+        # shows as a peak beyond tolerance instead of a good match at the window edge
+        return self.tolerance + 1
+
+    def window(self):
+        # (y_start, y_end, x_start, x_end) of the frame searched by verify, at the current offset
+        dy, dx = self.obj.roi_offset
+        y, x = self.patch_origin[0] + dy, self.patch_origin[1] + dx
+        margin = self.verify_margin()
+        return (max(y - margin, 0), y + self.patch_size + margin,
+                max(x - margin, 0), x + self.patch_size + margin)
+
+    def verify(self, window_image):
+        """
+        Args:
+            'window_image' (np.ndarray) : the frame cropped to window()
+        Returns:
+            True when the patch is found within tolerance of where the current offset puts it,
+            False when it is not, or when the window is cut by the frame edge and the drift
+            cannot be told
+        """
+        self.verifications += 1
+        window_image = self.gray(window_image)
+        y_start, _, x_start, _ = self.window()
+        margin = self.verify_margin()
+        # the patch's place in the window at the current offset
+        expected_y = self.patch_origin[0] + self.obj.roi_offset[0] - y_start
+        expected_x = self.patch_origin[1] + self.obj.roi_offset[1] - x_start
+        if expected_y < margin or expected_x < margin or \
+           window_image.shape[0] < expected_y + self.patch_size + margin or window_image.shape[1] < expected_x + self.patch_size + margin:
+            return False
+        scores = cv2.matchTemplate(window_image, self.patch, cv2.TM_CCOEFF_NORMED)
+        _, correlation, _, (x, y) = cv2.minMaxLoc(scores)
+        self.correlation = float(correlation)
+        drift = max(abs(y - expected_y), abs(x - expected_x))
+        return self.correlation >= self.min_correlation and drift <= self.tolerance
+
+    def register(self, frame):
+        # Locates the tubes in a full frame and updates VolumeEstimation.roi_offset. Returns
+        # False (offset unchanged) when the reference cannot be found within search_margin
+        start = time.perf_counter()
+        gray = self.gray(frame)
+        ds = self.downsample
+
+        # coarse: downsampled reference over the downsampled neighbourhood of its reference place
+        y0 = max(self.reference_origin[0] - self.search_margin, 0)
+        x0 = max(self.reference_origin[1] - self.search_margin, 0)
+        y1 = min(self.reference_origin[0] + self.reference.shape[0] * ds + self.search_margin, gray.shape[0])
+        x1 = min(self.reference_origin[1] + self.reference.shape[1] * ds + self.search_margin, gray.shape[1])
+        search = cv2.resize(gray[y0:y1, x0:x1], ((x1 - x0) // ds, (y1 - y0) // ds), interpolation=cv2.INTER_AREA)
+        if search.shape[0] < self.reference.shape[0] or search.shape[1] < self.reference.shape[1]:
+            print("ROI registration: search region outside the frame")
+            return False
+        scores = cv2.matchTemplate(search, self.reference, cv2.TM_CCOEFF_NORMED, mask=self.reference_mask)
+        _, coarse_score, _, (x, y) = cv2.minMaxLoc(np.nan_to_num(scores, nan=-1.0, posinf=-1.0, neginf=-1.0))
+        dy = y0 + y * ds - self.reference_origin[0]
+        dx = x0 + x * ds - self.reference_origin[1]
+
+        # fine: full resolution patch within one downsampled pixel of the coarse offset
+        py, px = self.patch_origin[0] + dy, self.patch_origin[1] + dx
+        fy0, fx0 = max(py - ds, 0), max(px - ds, 0)
+        fine = gray[fy0:py + self.patch_size + ds, fx0:px + self.patch_size + ds]
+        self.correlation = float(coarse_score)
+        if fine.shape[0] >= self.patch_size and fine.shape[1] >= self.patch_size:
+            scores = cv2.matchTemplate(fine, self.patch, cv2.TM_CCOEFF_NORMED)
+            _, fine_score, _, (x, y) = cv2.minMaxLoc(scores)
+            dy, dx = fy0 + y - self.patch_origin[0], fx0 + x - self.patch_origin[1]
+            self.correlation = min(self.correlation, float(fine_score))
+        else:
+            self.correlation = -1.0  # patch outside the frame
+
+        if self.correlation < self.min_correlation:
+            print(f"ROI registration failed (correlation {self.correlation:.2f}), keeping offset {self.obj.roi_offset}")
+            return False
+
+        self.obj.roi_offset = (int(dy), int(dx))
+        self.registrations += 1
+        print(f"ROI registration: tubes offset by {self.obj.roi_offset} pixels ({(time.perf_counter() - start) * 1000:.1f} ms)")
+        self.save()
+        return True
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        cache_dir = os.path.dirname(self.cache_path) or '.'
+        os.makedirs(cache_dir, exist_ok=True)
+        # a temporary file of this process: several workers may save at once
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as f:
+            np.savez(f, reference=self.reference, reference_mask=self.reference_mask, reference_origin=self.reference_origin, patch=self.patch,
+                     patch_origin=self.patch_origin, offset=self.obj.roi_offset, downsample=self.downsample)
+        os.replace(f.name, self.cache_path)  # workers sharing the file never read a partial one
+
+    def load(self, cache_path):
+        with np.load(cache_path) as cache:
+            self.reference = cache["reference"]
+            self.reference_mask = cache["reference_mask"]
+            self.reference_origin = tuple(int(v) for v in cache["reference_origin"])
+            self.patch = cache["patch"]
+            self.patch_origin = tuple(int(v) for v in cache["patch_origin"])
+            self.downsample = int(cache["downsample"])
+            self.obj.roi_offset = tuple(int(v) for v in cache["offset"])
+
+    def stats(self):
+        return {"OFFSET": list(self.obj.roi_offset),
+                "REGISTRATIONS": self.registrations,
+                "VERIFICATIONS": self.verifications,
+                "CORRELATION": self.correlation}
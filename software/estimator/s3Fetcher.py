@@ -0,0 +1,62 @@
+import os
+import cv2
+import numpy as np
+
+try:
+    import boto3
+    from botocore.config import Config
+except ImportError:
+    boto3 = None
+
+DEFAULT_ENDPOINT = "https://s3-west.nrp-nautilus.io"
+
+
+class S3Fetcher:
+    """
+    Reads S3 objects straight into memory through one pooled boto3 client.
+
+    The client (and its keep-alive connections) is created on first use in the process
+    that uses it, so a fetcher can be handed to pool workers. Credentials are read the
+    same way as the aws CLI. The endpoint can point at a local S3 stand-in for tests.
+    """
+    def __init__(self, endpoint_url=None, max_pool_connections=10):
+        self.endpoint_url = endpoint_url or os.environ.get("ESTIMATOR_S3_ENDPOINT", DEFAULT_ENDPOINT)
+        self.max_pool_connections = max_pool_connections
+        self.client = None
+
+    def __getstate__(self):
+        # boto3 clients cannot be pickled, every process opens its own
+        state = self.__dict__.copy()
+        state['client'] = None
+        return state
+
+    def get_client(self):
+        if self.client is None:
+            if boto3 is None:
+                raise ImportError("boto3 is required to fetch images from S3")
+            self.client = boto3.session.Session().client("s3", endpoint_url=self.endpoint_url,
+                                                         config=Config(max_pool_connections=self.max_pool_connections))
+        return self.client
+
+    @staticmethod
+    def parse_s3_path(s3_path):
+        # "s3://bucket/key/to/object.jpg" -> ("bucket", "key/to/object.jpg")
+        if not s3_path.startswith("s3://"):
+            raise ValueError(f"Invalid S3 path: {s3_path}")
+        bucket, _, key = s3_path[len("s3://"):].partition("/")
+        if not bucket or not key:
+            raise ValueError(f"Invalid S3 path: {s3_path}")
+        return bucket, key
+
+    def fetch(self, s3_path):
+        # encoded object bytes
+        bucket, key = self.parse_s3_path(s3_path)
+        response = self.get_client().get_object(Bucket=bucket, Key=key)
+        return response["Body"].read()
+
+    def fetch_image(self, s3_path):
+        # decoded BGR frame
+        image = cv2.imdecode(np.frombuffer(self.fetch(s3_path), dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Could not decode image: {s3_path}")
+        return image
@@ -0,0 +1,40 @@
+#Usage Example:
+#conda activate bgrenv
+#python3 segmentation-check-main.py --dataset /home/ella/NEW_TUBE/calib_2
+#
+#Regression check of the fused segmentation on the images of a dataset: on every tube strip,
+#fused_segmentation must give the same area and meniscus height as the reference path
+#(image_segmentation, i.e. HUE_filter, get_meniscus_height and meniscus_segmentation), and the
+#batched stack_segmentation of the frame the same as fused_segmentation. The same check on
+#synthetic frames is tests/test_segmentation.py (python -m pytest tests).
+#Exits with 1 on any mismatch.
+
+import os
+import sys
+import argparse
+from volumeEstimation import VolumeEstimation
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Check that the fused segmentation matches the reference segmentation")
+    parser.add_argument('--dataset', type=str, required=True, help='Folder of the images to check')
+    args = parser.parse_args()
+
+    obj = VolumeEstimation("LEFT")
+    mismatches = 0
+    tubes = 0
+    for image_file in sorted(os.listdir(args.dataset)):
+        if not image_file.endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        strips = obj.read_tube_strips(os.path.join(args.dataset, image_file))
+        tubes += len(strips)
+        mismatches += len(obj.compare_strip_segmentation(image_file, strips))
+        for side, batched in obj.segment_strips(strips).items():
+            fused = obj.fused_segmentation(strips[side])
+            if tuple(batched) != tuple(fused):
+                mismatches += 1
+                print(f"Mismatch {image_file} {side}: fused {fused}, stack {tuple(batched)}")
+
+    print(f"{mismatches} mismatches in {tubes} tubes")
+    sys.exit(1 if mismatches or not tubes else 0)
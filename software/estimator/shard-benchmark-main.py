@@ -0,0 +1,151 @@
+#Usage Example:
+#conda activate bgrenv
+#python3 shard-benchmark-main.py --consumers 1 2 4 --chips 8 --requests-per-chip 6 --fetch-latency 0.1
+#python3 shard-benchmark-main.py --consumers 1 2 4 --shared-group estimators
+#python3 shard-benchmark-main.py --consumers 1 2 --chip-ids M1001 M1002 M1003 M1004
+#
+#Runs 1..N estimator consumers (EstimatorService + ConsumerShard) behind an in-process broker
+#stand-in (localBroker.py), publishes a burst of estimate requests for several chips and reports
+#the throughput, the speedup over one consumer and whether every chip got its results in order.
+#Images are synthetic frames read from disk after --fetch-latency seconds, which stands in for
+#the S3 round trip. CPU-bound scaling needs as many cores as consumers x workers.
+#By default the chip ids are picked so that CHIP_ID hashing gives every consumer the same number
+#of chips; --chip-ids uses the given ids instead, and the speedup then follows their skew
+#(chips per shard), since the busiest consumer finishes last.
+#Exits with 1 when a chip received its results out of order.
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from volumeEstimation import VolumeEstimation
+from syntheticTubes import SyntheticTubes
+from calibrationRegistry import CalibrationRegistry
+from estimatorService import EstimatorService, warm_up
+from consumerShard import ConsumerShard
+from localBroker import LocalBroker
+
+REQUEST_TOPIC = "telemetry/+/log/estimator/+/REQUEST"
+
+
+class LocalFetcher:
+    # stands in for S3Fetcher in the workers: reads the image from disk after the emulated S3 round trip
+    def __init__(self, latency):
+        self.latency = latency
+
+    def fetch(self, path):
+        time.sleep(self.latency)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def balanced_chips(count, consumer_counts):
+    # chip ids whose k-th id lands on shard k % n for every consumer count n, so each run of the
+    # benchmark splits the chips evenly (plain "chip-0".."chip-3" all hash to one of 2 shards)
+    chips = []
+    candidate = 0
+    while len(chips) < count:
+        chip = f"chip-{candidate}"
+        candidate += 1
+        if all(ConsumerShard.shard_of(chip, n) == len(chips) % n for n in consumer_counts):
+            chips.append(chip)
+    return chips
+
+
+def run(consumers, paths, chips, args):
+    broker = LocalBroker()
+    services = []
+    for index in range(consumers):
+        service = EstimatorService(broker, CalibrationRegistry(os.path.join(args.workdir, "calibrations")), max_workers=args.workers,
+                                   max_queue=len(paths), cache_size=0, fetcher=LocalFetcher(args.fetch_latency))
+        shard = ConsumerShard(0 if args.shared_group else index, 1 if args.shared_group else consumers, args.shared_group)
+        shard.subscribe(broker, REQUEST_TOPIC, service.handle_estimate)
+        services.append(service)
+    for service in services:
+        for future in [service.pool.submit(warm_up) for _ in range(args.workers)]:
+            future.result()
+
+    received = {chip: [] for chip in chips}
+    errors = []
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def record(topic, message):
+        with lock:
+            if message["COMMAND"] == "FEEDBACK-REQUEST":
+                received[message["CHIP_ID"]].append(paths.index(message["IMAGE"]))
+            else:
+                errors.append(message)
+            if sum(map(len, received.values())) + len(errors) == len(paths):
+                done.set()
+
+    broker.subscribe_message(topic="telemetry/+/log/benchmark/FEEDBACK/REQUEST", callback=record)
+    broker.subscribe_message(topic="telemetry/+/log/estimator/ESTIMATE/ERROR", callback=record)
+    broker.subscribe_message(topic="telemetry/+/log/estimator/ESTIMATE/OUTOFBOUNDS", callback=record)
+    broker.subscribe_message(topic="telemetry/+/log/estimator/ESTIMATE/OVERLOAD", callback=record)
+
+    start = time.perf_counter()
+    for k, path in enumerate(paths):
+        broker.publish_message(topic="telemetry/benchmark/log/estimator/ESTIMATE/REQUEST",
+                               message={"COMMAND": "ESTIMATE-REQUEST", "TYPE": ["volume"], "INDEX": "LEFT",
+                                        "CHIP_ID": chips[k % len(chips)], "UUID": "benchmark",
+                                        "FOR": "benchmark", "FROM": "benchmark", "PICTURE": {"VOL": [path]}})
+    finished = done.wait(timeout=args.timeout)
+    elapsed = time.perf_counter() - start
+
+    for service in services:
+        service.pool.shutdown()
+
+    out_of_order = [chip for chip, order in received.items() if order != sorted(order)]
+    return {"CONSUMERS": consumers,
+            "COMPLETED": finished,
+            "SECONDS": elapsed,
+            "THROUGHPUT": len(paths) / elapsed,
+            "ERRORS": len(errors),
+            "OUT_OF_ORDER_CHIPS": out_of_order,
+            # chips per consumer, the broker decides in shared mode
+            "SHARD_LOAD": None if args.shared_group else [sum(1 for chip in chips if ConsumerShard.shard_of(chip, consumers) == index) for index in range(consumers)]}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Throughput of sharded estimator consumers behind a local broker stand-in")
+    parser.add_argument('--consumers', type=int, nargs='+', default=[1, 2, 4], help='Consumer counts to compare (default: 1 2 4)')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes per consumer (default: 1)')
+    parser.add_argument('--chips', type=int, default=8, help='Number of chips publishing requests (default: 8)')
+    parser.add_argument('--chip-ids', type=str, nargs='+', default=None, help='Chip ids to publish as, instead of --chips ids balanced over the shards')
+    parser.add_argument('--requests-per-chip', type=int, default=6, help='Requests published per chip (default: 6)')
+    parser.add_argument('--fetch-latency', type=float, default=0.1, help='Seconds of emulated S3 round trip per image (default: 0.1)')
+    parser.add_argument('--shared-group', type=str, default=None, help='Split through a $share subscription group instead of CHIP_ID hashing')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds to wait for all results of one run (default: 300)')
+    parser.add_argument('--json', type=str, default=None, help='Write the results to this file')
+    args = parser.parse_args()
+
+    args.workdir = tempfile.mkdtemp(prefix="shard-benchmark-")
+    chips = args.chip_ids or balanced_chips(args.chips, args.consumers)
+    args.chips = len(chips)
+    generator = SyntheticTubes(VolumeEstimation("LEFT"), seed=0)
+    paths = generator.save_dataset(os.path.join(args.workdir, "frames"), args.chips * args.requests_per_chip)
+
+    results = [run(consumers, paths, chips, args) for consumers in args.consumers]
+
+    print(f"{len(paths)} requests from {args.chips} chips, {args.workers} worker(s) per consumer, "
+          f"{args.fetch_latency * 1000:.0f} ms fetch, {os.cpu_count()} CPU(s), "
+          f"{'shared group ' + args.shared_group if args.shared_group else 'CHIP_ID hashing'}")
+    print(f"{'consumers':>9} {'req/s':>8} {'speedup':>8} {'efficiency':>10} {'errors':>6}  chips per shard / out of order")
+    base = results[0]["THROUGHPUT"] / results[0]["CONSUMERS"]
+    for result in results:
+        speedup = result["THROUGHPUT"] / base
+        result["SPEEDUP"] = speedup
+        print(f"{result['CONSUMERS']:>9} {result['THROUGHPUT']:>8.2f} {speedup:>8.2f} {speedup / result['CONSUMERS']:>10.0%} {result['ERRORS']:>6}  "
+              f"{result['SHARD_LOAD'] or 'broker'} / {result['OUT_OF_ORDER_CHIPS'] or 'none'}" + ("" if result["COMPLETED"] else "  (timed out)"))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if any(result["OUT_OF_ORDER_CHIPS"] or not result["COMPLETED"] for result in results):
+        sys.exit(1)
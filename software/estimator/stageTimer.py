@@ -0,0 +1,61 @@
+import time
+import contextlib
+from collections import deque
+import numpy as np
+
+
+class StageTimer:
+    """
+    Monotonic per-stage timings over a rolling window.
+
+    Every stage keeps its last `window` durations (ms), from which percentiles are
+    computed on demand. `last` holds the breakdown of the current/latest run and is
+    cleared by begin(). Recording a stage costs a couple of perf_counter calls.
+    """
+    def __init__(self, window=1000):
+        self.window = window
+        self.samples = {}  # stage -> deque of durations in ms
+        self.last = {}  # stage -> duration in ms of the latest run
+
+    def begin(self):
+        self.last = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def record(self, name, duration_ms):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+        samples.append(duration_ms)
+        # stages hit several times in one run (one per tube) add up
+        self.last[name] = self.last.get(name, 0.0) + duration_ms
+
+    def record_many(self, durations):
+        # merge a breakdown measured elsewhere (e.g. in a pool worker)
+        for name, duration_ms in durations.items():
+            self.record(name, duration_ms)
+
+    def breakdown(self, digits=2):
+        # compact copy of `last` for messages
+        return {name: round(duration_ms, digits) for name, duration_ms in self.last.items()}
+
+    def percentiles(self, percentiles=(50, 95, 99), digits=2):
+        stats = {}
+        for name, samples in list(self.samples.items()):
+            values = np.array(list(samples), dtype=np.float64)  # list() copies the deque atomically
+            if values.size == 0:
+                continue
+            stats[name] = {"COUNT": int(values.size), "MAX": round(float(values.max()), digits)}
+            for percentile, value in zip(percentiles, np.percentile(values, percentiles)):
+                stats[name][f"P{percentile}"] = round(float(value), digits)
+        return stats
+
+    def reset(self):
+        self.samples = {}
+        self.last = {}
@@ -0,0 +1,48 @@
+#Usage Example:
+#conda activate bgrenv
+#python3 stream-main.py path/to/timelapse/ --follow --output volumes.csv
+#python3 stream-main.py path/to/video.mp4 --every 30 --output volumes.csv
+#python3 stream-main.py path/to/timelapse/ --follow --registration registration.npz
+#python3 stream-main.py path/to/timelapse/ --follow --subpixel
+#python3 stream-main.py path/to/timelapse/ --follow --reject-on-quality
+#
+#Estimates the tube volumes of every new image (or video frame) and appends
+#timestamp, tube, volume and confidence rows to a CSV file. Frames whose tubes did not
+#change are skipped. Stop a --follow run with Ctrl+C.
+
+import argparse
+from volumeEstimation import VolumeEstimation
+from calibrationRegistry import CalibrationRegistry
+from streamEstimator import StreamEstimator
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Continuous volume estimation of a time-lapse folder or a video")
+    parser.add_argument('source', type=str, help='Image folder, video file, stream URL or camera index')
+    parser.add_argument('--output', type=str, default='volumes.csv', help='CSV file the rows are appended to (default: volumes.csv)')
+    parser.add_argument('--follow', action='store_true', help='Keep watching the folder for new images')
+    parser.add_argument('--every', type=int, default=1, help='Only estimate every n-th video frame (default: 1)')
+    parser.add_argument('--diff-threshold', type=float, default=8.0, help='Largest row change of the tubes (8-bit levels) below which a frame is skipped (default: 8)')
+    parser.add_argument('--no-tracking', action='store_true', help='Report raw per-frame volumes instead of tracked ones')
+    parser.add_argument('--reject-on-quality', action='store_true', help='Reject blurry frames and a wrong panel color (default: no check, the blur threshold is not tuned on real frames)')
+    parser.add_argument('--calibration-dir', type=str, default=None, help='Use the latest calibration file of this folder')
+    parser.add_argument('--registration', type=str, default=None, help='ROI registration file (registration-main.py), the tube ROIs then follow camera moves')
+    parser.add_argument('--registration-reference', type=str, default=None, help='Image with the tubes on their ROIs, (re)builds the --registration file')
+    parser.add_argument('--subpixel', action='store_true', help='Interpolate fractional meniscus heights, areas and volumes')
+    args = parser.parse_args()
+
+    obj = VolumeEstimation("LEFT")
+    obj.check_quality = args.reject_on_quality
+    obj.subpixel_meniscus = args.subpixel
+    if args.calibration_dir is not None:
+        calibration = CalibrationRegistry(args.calibration_dir).load()
+        if calibration is not None:
+            obj.apply_calibration(calibration)
+            print(f"Using calibration version {calibration['version']}")
+
+    if args.registration is not None or args.registration_reference is not None:
+        obj.enable_registration(args.registration, reference=args.registration_reference)
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    stream = StreamEstimator(obj, diff_threshold=args.diff_threshold, tracking=not args.no_tracking)
+    stream.run(source, args.output, follow=args.follow, every=args.every)
@@ -0,0 +1,151 @@
+import os
+import csv
+import time
+import cv2
+import numpy as np
+
+
+class StreamEstimator:
+    """
+    Continuous volume estimation over a growing image folder or a video.
+
+    Frames flow through generators (source -> estimates -> CSV), so nothing is kept
+    besides the previous tube strips and the tracker state. A frame is skipped when no
+    row of its tube strips differs from the last estimated frame by more than
+    `diff_threshold` (row mean of the absolute difference, in 8-bit levels), so a
+    meniscus moving by a single row still counts as a change. With tracking, volumes
+    are smoothed per tube by the VolumeEstimation tracker and the confidence comes from
+    it; otherwise the confidence is 1 for every frame that passes the quality check.
+    """
+    def __init__(self, volume_estimation_obj, diff_threshold=8.0, tracking=True):
+        self.obj = volume_estimation_obj
+        self.diff_threshold = diff_threshold
+        if tracking and self.obj.tracker is None:
+            self.obj.enable_tracking()
+        self.tracking = tracking
+
+        self.last_strips = None
+        self.frames = 0
+        self.skipped = 0
+        self.rejected = 0
+
+    def directory_frames(self, dataset_path, follow=False, poll_interval=1.0, settle_time=1.0):
+        # (timestamp, path) of every image in modification order. With follow, keeps polling
+        # for new images; files modified less than settle_time ago may still be written.
+        seen = set()
+        while True:
+            now = time.time()
+            new_files = []
+            for entry in os.scandir(dataset_path):
+                if entry.name in seen or not entry.name.endswith(('.jpg', '.jpeg', '.png')):
+                    continue
+                mtime = entry.stat().st_mtime
+                if follow and now - mtime < settle_time:
+                    continue
+                new_files.append((mtime, entry.path))
+                seen.add(entry.name)
+
+            yield from sorted(new_files)
+
+            if not follow:
+                return
+            time.sleep(poll_interval)
+
+    def video_frames(self, source, every=1):
+        # (timestamp, frame) of every `every`-th frame of a video file, stream URL or camera index.
+        # Files are timestamped by their position, live sources by the wall clock.
+        is_file = isinstance(source, str) and os.path.isfile(source)
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video source: {source}")
+        try:
+            index = 0
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                if index % every == 0:
+                    timestamp = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000 if is_file else time.time()
+                    yield timestamp, frame
+                index += 1
+        finally:
+            capture.release()
+
+    def changed(self, strips):
+        # True when a row of any tube strip changed more than diff_threshold since the last estimated frame
+        if self.last_strips is None:
+            return True
+        for side, strip in strips.items():
+            last_strip = self.last_strips.get(side)
+            if last_strip is None or last_strip.shape != strip.shape:
+                return True
+            if np.mean(cv2.absdiff(strip, last_strip), axis=(1, 2)).max() > self.diff_threshold:
+                return True
+        return False
+
+    def estimates(self, frames):
+        """
+        Args:
+            'frames' (iterable) : (timestamp, frame) pairs, frame being an image path, encoded bytes or a
+                                  BGR array, as yielded by directory_frames and video_frames
+        Yields:
+            dict with "TIMESTAMP", "TUBE", "VOLUME" (uL) and "CONFIDENCE" per tube and estimated frame
+        """
+        for timestamp, frame in frames:
+            self.frames += 1
+            try:
+                strips = self.obj.read_checked_tube_strips(frame)
+            except ValueError as e:
+                print(f"Skipping frame at {timestamp}: {e}")
+                self.rejected += 1
+                continue
+
+            if self.obj.check_quality and self.obj.reject_on_quality and not self.obj.quality["PASS"]:
+                self.rejected += 1
+                continue
+            if not self.changed(strips):
+                self.skipped += 1
+                continue
+            # copies, video frames are reused by the capture
+            self.last_strips = {side: strip.copy() for side, strip in strips.items()}
+
+            for side in self.obj.sides:
+                if self.tracking:
+                    self.obj.height_hints = {side: self.obj.tracker.height_hint(side)}
+                    volume = self.obj.volume_from_rect_image(strips[side], side)
+                    tracked = self.obj.tracker.update(side, volume, self.obj.height, timestamp, self.obj.full_scan)
+                    volume, confidence = tracked["VOLUME"], tracked["CONFIDENCE"]
+                else:
+                    volume, confidence = self.obj.volume_from_rect_image(strips[side], side), 1.0
+                yield {"TIMESTAMP": timestamp, "TUBE": side, "VOLUME": float(volume), "CONFIDENCE": confidence}
+            self.obj.height_hints = {}
+
+    def write_csv(self, rows, csv_path):
+        # Appends rows as they come (flushed, so the file can be followed) and returns how many were written
+        new_file = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+        count = 0
+        with open(csv_path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(["timestamp", "tube", "volume", "confidence"])
+            for row in rows:
+                writer.writerow([f"{row['TIMESTAMP']:.3f}", row["TUBE"], f"{row['VOLUME']:.1f}", row["CONFIDENCE"]])
+                f.flush()
+                count += 1
+        return count
+
+    def run(self, source, csv_path, follow=False, every=1):
+        # source: an image folder, a video file/stream URL or a camera index
+        if isinstance(source, str) and os.path.isdir(source):
+            frames = self.directory_frames(source, follow=follow)
+        else:
+            frames = self.video_frames(source, every=every)
+
+        start = time.perf_counter()
+        try:
+            count = self.write_csv(self.estimates(frames), csv_path)
+        except KeyboardInterrupt:
+            count = None
+        print(f"{self.frames} frames in {time.perf_counter() - start:.1f} s: "
+              f"{self.skipped} unchanged, {self.rejected} rejected" + (f", {count} rows written to {csv_path}" if count is not None else ""))
+        return count
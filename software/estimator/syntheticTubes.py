@@ -0,0 +1,133 @@
+import os
+import cv2
+import numpy as np
+
+
+class SyntheticTubes:
+    """
+    Renders synthetic fluid-level camera frames with known tube fill heights.
+
+    Each tube of the VolumeEstimation geometry is drawn as a saturated fluid column
+    under a dark meniscus band, between tube walls hanging from a holder bar, on a noisy
+    background, with a colored panel square. Walls and holder do not change with the fill
+    level, they are the static structure RoiRegistration locks onto. Tubes are drawn on
+    the measured ROIs (roi_offset is ignored).
+    As in the real tubes, the darkest row sits right above the meniscus height and the
+    most saturated one right below it, where get_meniscus_height looks for them.
+    The ground truth of every tube (meniscus height, segmented area and the volume the
+    current calibration gives for that area) comes with the frame, so segmentation
+    and the whole estimate can be checked without camera hardware.
+    """
+    def __init__(self, volume_estimation_obj, seed=0):
+        self.obj = volume_estimation_obj
+        self.rng = np.random.default_rng(seed)
+
+        self.frame_shape = (1944, 2592)  # rows, columns
+        self.background_color = (180, 140, 140)  # BGR, value above the meniscus band range
+        self.fluid_color = (200, 90, 60)  # BGR, saturated media
+        self.meniscus_color = (60, 60, 60)  # BGR, dark and unsaturated, darkest right above the height
+        self.meniscus_rows = 3  # band rows drawn above the meniscus height
+        self.peak_color = (230, 60, 10)  # BGR, most saturated rows right below the height
+        self.peak_rows = 2
+        self.tube_margin = 5  # columns drawn on each side of the tube strip
+        self.wall_color = (90, 90, 90)  # BGR, tube walls next to the fluid columns
+        self.wall_width = 3
+        self.holder_color = (40, 40, 40)  # BGR, bar above the tubes
+        self.holder_rows = (40, 25)  # rows above the top of the strips
+        self.panel_color = (10, 10, 10)  # BGR, passes the panel color check
+        self.jpeg_quality = 95
+
+    def height_range(self, side):
+        # meniscus heights (in strip rows) the estimator can resolve
+        y_start, y_end, _, _ = self.obj.base_tube_roi(side)
+        return (self.obj.meniscus_band_rows + self.meniscus_rows, y_end - y_start - self.obj.meniscus_search_rows)
+
+    def random_heights(self, sides=None):
+        if sides is None:
+            sides = self.obj.sides
+        return {side: int(self.rng.integers(*self.height_range(side))) for side in sides}
+
+    def truth(self, side, height):
+        # the meniscus band above the height is counted by meniscus_segmentation
+        y_start, y_end, x_start, x_end = self.obj.base_tube_roi(side)
+        cols = x_end - x_start
+        meniscus_area = cols * min(self.meniscus_rows, height)
+        area = cols * (y_end - y_start - height) + meniscus_area
+        return {"HEIGHT": height,
+                "AREA": area,
+                "MENISCUS_AREA": meniscus_area,
+                "VOLUME": float(self.obj.volume_from_area(area))}
+
+    def render(self, heights, noise=8.0, blur_sigma=0.0, panel_color=None):
+        """
+        Args:
+            'heights' (dict) : meniscus height of each tube, in rows from the top of its strip
+            'noise' (float) : standard deviation of the gaussian pixel noise
+            'blur_sigma' (float) : gaussian blur applied to the whole frame, 0 disables it
+            'panel_color' (tuple) : BGR color of the panel square, None uses self.panel_color
+        Returns:
+            BGR frame and {side: truth}
+        """
+        rows, cols = self.frame_shape
+        image = np.empty((rows, cols, 3), dtype=np.uint8)
+        image[:] = self.background_color
+
+        # static tube holder and walls
+        rois = [self.obj.base_tube_roi(side) for side in heights]
+        top = min(roi[0] for roi in rois)
+        image[max(top - self.holder_rows[0], 0):max(top - self.holder_rows[1], 0),
+              max(min(roi[2] for roi in rois) - 60, 0):max(roi[3] for roi in rois) + 60] = self.holder_color
+        for y_start, y_end, x_start, x_end in rois:
+            x0 = max(x_start - self.tube_margin, 0)
+            x1 = x_end + self.tube_margin
+            image[top - self.holder_rows[1]:y_end + 10, max(x0 - self.wall_width, 0):x0] = self.wall_color
+            image[top - self.holder_rows[1]:y_end + 10, x1:x1 + self.wall_width] = self.wall_color
+
+        truth = {}
+        for side, height in heights.items():
+            y_start, y_end, x_start, x_end = self.obj.base_tube_roi(side)
+            x0 = max(x_start - self.tube_margin, 0)
+            x1 = x_end + self.tube_margin
+            top = y_start + height
+            image[top:y_end, x0:x1] = self.fluid_color
+            image[top:top + self.peak_rows, x0:x1] = self.peak_color
+            for k in range(1, self.meniscus_rows + 1):
+                # lighter away from the height so the darkest row is unique
+                image[max(top - k, y_start), x0:x1] = np.minimum(np.add(self.meniscus_color, 15 * (k - 1)), 255)
+            truth[side] = self.truth(side, height)
+
+        y_start, y_end, x_start, x_end = self.obj.quality_gate.panel_region
+        image[y_start:y_end, x_start:x_end] = self.panel_color if panel_color is None else panel_color
+
+        if blur_sigma > 0:
+            image = cv2.GaussianBlur(image, (0, 0), blur_sigma)
+        if noise > 0:
+            image = np.clip(image + self.rng.normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+
+        return image, truth
+
+    def encode(self, image):
+        # JPEG bytes, as uploaded by the fluid-level camera
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise ValueError("Could not encode synthetic frame")
+        return buffer.tobytes()
+
+    def save_dataset(self, output_dir, n_images, **render_kwargs):
+        # Both tubes share the fill height so the file name carries the ground truth volume
+        # in the `-<mL>.jpg` form read by VolumeEstimation.get_gt_volume
+        os.makedirs(output_dir, exist_ok=True)
+        low = max(self.height_range(side)[0] for side in self.obj.sides)
+        high = min(self.height_range(side)[1] for side in self.obj.sides)
+
+        paths = []
+        for k in range(n_images):
+            height = int(self.rng.integers(low, high))
+            image, truth = self.render({side: height for side in self.obj.sides}, **render_kwargs)
+            volume_ml = truth[self.obj.sides[0]]["VOLUME"] / 1000
+            path = os.path.join(output_dir, f"synthetic-{k:04d}-{volume_ml:.4f}.jpg")
+            cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            paths.append(path)
+
+        print(f"Saved {n_images} synthetic images to {output_dir}")
+        return paths
@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+# the estimator modules are flat files next to the *-main.py scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from volumeEstimation import VolumeEstimation
+from syntheticTubes import SyntheticTubes
+
+
+@pytest.fixture
+def estimator():
+    return VolumeEstimation("LEFT")
+
+
+@pytest.fixture
+def generator(estimator):
+    return SyntheticTubes(estimator, seed=0)
+
@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+# Per-stage latency of the estimator on synthetic frames (pytest-benchmark), and the end-to-end
+# accuracy on the same frames. Compare runs with --benchmark-autosave / --benchmark-compare.
+
+FRAMES = 8
+
+
+@pytest.fixture
+def frame(generator):
+    image, truth = generator.render(generator.random_heights(), noise=8.0, blur_sigma=0.8)
+    return image, generator.encode(image), truth
+
+
+def test_decode(benchmark, frame):
+    _, jpeg, _ = frame
+    image = benchmark(cv2.imdecode, np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert image.shape[:2] == (1944, 2592)
+
+
+def test_roi_decode(benchmark, estimator, frame):
+    _, jpeg, _ = frame
+    regions = [estimator.tube_roi(side) for side in estimator.sides]
+    strips = benchmark(estimator.roi_decoder.decode_regions, jpeg, regions)
+    assert [strip.shape[:2] for strip in strips] == [(y1 - y0, x1 - x0) for y0, y1, x0, x1 in regions]
+
+
+def test_crop(benchmark, estimator, frame):
+    image, _, _ = frame
+    strip = benchmark(estimator.image_crop, image, "LEFT")
+    y_start, y_end, x_start, x_end = estimator.tube_roi("LEFT")
+    assert strip.shape[:2] == (y_end - y_start, x_end - x_start)
+
+
+def test_hsv(benchmark, estimator, frame):
+    image, _, _ = frame
+    strip = estimator.image_crop(image, "LEFT")
+    hsv_image = benchmark(estimator.strip_hsv, strip)
+    assert np.array_equal(hsv_image, cv2.cvtColor(strip, cv2.COLOR_BGR2HSV))
+
+
+def test_segmentation(benchmark, estimator, frame):
+    image, _, truth = frame
+    strip = estimator.image_crop(image, "LEFT")
+    area, height, _ = benchmark(estimator.strip_segmentation, strip)
+    assert abs(height - truth["LEFT"]["HEIGHT"]) <= 1
+
+
+def test_volume_lut(benchmark, estimator):
+    areas = np.random.default_rng(0).integers(0, estimator.max_tube_area(), 1000)
+    estimator.get_volume_lut()  # built once, not part of the lookup
+    volumes = benchmark(estimator.volume_from_area_array, areas)
+    assert np.allclose(volumes, estimator.volume_polynomial(areas))
+
+
+def test_polynomial(benchmark, estimator):
+    areas = np.random.default_rng(0).integers(0, estimator.max_tube_area(), 1000)
+    volumes = benchmark(estimator.volume_polynomial, areas)
+    assert np.all(volumes >= 0)
+
+
+def test_batch_estimation(benchmark, estimator, frame):
+    # what the estimator service runs for every image: ROI decode and both tubes segmented as one batch
+    _, jpeg, truth = frame
+    estimator.get_volume_lut()
+    volumes = benchmark(estimator.volume_estimation_all, jpeg)
+    for side in estimator.sides:
+        assert volumes[side] == pytest.approx(truth[side]["VOLUME"], abs=25)
+
+
+def test_end_to_end_accuracy(estimator, generator):
+    errors = []
+    for _ in range(FRAMES):
+        image, truth = generator.render(generator.random_heights(), noise=8.0, blur_sigma=0.8)
+        volumes = estimator.volume_estimation_all(generator.encode(image))
+        errors += [abs(volumes[side] - truth[side]["VOLUME"]) for side in estimator.sides]
+    # one row of meniscus height is about 13 uL
+    assert np.mean(errors) < 5
+    assert np.max(errors) < 25
@@ -0,0 +1,34 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from calibrationRegistry import CalibrationRegistry
+
+# Versions saved by concurrent processes must all be kept, each in its own complete file.
+
+
+def save_calibrations(calibration_dir, worker, count):
+    registry = CalibrationRegistry(calibration_dir)
+    return [registry.save({"worker": worker, "sample": k})["version"] for k in range(count)]
+
+
+def test_save_versions(tmp_path):
+    registry = CalibrationRegistry(str(tmp_path))
+    assert registry.load() is None
+    assert registry.save({"breakpoint": 1})["version"] == 1
+    assert registry.save({"breakpoint": 2})["version"] == 2
+    assert CalibrationRegistry(str(tmp_path)).load()["breakpoint"] == 2
+    assert CalibrationRegistry(str(tmp_path)).load(1)["breakpoint"] == 1
+
+
+def test_concurrent_saves(tmp_path):
+    workers, count = 4, 10
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        saved = list(pool.map(save_calibrations, [str(tmp_path)] * workers, range(workers), [count] * workers))
+
+    versions = sorted(version for worker_versions in saved for version in worker_versions)
+    assert versions == list(range(1, workers * count + 1))
+    registry = CalibrationRegistry(str(tmp_path))
+    assert registry.versions() == versions
+    samples = {(registry.load(version)["worker"], registry.load(version)["sample"]) for version in versions}
+    assert samples == {(worker, k) for worker in range(workers) for k in range(count)}
+    assert all(registry.load(version)["version"] == version for version in versions)
+    assert not [file for file in os.listdir(tmp_path) if file.endswith(".tmp")]
@@ -0,0 +1,110 @@
+import threading
+import pytest
+from consumerShard import ConsumerShard
+from localBroker import LocalBroker
+from calibrationRegistry import CalibrationRegistry
+from estimatorService import EstimatorService
+
+# Rack requests (a {INDEX: CHIP_ID} map) are split per chip, so every chip is sharded and ordered
+# on its own, with its single-tube requests.
+
+REQUEST_TOPIC = "telemetry/+/log/estimator/+/REQUEST"
+
+
+def chips_on_shards(count):
+    # one chip id per shard of `count`
+    chips = {}
+    candidate = 0
+    while len(chips) < count:
+        chip = f"chip-{candidate}"
+        chips.setdefault(ConsumerShard.shard_of(chip, count), chip)
+        candidate += 1
+    return [chips[index] for index in range(count)]
+
+
+def request(indexes, chips, path="frame.jpg"):
+    return {"COMMAND": "ESTIMATE-REQUEST", "TYPE": ["volume"], "INDEX": indexes, "CHIP_ID": chips,
+            "UUID": "test", "FOR": "test", "FROM": "test", "PICTURE": {"VOL": [path]}}
+
+
+def test_split_by_chip():
+    single = request("LEFT", "chip-a")
+    assert ConsumerShard.split_by_chip(single) == [single]
+
+    rack = request(["A1", "A2", "B1"], {"A1": "chip-a", "A2": "chip-b", "B1": "chip-a", "B2": "chip-c"})
+    split = ConsumerShard.split_by_chip(rack)
+    assert [(part["CHIP_ID"], part["INDEX"]) for part in split] == [("chip-a", ["A1", "B1"]), ("chip-b", ["A2"])]
+    assert all(part["PICTURE"] == rack["PICTURE"] for part in split)
+
+    everything = ConsumerShard.split_by_chip(request("ALL", {"A1": "chip-a", "A2": "chip-b"}))
+    assert [(part["CHIP_ID"], part["INDEX"]) for part in everything] == [("chip-a", ["A1"]), ("chip-b", ["A2"])]
+
+    # a map of one chip becomes that chip
+    assert ConsumerShard.split_by_chip(request("A1", {"A1": "chip-a", "A2": "chip-b"}))[0]["CHIP_ID"] == "chip-a"
+
+    # left whole, answered with an error by the estimator
+    missing = request(["A1", "A3"], {"A1": "chip-a", "A2": "chip-b"})
+    assert ConsumerShard.split_by_chip(missing) == [missing]
+
+
+def test_filtered_keeps_own_chips():
+    chips = chips_on_shards(2)
+    received = [[], []]
+    shards = [ConsumerShard(index, 2) for index in range(2)]
+    consumers = [shard.filtered(lambda topic, message, index=index: received[index].append(message)) for index, shard in enumerate(shards)]
+
+    for consume in consumers:
+        consume("t", request(["LEFT", "RIGHT"], {"LEFT": chips[0], "RIGHT": chips[1]}))
+        consume("t", request("LEFT", chips[1]))
+        consume("t", {"COMMAND": "TRACK-RESET", "CHIP_ID": chips[0], "INDEX": "LEFT"})
+
+    assert [(message["CHIP_ID"], message["INDEX"]) for message in received[0] if message["COMMAND"] == "ESTIMATE-REQUEST"] == [(chips[0], ["LEFT"])]
+    assert [(message["CHIP_ID"], message["INDEX"]) for message in received[1] if message["COMMAND"] == "ESTIMATE-REQUEST"] == [(chips[1], ["RIGHT"]), (chips[1], "LEFT")]
+    assert all(any(message["COMMAND"] == "TRACK-RESET" for message in messages) for messages in received)
+
+
+class MemoryFetcher:
+    # stands in for S3Fetcher: the encoded images by path
+    def __init__(self, images):
+        self.images = images
+
+    def fetch(self, path):
+        return self.images[path]
+
+
+@pytest.fixture(scope="module")
+def images():
+    from volumeEstimation import VolumeEstimation
+    from syntheticTubes import SyntheticTubes
+    generator = SyntheticTubes(VolumeEstimation("LEFT"), seed=0)
+    return {f"frame-{k}.jpg": generator.encode(generator.render(generator.random_heights())[0]) for k in range(4)}
+
+
+def test_sharded_rack_requests_stay_in_order(tmp_path, images):
+    chips = chips_on_shards(2)
+    broker = LocalBroker()
+    services = []
+    for index in range(2):
+        service = EstimatorService(broker, CalibrationRegistry(str(tmp_path)), max_workers=1, cache_size=0, fetcher=MemoryFetcher(images))
+        ConsumerShard(index, 2).subscribe(broker, REQUEST_TOPIC, service.handle_estimate)
+        services.append(service)
+
+    received = []
+    done = threading.Event()
+    def record(topic, message):
+        received.append((message["CHIP_ID"], message["INDEX"], message["IMAGE"]))
+        if len(received) == 5:
+            done.set()
+    broker.subscribe_message(topic="telemetry/+/log/test/FEEDBACK/REQUEST", callback=record)
+
+    # rack photo of both chips, then single-tube photos of each
+    broker.publish_message("telemetry/test/log/estimator/ESTIMATE/REQUEST", request("ALL", {"LEFT": chips[0], "RIGHT": chips[1]}, "frame-0.jpg"))
+    broker.publish_message("telemetry/test/log/estimator/ESTIMATE/REQUEST", request("LEFT", chips[0], "frame-1.jpg"))
+    broker.publish_message("telemetry/test/log/estimator/ESTIMATE/REQUEST", request("RIGHT", chips[1], "frame-2.jpg"))
+    broker.publish_message("telemetry/test/log/estimator/ESTIMATE/REQUEST", request("LEFT", chips[1], "frame-3.jpg"))
+    assert done.wait(timeout=60)
+    for service in services:
+        service.pool.shutdown()
+
+    assert [image for chip, _, image in received if chip == chips[0]] == ["frame-0.jpg", "frame-1.jpg"]
+    assert [image for chip, _, image in received if chip == chips[1]] == ["frame-0.jpg", "frame-2.jpg", "frame-3.jpg"]
@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+import pytest
+from volumeEstimation import VolumeEstimation
+from syntheticTubes import SyntheticTubes
+
+# HUE_filter_float against the per-pixel float thresholds it implements, and the error bound of
+# the opt-in lookup table mode.
+
+FRAMES = 10
+
+
+@pytest.fixture(scope="module")
+def strips():
+    estimator = VolumeEstimation("LEFT")
+    generator = SyntheticTubes(estimator, seed=0)
+    strips = []
+    for _ in range(FRAMES):
+        image, _ = generator.render(generator.random_heights(), noise=8.0, blur_sigma=0.8)
+        strips.extend(estimator.read_tube_strips(image).values())
+    return strips
+
+
+def reference_hue_filter(estimator, image_rgb_crop):
+    I = cv2.cvtColor(np.float32(image_rgb_crop) / 255.0, cv2.COLOR_RGB2HSV)
+    mask = (I[:, :, 0] >= estimator.hue_min) & (I[:, :, 1] >= estimator.saturation_min) & (I[:, :, 0] <= estimator.hue_max)
+    return mask.astype(np.uint8) * 255
+
+
+def test_float_matches_reference(estimator, strips):
+    for strip in strips:
+        assert np.array_equal(estimator.HUE_filter_float(strip), reference_hue_filter(estimator, strip))
+    # not contiguous, like the crops of a decoded frame
+    image = np.random.default_rng(0).integers(0, 256, (200, 120, 3), dtype=np.uint8)
+    assert np.array_equal(estimator.HUE_filter_float(image[20:180, 30:50]), reference_hue_filter(estimator, image[20:180, 30:50]))
+
+
+def test_float_is_default(estimator, strips):
+    assert estimator.hue_filter_mode == "float"
+    assert np.array_equal(estimator.HUE_filter(strips[0]), estimator.HUE_filter_float(strips[0]))
+
+
+def test_lut_error_bound(estimator, strips):
+    estimator.hue_filter_mode = "lut"
+    agreements = []
+    for strip in strips:
+        mask = estimator.HUE_filter(strip)
+        reference = estimator.HUE_filter_float(strip)
+        agreements.append(np.mean(mask == reference))
+        # white pixels are the tube area: within 1% of the strip
+        assert abs(estimator.count_white_pixels(mask) - estimator.count_white_pixels(reference)) < 0.01 * strip.shape[0] * strip.shape[1]
+    assert min(agreements) > 0.9
+    assert np.mean(agreements) > 0.94
+
+
+def test_lut_follows_thresholds(estimator, strips):
+    estimator.HUE_filter_lut(strips[0])
+    estimator.saturation_min = 40.0 / 255.0
+    mask = estimator.HUE_filter_lut(strips[0])
+    assert estimator.hue_lut_params[2] == estimator.saturation_min
+    assert np.mean(mask == estimator.HUE_filter_float(strips[0])) > 0.9
@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+from imageProcessor import ImageProcessor
+
+# The packed MaskDataset stores binary masks: on resized masks with grey edges it gives the
+# dense loader's masks thresholded at 127, and counts the grey pixels it rounded.
+
+
+def real_style_masks(rng, rows=1065, cols=20):
+    # H, M and E masks like the segmentation writes them, with the soft edges of a smoothed
+    # contour and an odd meniscus row, so the half-size resize leaves grey pixels
+    height = int(rng.integers(200, rows - 200)) | 1
+    masks = np.zeros((3, rows, cols), dtype=np.uint8)
+    masks[0, height:] = 255
+    masks[1, height - 7:height] = 255
+    masks[2, height] = 255
+    return [cv2.GaussianBlur(mask, (5, 5), 1.0) for mask in masks]
+
+
+def write_dataset(tmp_path, samples):
+    rng = np.random.default_rng(0)
+    lines = []
+    for k in range(samples):
+        paths = []
+        for name, mask in zip("HME", real_style_masks(rng)):
+            paths.append(str(tmp_path / f"{name}-{k:04d}.png"))
+            cv2.imwrite(paths[-1], mask)
+        lines.append(",".join(paths + [str(1000 + k), str(100 + k), str(200.5 + k)]))
+    data_path = tmp_path / "data.txt"
+    data_path.write_text("\n".join(lines) + "\n")
+    return str(data_path)
+
+
+def test_packed_masks_are_thresholded_dense_masks(tmp_path, estimator):
+    processor = ImageProcessor(estimator)
+    data_path = write_dataset(tmp_path, 6)
+    images_H, images_M, images_E, H_areas, M_areas, volumes, image_size = processor.load_images_and_areas_from_file(data_path)
+
+    assert processor.pack_images_and_areas_from_file(data_path, str(tmp_path / "packed")) == 6
+    dataset = processor.load_packed_images_and_areas(str(tmp_path / "packed"))
+    assert dataset.image_size == image_size
+
+    dense = np.stack([images_H, images_M, images_E], axis=1)
+    grey = int(np.count_nonzero((dense != 0) & (dense != 255)))
+    assert grey > 0  # the resized masks are not binary, the format is lossy
+    assert dataset.binarized_pixels == grey
+
+    packed = []
+    for batch_H, batch_M, batch_E, batch_H_areas, batch_M_areas, batch_volumes in dataset.batches(4):
+        packed.append(np.stack([batch_H, batch_M, batch_E], axis=1))
+    packed = np.concatenate(packed)
+    assert np.array_equal(packed, np.where(dense > 127, 255, 0).astype(np.uint8))
+    assert np.array_equal(np.asarray(dataset.areas), np.stack([H_areas, M_areas], axis=1))
+    assert np.array_equal(np.asarray(dataset.volumes), volumes)
+
+
+def test_shuffled_batches(tmp_path, estimator):
+    processor = ImageProcessor(estimator)
+    data_path = write_dataset(tmp_path, 5)
+    processor.pack_images_and_areas_from_file(data_path, str(tmp_path / "packed"))
+    dataset = processor.load_packed_images_and_areas(str(tmp_path / "packed"))
+
+    order = [3, 0, 4, 1, 2]
+    volumes = np.concatenate([batch[5] for batch in dataset.batches(2, order)])
+    assert np.array_equal(volumes, np.asarray(dataset.volumes)[order])
@@ -0,0 +1,46 @@
+import estimatorService
+
+# The estimator service only runs the quality gate when a failed check rejects the image, so by
+# default only the tube ROIs are decoded.
+
+
+class MemoryFetcher:
+    # stands in for S3Fetcher: the encoded images by path
+    def __init__(self, images):
+        self.images = images
+
+    def fetch(self, path):
+        return self.images[path]
+
+
+def run_worker(generator, reject_on_quality):
+    image, truth = generator.render(generator.random_heights(), noise=8.0, blur_sigma=0.8)
+    estimatorService.init_worker(None, fetcher=MemoryFetcher({"frame.jpg": generator.encode(image)}), reject_on_quality=reject_on_quality)
+    decoded = []
+    decode_regions = estimatorService.worker_estimator.roi_decoder.decode_regions
+    def recording_decode_regions(image_or_path, regions):
+        decoded.append(list(regions))
+        return decode_regions(image_or_path, regions)
+    estimatorService.worker_estimator.roi_decoder.decode_regions = recording_decode_regions
+    return truth, decoded
+
+
+def test_no_quality_check_by_default(generator):
+    truth, decoded = run_worker(generator, reject_on_quality=False)
+    result = estimatorService.estimate_volume("frame.jpg", ["LEFT", "RIGHT"], None)
+    assert result["QUALITY"] is None
+    assert decoded == [[estimatorService.worker_estimator.tube_roi(side) for side in ["LEFT", "RIGHT"]]]
+    for side in ["LEFT", "RIGHT"]:
+        assert abs(result["TUBES"][side]["VOL"] - truth[side]["VOLUME"]) < 25
+
+
+def test_reject_on_quality(generator):
+    run_worker(generator, reject_on_quality=True)
+    result = estimatorService.estimate_volume("frame.jpg", ["LEFT", "RIGHT"], None)
+    assert result["QUALITY"]["PASS"]
+    assert all(tube["VOL"] is not None for tube in result["TUBES"].values())
+
+    estimatorService.worker_estimator.quality_gate.blur_threshold = float("inf")
+    result = estimatorService.estimate_volume("frame.jpg", ["LEFT", "RIGHT"], None)
+    assert result["QUALITY"]["IS_BLUR"]
+    assert all(tube["VOL"] is None for tube in result["TUBES"].values())
@@ -0,0 +1,70 @@
+import os
+import cv2
+import numpy as np
+import pytest
+from volumeEstimation import VolumeEstimation
+from syntheticTubes import SyntheticTubes
+
+# Camera drifts of 0 to 5 pixels: every frame is either re-registered onto the tubes or, within
+# `tolerance` pixels, estimated as it is with a small volume error.
+
+SHIFTS = sorted({(d * sy, d * sx) for d in range(6) for sy, sx in [(1, 0), (0, 1), (1, 1), (-1, 0), (0, -1), (-1, 1)]})
+MAX_ERROR = 25  # uL, one row of meniscus height is about 13 uL
+
+
+def shift(image, dy, dx):
+    # the camera moved by (dy, dx): the whole scene moves, the border repeats the edge
+    matrix = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(image, matrix, (image.shape[1], image.shape[0]), borderMode=cv2.BORDER_REPLICATE)
+
+
+@pytest.fixture(scope="module")
+def scene(tmp_path_factory):
+    estimator = VolumeEstimation("LEFT")
+    estimator.check_quality = True
+    generator = SyntheticTubes(estimator, seed=0)
+    reference, _ = generator.render(generator.random_heights())
+    registration = estimator.enable_registration(str(tmp_path_factory.mktemp("registration") / "registration.npz"), reference=reference)
+    image, _ = generator.render(generator.random_heights())
+    expected = VolumeEstimation("LEFT").volume_estimation_all(image)  # fixed ROIs on the unmoved frame
+    return estimator, registration, image, expected
+
+
+@pytest.mark.parametrize("dy,dx", SHIFTS)
+def test_drift_is_registered_or_within_tolerance(scene, dy, dx):
+    estimator, registration, image, expected = scene
+    estimator.roi_offset = (0, 0)
+    registrations = registration.registrations
+
+    volumes = estimator.volume_estimation_all(shift(image, dy, dx))
+
+    residual = max(abs(estimator.roi_offset[0] - dy), abs(estimator.roi_offset[1] - dx))
+    assert residual <= registration.tolerance
+    if max(abs(dy), abs(dx)) > registration.tolerance:
+        assert registration.registrations == registrations + 1
+    for side in estimator.sides:
+        assert abs(volumes[side] - expected[side]) < MAX_ERROR * residual + 1e-6
+
+
+def test_verify_rejects_drift_beyond_tolerance(scene):
+    estimator, registration, image, _ = scene
+    estimator.roi_offset = (0, 0)
+    for dy, dx in SHIFTS:
+        y_start, y_end, x_start, x_end = registration.window()
+        accepted = registration.verify(shift(image, dy, dx)[y_start:y_end, x_start:x_end])
+        assert accepted == (max(abs(dy), abs(dx)) <= registration.tolerance), (dy, dx)
+
+
+def test_verify_rejects_window_cut_by_frame(scene):
+    estimator, registration, image, _ = scene
+    estimator.roi_offset = (0, 0)
+    y_start, y_end, x_start, x_end = registration.window()
+    assert registration.verify(image[y_start:y_end, x_start:x_end])
+    assert not registration.verify(image[y_start:y_end - 2, x_start:x_end])
+
+
+def test_save_leaves_no_temporary_file(scene):
+    _, registration, _, _ = scene
+    registration.save()
+    cache_dir = os.path.dirname(registration.cache_path)
+    assert os.listdir(cache_dir) == [os.path.basename(registration.cache_path)]
@@ -0,0 +1,52 @@
+import pytest
+from volumeEstimation import VolumeEstimation
+from syntheticTubes import SyntheticTubes
+
+# The fused, windowed and batched segmentations must give exactly the area and meniscus height
+# of the reference path (image_segmentation, i.e. HUE_filter, get_meniscus_height and
+# meniscus_segmentation) on every synthetic tube.
+
+FRAMES = 12
+
+
+@pytest.fixture(scope="module", params=[(8.0, 0.0), (8.0, 0.8), (14.0, 1.2)], ids=["noise8", "noise8-blur", "noise14-blur"])
+def frames(request):
+    # rendered once per noise setting, the strips are only read by the tests
+    noise, blur_sigma = request.param
+    estimator = VolumeEstimation("LEFT")
+    generator = SyntheticTubes(estimator, seed=0)
+    frames = []
+    for k in range(FRAMES):
+        image, truth = generator.render(generator.random_heights(), noise=noise, blur_sigma=blur_sigma)
+        frames.append((f"synthetic-{k:04d}", estimator.read_tube_strips(image), truth))
+    return frames
+
+
+def test_fused_matches_reference(estimator, frames):
+    for name, strips, _ in frames:
+        assert estimator.compare_strip_segmentation(name, strips) == []
+
+
+def test_stack_matches_fused(estimator, frames):
+    for name, strips, _ in frames:
+        for side, batched in estimator.segment_strips(strips).items():
+            assert tuple(batched) == tuple(estimator.fused_segmentation(strips[side])), (name, side)
+
+
+@pytest.mark.parametrize("hint_offset", [0, -3, 5])
+def test_windowed_matches_fused(estimator, frames, hint_offset):
+    # a hint inside the tracking window gives the fused result without scanning the whole strip
+    for name, strips, truth in frames:
+        for side, strip in strips.items():
+            area, height, meniscus_area, full_scan = estimator.windowed_segmentation(strip, truth[side]["HEIGHT"] + hint_offset)
+            assert (area, height, meniscus_area) == estimator.fused_segmentation(strip), (name, side)
+            assert not full_scan
+
+
+def test_windowed_falls_back_to_full_scan(estimator, frames):
+    # a hint far from the level scans the whole strip, with the same result
+    for name, strips, truth in frames:
+        for side, strip in strips.items():
+            hint = (truth[side]["HEIGHT"] + strip.shape[0] // 2) % strip.shape[0]
+            area, height, meniscus_area, _ = estimator.windowed_segmentation(strip, hint)
+            assert (area, height, meniscus_area) == estimator.fused_segmentation(strip), (name, side)
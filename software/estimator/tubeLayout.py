@@ -0,0 +1,89 @@
+import os
+import json
+
+
+class TubeLayout:
+    """
+    Named tube strips of one camera frame.
+
+    Every tube is a (y_start, y_end, x_start, x_end) region of the full frame, in the order
+    given. A layout is stored as JSON:
+
+        {"camera": "zambezi-cam",
+         "tubes": [{"name": "A1", "roi": [210, 1275, 135, 155]}, ...]}
+
+    `grid` builds the layout of a rack whose tube strips are equally spaced, e.g. the
+    12 or 24 reservoirs of an autoculture rack in one photo. Strips are sliced out of a
+    decoded frame as views (no copy); equally sized strips can then be stacked and
+    segmented as one batch (VolumeEstimation.segment_strips).
+    """
+    def __init__(self, tubes, camera=None):
+        self.camera = camera
+        self.rois = {}
+        for name, roi in tubes:
+            y_start, y_end, x_start, x_end = (int(value) for value in roi)
+            if name in self.rois:
+                raise ValueError(f"Duplicate tube name: {name}")
+            if y_end <= y_start or x_end <= x_start or y_start < 0 or x_start < 0:
+                raise ValueError(f"Invalid ROI of tube {name}: {roi}")
+            self.rois[name] = (y_start, y_end, x_start, x_end)
+        if not self.rois:
+            raise ValueError("A tube layout needs at least one tube")
+
+    @property
+    def names(self):
+        return list(self.rois)
+
+    def roi(self, name):
+        if name not in self.rois:
+            raise ValueError(f"Invalid side: {name}")
+        return self.rois[name]
+
+    @classmethod
+    def grid(cls, rows, columns, y_start, x_start, height, width, row_pitch, column_pitch, camera=None):
+        # rows x columns equally spaced strips named A1, A2, ... B1, ... (rack notation)
+        tubes = []
+        for row in range(rows):
+            for column in range(columns):
+                y = y_start + row * row_pitch
+                x = x_start + column * column_pitch
+                tubes.append((f"{chr(ord('A') + row)}{column + 1}", (y, y + height, x, x + width)))
+        return cls(tubes, camera)
+
+    @classmethod
+    def load(cls, layout_path):
+        with open(layout_path, 'r') as f:
+            layout = json.load(f)
+        return cls([(tube["name"], tube["roi"]) for tube in layout["tubes"]], layout.get("camera"))
+
+    def save(self, layout_path):
+        os.makedirs(os.path.dirname(layout_path) or '.', exist_ok=True)
+        with open(layout_path, 'w') as f:
+            json.dump({"camera": self.camera,
+                       "tubes": [{"name": name, "roi": list(roi)} for name, roi in self.rois.items()]}, f, indent=4)
+
+    def extract(self, frame, names=None, origin=(0, 0)):
+        """
+        Args:
+            'frame' (np.ndarray) : decoded frame, or a crop of it starting at `origin`
+            'names' (list) : tubes to slice, default all
+            'origin' (tuple) : (y, x) of frame[0, 0] in the full frame
+        Returns:
+            {name: strip}, every strip a view of `frame`
+        """
+        if names is None:
+            names = self.names
+        y_origin, x_origin = origin
+        strips = {}
+        for name in names:
+            y_start, y_end, x_start, x_end = self.roi(name)
+            strips[name] = frame[y_start - y_origin:y_end - y_origin, x_start - x_origin:x_end - x_origin]
+        return strips
+
+    @staticmethod
+    def shape_groups(strips):
+        # {(rows, cols): [names]} of strips that can be stacked into one batch
+        groups = {}
+        for name, strip in strips.items():
+            groups.setdefault(strip.shape[:2], []).append(name)
+        return groups
@@ -5,13 +5,28 @@ import numpy as np
 import re
 import math
 import sys
-import pandas as pd
+import time
+import functools
+import contextlib
 import csv
 from curveFitting import CurveFitting
+from roiDecoder import RoiDecoder
+from roiRegistration import RoiRegistration
+from qualityGate import QualityGate
+from datasetRunner import DatasetRunner
+from featureCache import FeatureCache
+from calibrationRegistry import CalibrationRegistry
+from calibrationFitter import CalibrationFitter
+from stageTimer import StageTimer
+from meniscusTracker import MeniscusTracker
+from tubeLayout import TubeLayout
+
+NO_TIMING = contextlib.nullcontext()
 
 class VolumeEstimation:
     def __init__(self, side):
         self.side = side
+        self.sides = ["LEFT", "RIGHT"]
 
         self.vol_left = 0
         self.vol_right = 0
@@ -37,6 +52,10 @@ class VolumeEstimation:
         self.d = 7.701084013461749e-07 
         self.e = 0.6203205589679506 
         self.f = -1217.8468504658977
+        # calibrations of any degree (highest power first), None uses g..j and c..f
+        self.cone_coefficients = None
+        self.cylinder_coefficients = None
+        self.calibration_version = "default"  # replaced by apply_calibration
 
         self.x1 = 1135  # upper-left (y1, x1)
         self.x2 = 1155  # upper-right (y1, x2)
@@ -50,8 +69,61 @@ class VolumeEstimation:
 
         self.dist = 290 # down-right (y3, x2)
 
+        # named tube strips of the camera (e.g. a whole rack), None keeps the LEFT/RIGHT strips above.
+        # See apply_layout
+        self.layout = None
+
+        # (dy, dx) camera move applied to every tube ROI, kept up to date by an RoiRegistration
+        # (see enable_registration) that verifies it on every frame
+        self.roi_offset = (0, 0)
+        self.registration = None
+
         self.BLUR_THRESHOLD = 50
 
+        # fluid detection (HUE_filter)
+        self.hue_min = 90.0 * 360 / 179  # degrees
+        self.hue_max = 174 * 360 / 179
+        self.saturation_min = 15.0 / 255.0
+        self.hue_filter_mode = "float"  # "float" or "lut" (quantized RGB lookup table, approximate, opt-in)
+        self.hue_lut_bins = 32  # per channel, power of two
+        self.hue_lut = None
+        self.hue_lut_params = None
+
+        # meniscus segmentation (HSV value channel)
+        self.meniscus_value_min = 30
+        self.meniscus_value_max = 130
+        self.meniscus_search_rows = 12  # rows around the saturation peak searched for the value minimum
+        self.meniscus_band_rows = 20  # rows above the meniscus height refined by meniscus_segmentation
+
+        # meniscus search, see strip_segmentation: "full" scans every row of the strip, "pyramid" finds
+        # the meniscus on a strip shrunk pyramid_factor (rows, columns) times and only converts the rows
+        # around it (pyramid_refine_rows more on either side) and the meniscus band at full resolution.
+        # Rows are only halved: the saturation peak is one or two rows thin and averaging 4 rows can
+        # hide it under noise. The pyramid only pays off on wide strips (about 1.6x on 2130x160), on
+        # the 20 px LEFT/RIGHT strips the full search is faster. subpixel_meniscus interpolates
+        # fractional heights and areas.
+        self.meniscus_search = "full"
+        self.pyramid_factor = (2, 8)
+        self.pyramid_refine_rows = 3
+        self.subpixel_meniscus = False
+        self.row_sum_weights = {}  # strip width -> (cols * 3, 2) selector of row_sums
+
+        # meniscus rows expected per side (e.g. from a MeniscusTracker), the search is then limited
+        # to tracking_window_rows around them, see windowed_segmentation
+        self.height_hints = {}
+        self.tracking_window_rows = 40
+        self.tracking_min_contrast = 0.2  # relative value dip a window needs to contain the meniscus
+        self.tracker = None
+
+        self.batch_size = 64
+
+        # area -> volume table covering every possible strip area, see get_volume_lut
+        self.volume_lut = None
+        self.volume_lut_params = None
+
+        # decodes only the MCUs covering the tube strips when libturbojpeg is available
+        self.roi_decoder = RoiDecoder()
+
         self.volume_gt_left = []
         self.volume_gt_right = []
         self.area_left = []
@@ -63,20 +135,41 @@ class VolumeEstimation:
         self.image_is_red = False
         self.image_is_blur = False
 
-    def images_temperature(self, dataset_path):
-        image_files = [file for file in os.listdir(dataset_path) if file.endswith(('.jpg', '.jpeg', '.png'))]
+        # single-decode blur and panel color check, run by volume_estimation when check_quality is set
+        self.quality_gate = QualityGate(self)
+        self.check_quality = False
+        self.reject_on_quality = True  # False only reports self.quality, the tubes are estimated anyway
+        self.quality = None
 
-        # Sort the files by modification time, earliest first
-        image_files.sort(key=lambda x: os.path.getmtime(os.path.join(dataset_path, x)))
+        # process pool for dataset-wide calibration and evaluation runs
+        self.runner = DatasetRunner()
+
+        # days the feature cache keeps the rows of other segmentation parameters after their last use,
+        # None never prunes them (e.g. when alternating between full and sub-pixel searches)
+        self.feature_cache_max_age_days = None
+
+        # per-stage timings, see enable_timing. None keeps the stages uninstrumented
+        self.timer = None
+
+    def enable_timing(self, window=1000):
+        self.timer = StageTimer(window)
+        return self.timer
+
+    def stage(self, name):
+        # timing context of one pipeline stage, a no-op unless enable_timing was called
+        if self.timer is None:
+            return NO_TIMING
+        return self.timer.stage(name)
+
+    def images_temperature(self, dataset_path):
+        image_files = self.runner.list_images(dataset_path, sort_by_mtime=True)
 
         Rs = []
         Gs = []
         Bs = []
 
-        for image_file in image_files:
-            image_path = os.path.join(dataset_path, image_file)
-
-            avr_colors = self.is_red(image_path)
+        image_paths = [os.path.join(dataset_path, image_file) for image_file in image_files]
+        for avr_colors in self.runner.map(self.is_red, image_paths):
             Rs.append(avr_colors[0])
             Gs.append(avr_colors[1])
             Bs.append(avr_colors[2])
@@ -146,17 +239,10 @@ class VolumeEstimation:
         return (R, G, B)             
 
     def images_blurness(self, dataset_path):
-        image_files = [file for file in os.listdir(dataset_path) if file.endswith(('.jpg', '.jpeg', '.png'))]
+        image_files = self.runner.list_images(dataset_path, sort_by_mtime=True)
 
-        # Sort the files by modification time, earliest first
-        image_files.sort(key=lambda x: os.path.getmtime(os.path.join(dataset_path, x)))
-
-        Laplace = []
-        for image_file in image_files:
-            image_path = os.path.join(dataset_path, image_file)
-
-            fm = self.is_blur(image_path)
-            Laplace.append(fm)
+        image_paths = [os.path.join(dataset_path, image_file) for image_file in image_files]
+        Laplace = self.runner.map(self.is_blur, image_paths)
 
         indices = list(range(1, len(image_files) + 1))
 
@@ -183,15 +269,16 @@ class VolumeEstimation:
         return fm
     
     def check_image_quality(self, image_path):
-        # check blurness
-        self.is_blur(image_path)
-        # check image color
-        self.is_red(image_path)
+        # blur and panel color from a single decode
+        image = self.read_image(image_path)
+        self.quality = self.quality_gate.evaluate(image)
+        self.image_is_blur = self.quality["IS_BLUR"]
+        self.image_is_red = self.quality["IS_RED"]
         if(self.image_is_red):
             print("Image is too red. Please, check panel color.")
         if(self.image_is_blur):
             print("Image is too blur.")
-        return
+        return self.quality
         
     def image_segmentation(self, rect_image):      
         gray_image = cv2.cvtColor(rect_image, cv2.COLOR_RGB2GRAY)
@@ -216,6 +303,199 @@ class VolumeEstimation:
 
         return binary_image
 
+    def fused_segmentation(self, rect_image):
+        # Single-pass equivalent of image_segmentation + count_white_pixels.
+        # Converts to HSV once (S and V do not depend on the RGB/BGR order), works on
+        # views of the strip and never materializes the binary image.
+        # The HUE_filter fluid check is skipped since image_segmentation discards its result.
+        # Returns area, meniscus height and meniscus area.
+        with self.stage("hsv"):
+            hsv_image = self.strip_hsv(rect_image)
+        E_channel = hsv_image[:, :, 2]
+
+        with self.stage("get_meniscus_height"):
+            height = self.meniscus_height_from_sums(*self.row_sums(hsv_image))
+
+        with self.stage("meniscus_segmentation"):
+            start_row = max(height - self.meniscus_band_rows, 0)
+            band = E_channel[start_row:height]
+            meniscus_area = cv2.countNonZero(cv2.inRange(band, self.meniscus_value_min, self.meniscus_value_max)) if band.size else 0
+
+        rows, cols = E_channel.shape
+        area = cols * (rows - height) + meniscus_area
+
+        return area, height, meniscus_area
+
+    def windowed_segmentation(self, rect_image, hint_height):
+        # fused_segmentation restricted to the rows around an expected meniscus height. When the
+        # saturation peak is too close to the window edge for the value search, or there is no
+        # dark meniscus row next to it, the level moved further than the window and the whole
+        # strip is scanned instead.
+        # Returns area, meniscus height, meniscus area and whether the whole strip was scanned.
+        rows, cols = rect_image.shape[:2]
+        hint_height = int(round(hint_height))  # sub-pixel heights are fractional
+        start_row = min(max(hint_height - self.tracking_window_rows, 0), rows)
+        end_row = min(max(hint_height + self.tracking_window_rows + 1, 0), rows)
+        band_start_row = max(start_row - self.meniscus_band_rows, 0)
+        if end_row - start_row <= 2 * self.meniscus_search_rows:
+            return self.strip_segmentation(rect_image) + (True,)
+
+        with self.stage("hsv"):
+            hsv_image = self.strip_hsv(rect_image[band_start_row:end_row])
+        E_channel = hsv_image[:, :, 2]
+
+        with self.stage("get_meniscus_height"):
+            line_sum_U, line_sum_E = self.row_sums(hsv_image[start_row - band_start_row:])
+            peak_row = start_row + np.argmax(line_sum_U)
+            if (start_row > 0 and peak_row - start_row < self.meniscus_search_rows) or \
+               (end_row < rows and end_row - peak_row <= self.meniscus_search_rows):
+                return self.strip_segmentation(rect_image) + (True,)
+            search = line_sum_E[max(peak_row - self.meniscus_search_rows - start_row, 0):peak_row + self.meniscus_search_rows + 1 - start_row]
+            reference = np.median(line_sum_E)
+            if reference <= 0 or (reference - search.min()) / reference < self.tracking_min_contrast:
+                return self.strip_segmentation(rect_image) + (True,)
+            if self.subpixel_meniscus:
+                height = self.subpixel_meniscus_height(line_sum_U, line_sum_E, offset=start_row)
+            else:
+                height = self.meniscus_height_from_sums(line_sum_U, line_sum_E, offset=start_row)
+
+        with self.stage("meniscus_segmentation"):
+            band_end_row = int(round(height))
+            band = E_channel[max(band_end_row - self.meniscus_band_rows, 0) - band_start_row:band_end_row - band_start_row]
+            meniscus_area = cv2.countNonZero(cv2.inRange(band, self.meniscus_value_min, self.meniscus_value_max)) if band.size else 0
+
+        area = cols * (rows - height) + meniscus_area
+
+        return area, height, meniscus_area, False
+
+    def strip_segmentation(self, rect_image):
+        # Whole strip segmentation of the configured meniscus search: area, meniscus height and
+        # meniscus area. Without subpixel_meniscus, "full" is fused_segmentation and "pyramid"
+        # gives the same integer heights for a fraction of the HSV conversion.
+        rows = rect_image.shape[0]
+        if self.meniscus_search == "pyramid":
+            start_row, end_row = self.pyramid_rows(rect_image)
+        elif self.meniscus_search == "full":
+            if not self.subpixel_meniscus:
+                return self.fused_segmentation(rect_image)
+            start_row, end_row = 0, rows
+        else:
+            raise ValueError(f"Invalid meniscus search: {self.meniscus_search}")
+        return self.refined_segmentation(rect_image, start_row, end_row)
+
+    def pyramid_rows(self, rect_image):
+        # Coarse step of the pyramid search: the saturation peak and value minimum are searched on the
+        # strip shrunk pyramid_factor (rows, columns) times (INTER_AREA). Returns the full resolution
+        # rows covering both, and pyramid_refine_rows on either side.
+        factor, column_factor = self.pyramid_factor
+        rows, cols = rect_image.shape[:2]
+        search_rows = -(-self.meniscus_search_rows // factor)  # coarse rows, rounded up
+        if rows // factor <= 2 * search_rows + 2:
+            return 0, rows
+
+        with self.stage("pyramid_search"):
+            small = cv2.resize(rect_image, (max(cols // column_factor, 1), rows // factor), interpolation=cv2.INTER_AREA)
+            line_sum_U, line_sum_E = self.row_sums(self.strip_hsv(small))
+            coarse_U = int(np.argmax(line_sum_U))
+            lower_bound = max(coarse_U - search_rows, 0)
+            coarse_E = lower_bound + int(np.argmin(line_sum_E[lower_bound:coarse_U + search_rows + 1]))
+
+        start_row = max(min(coarse_U, coarse_E) * factor - self.pyramid_refine_rows, 0)
+        end_row = min((max(coarse_U, coarse_E) + 1) * factor + self.pyramid_refine_rows, rows)
+        return start_row, end_row
+
+    def refined_segmentation(self, rect_image, start_row, end_row):
+        # fused_segmentation with the meniscus searched in rows start_row:end_row only (the meniscus
+        # band above them is converted too), fractional heights and areas with subpixel_meniscus.
+        # Returns area, meniscus height and meniscus area.
+        rows, cols = rect_image.shape[:2]
+        band_start_row = max(start_row - self.meniscus_band_rows - 1, 0)
+        with self.stage("hsv"):
+            hsv_image = self.strip_hsv(rect_image[band_start_row:end_row])
+        E_channel = hsv_image[:, :, 2]
+
+        with self.stage("get_meniscus_height"):
+            line_sum_U, line_sum_E = self.row_sums(hsv_image[start_row - band_start_row:])
+            if self.subpixel_meniscus:
+                height = self.subpixel_meniscus_height(line_sum_U, line_sum_E, offset=start_row)
+            else:
+                height = self.meniscus_height_from_sums(line_sum_U, line_sum_E, offset=start_row)
+
+        with self.stage("meniscus_segmentation"):
+            band_end_row = int(round(height))
+            band = E_channel[max(band_end_row - self.meniscus_band_rows, 0) - band_start_row:band_end_row - band_start_row]
+            meniscus_area = cv2.countNonZero(cv2.inRange(band, self.meniscus_value_min, self.meniscus_value_max)) if band.size else 0
+
+        area = cols * (rows - height) + meniscus_area
+
+        return area, height, meniscus_area
+
+    def subpixel_meniscus_height(self, line_sum_U, line_sum_E, offset=0):
+        # meniscus_height_from_sums with the saturation peak and the value minimum moved to the vertex
+        # of the parabola through their row sums and their neighbours, a fractional row
+        max_index_U = int(np.argmax(line_sum_U))
+        lower_bound = max(max_index_U - self.meniscus_search_rows, 0)
+        min_index_E = lower_bound + int(np.argmin(line_sum_E[lower_bound:max_index_U + self.meniscus_search_rows + 1]))
+        return offset + (max_index_U + self.parabola_vertex(line_sum_U, max_index_U) +
+                         min_index_E + self.parabola_vertex(line_sum_E, min_index_E)) / 2
+
+    @staticmethod
+    def parabola_vertex(line_sum, index):
+        # offset (-0.5 to 0.5 rows) of the extremum of the parabola through line_sum[index - 1:index + 2]
+        if index <= 0 or index >= len(line_sum) - 1:
+            return 0.0
+        before, at, after = (float(value) for value in line_sum[index - 1:index + 2])
+        curvature = before - 2 * at + after
+        if curvature == 0:
+            return 0.0
+        return min(max(0.5 * (before - after) / curvature, -0.5), 0.5)
+
+    @staticmethod
+    def strip_hsv(rect_image):
+        # cv2.cvtColor BGR2HSV of a strip. OpenCV pays a fixed cost per image row, which dominates on
+        # narrow tube strips (~1000 rows of 20 pixels), so the strip is converted as one row of pixels
+        strip = np.ascontiguousarray(rect_image)
+        return cv2.cvtColor(strip.reshape(1, -1, 3), cv2.COLOR_BGR2HSV).reshape(strip.shape)
+
+    def row_sums(self, hsv_image):
+        # saturation and value sums of every row of an HSV strip (or of a stack of strips, then
+        # (N, rows) each), as one matrix product. float32 holds these sums (< 2**24) exactly.
+        cols = hsv_image.shape[-2]
+        weights = self.row_sum_weights.get(cols)
+        if weights is None:
+            weights = np.zeros((cols * 3, 2), dtype=np.float32)
+            weights[1::3, 0] = 1
+            weights[2::3, 1] = 1
+            self.row_sum_weights[cols] = weights
+        sums = np.ascontiguousarray(hsv_image).reshape(-1, cols * 3).astype(np.float32) @ weights
+        sums = sums.reshape(hsv_image.shape[:-2] + (2,))
+        return sums[..., 0], sums[..., 1]
+
+    def compare_segmentation(self, dataset_path):
+        # Regression check: fused_segmentation must give the same area as image_segmentation
+        image_files = [file for file in os.listdir(dataset_path) if file.endswith(('.jpg', '.jpeg', '.png'))]
+
+        mismatches = []
+        for image_file in image_files:
+            strips = self.read_tube_strips(os.path.join(dataset_path, image_file))
+            mismatches.extend(self.compare_strip_segmentation(image_file, strips))
+
+        print(f"{len(mismatches)} mismatches in {len(image_files) * len(self.sides)} tubes")
+        return mismatches
+
+    def compare_strip_segmentation(self, name, strips):
+        # compare_segmentation of one frame's {side: strip}: the area and meniscus height of
+        # fused_segmentation against image_segmentation and get_meniscus_height. Returns the
+        # (name, side, reference, fused) (area, height) pairs that differ
+        mismatches = []
+        for side, rect_image in strips.items():
+            reference = (self.count_white_pixels(self.image_segmentation(rect_image)), self.get_meniscus_height(rect_image))
+            area_fused, height_fused, _ = self.fused_segmentation(rect_image)
+            if reference != (area_fused, height_fused):
+                mismatches.append((name, side, reference, (area_fused, height_fused)))
+                print(f"Mismatch {name} {side}: reference {reference}, fused {(area_fused, height_fused)}")
+        return mismatches
+
     def segmentation_refinement(self, rect_image, height):
         rgb_meniscus = self.get_area_of_interest(rect_image, height)
         binary_meniscus = self.meniscus_segmentation(rgb_meniscus)
@@ -223,23 +503,11 @@ class VolumeEstimation:
         return binary_meniscus
 
     def volume_estimation(self, image_path):
-        #self.check_image_quality(image_path)
+        strips = self.read_checked_tube_strips(image_path, [self.side])
         if (not self.image_is_blur) and (not self.image_is_red):
-            image = cv2.imread(image_path)
-            rect_image = self.image_crop(image, self.side)
+            rect_image = strips[self.side]
 
-            binary_image = self.image_segmentation(rect_image)
-    
-            area = self.count_white_pixels(binary_image)
-            self.area = area
-            
-            # cylinder lower part
-            if area < self.ref_area:
-                volume = self.g * area**3 + self.h * area**2 + self.i*area + self.j
-            else:
-                volume = self.c * area**3 + self.d * area**2 + self.e*area + self.f
-            if volume < 0 or volume == self.j:
-                volume = 0
+            volume = self.volume_from_rect_image(rect_image, self.side)
 
             if self.side == 'LEFT':
                 self.vol_left = volume
@@ -252,39 +520,424 @@ class VolumeEstimation:
         else:
             return None
 
-    def HUE_filter(self, image_rgb_crop):
-        image_rgb_crop = np.float32(image_rgb_crop) / 255.0
-
-        I = cv2.cvtColor(image_rgb_crop, cv2.COLOR_RGB2HSV)
-        I = np.float32(I)
-
-        H_channel = I[:, :, 0]
-        U_channel = I[:, :, 1]
-
-        channel1Min = 90.0 * 360 / 179
-        channel1Max = 174 * 360 / 179
-        channel2Min = 15.0 / 255.0
+    def volume_estimation_all(self, image_or_path, sides=None):
+        # Decode the frame once and estimate every configured tube (or only `sides`) from it.
+        # Without height hints, equally sized strips are segmented as one batch (segment_strips).
+        # (area, meniscus height, whole strip scanned) of every tube are kept in self.tube_features
+        if sides is None:
+            sides = self.sides
+        volumes = {}
+        self.tube_features = {}
+        strips = self.read_checked_tube_strips(image_or_path, sides)
+        if (not self.image_is_blur) and (not self.image_is_red):
+            if any(self.height_hints.get(side) is not None for side in sides):
+                for side in sides:
+                    volumes[side] = self.volume_from_rect_image(strips[side], side)
+                    self.tube_features[side] = (self.area, self.height, self.full_scan)
+            else:
+                features = self.segment_strips(strips)
+                with self.stage("polynomial"):
+                    tube_volumes = self.volume_from_area_array([features[side][0] for side in sides])
+                for side, volume in zip(sides, tube_volumes):
+                    area, height, _ = features[side]
+                    volumes[side] = volume
+                    self.tube_features[side] = (area, height, True)
+
+            self.vol_left = volumes.get('LEFT', self.vol_left)
+            self.vol_right = volumes.get('RIGHT', self.vol_right)
+        else:
+            for side in sides:
+                volumes[side] = None
+
+        return volumes
+
+    def segment_strips(self, strips):
+        # stack_segmentation of every group of equally sized strips: {side: (area, height, meniscus area)}.
+        # The pyramid and sub-pixel meniscus searches segment them one by one.
+        if self.meniscus_search != "full" or self.subpixel_meniscus:
+            return {name: self.strip_segmentation(strip) for name, strip in strips.items()}
+        features = {}
+        with self.stage("stack_segmentation"):
+            for names in TubeLayout.shape_groups(strips).values():
+                areas, heights, meniscus_areas = self.stack_segmentation(np.stack([strips[name] for name in names]))
+                features.update(zip(names, zip(areas.tolist(), heights.tolist(), meniscus_areas.tolist())))
+        return features
+
+    def enable_tracking(self, **tracker_kwargs):
+        self.tracker = MeniscusTracker(**tracker_kwargs)
+        return self.tracker
+
+    def tracked_volume_estimation(self, image_or_path, timestamp=None, key=None):
+        # volume_estimation_all smoothed by self.tracker, every tube is tracked as (key, side).
+        # Returns {side: MeniscusTracker.update output}, or None per side when the quality check fails.
+        if self.tracker is None:
+            self.enable_tracking()
+
+        results = {}
+        strips = self.read_checked_tube_strips(image_or_path)
+        if self.image_is_blur or self.image_is_red:
+            return {side: None for side in self.sides}
+
+        self.height_hints = {side: self.tracker.height_hint((key, side)) for side in self.sides}
+        for side in self.sides:
+            volume = self.volume_from_rect_image(strips[side], side)
+            results[side] = self.tracker.update((key, side), volume, self.height, timestamp, self.full_scan)
+        self.height_hints = {}
+
+        return results
+
+    def read_image(self, image_or_path):
+        # Accept an already decoded frame or a path to an image file
+        if isinstance(image_or_path, np.ndarray):
+            return image_or_path
+        image = cv2.imread(image_or_path)
+        if image is None:
+            raise ValueError(f"Could not read image: {image_or_path}")
+        return image
+
+    def read_tube_strips(self, image_or_path, sides=None, verify_registration=True):
+        # Returns {side: strip}. Paths and encoded bytes only decode the tube regions
+        # (and the registration window).
+        if sides is None:
+            sides = self.sides
+        regions = [self.tube_roi(side) for side in sides]
+        if verify_registration:
+            regions += self.registration_regions()
+        with self.stage("imread"):
+            strips = self.roi_decoder.decode_regions(image_or_path, regions)
+        if len(strips) > len(sides):
+            frame = self.registered_frame(image_or_path, strips.pop())
+            if frame is not None:
+                return self.read_tube_strips(frame, sides, verify_registration=False)
+        return dict(zip(sides, strips))
+
+    def read_checked_tube_strips(self, image_or_path, sides=None, verify_registration=True):
+        # read_tube_strips that also runs the quality gate on the same decode when check_quality is set
+        if not self.check_quality:
+            return self.read_tube_strips(image_or_path, sides, verify_registration)
+
+        if sides is None:
+            sides = self.sides
+        regions = self.quality_gate.regions(sides)
+        if verify_registration:
+            regions += self.registration_regions()
+        with self.stage("imread"):
+            tube_image, panel_image, *window = self.roi_decoder.decode_regions(image_or_path, regions)
+        if window:
+            frame = self.registered_frame(image_or_path, window[0])
+            if frame is not None:
+                return self.read_checked_tube_strips(frame, sides, verify_registration=False)
+        with self.stage("quality_gate"):
+            self.quality = self.quality_gate.evaluate_regions(tube_image, panel_image)
+        self.image_is_blur = self.reject_on_quality and self.quality["IS_BLUR"]
+        self.image_is_red = self.reject_on_quality and self.quality["IS_RED"]
+
+        # the tube strips are views of the gate's tube region, the layout holds the ROIs before roi_offset
+        y_start, _, x_start, _ = self.quality_gate.tube_region(sides)
+        dy, dx = self.roi_offset
+        with self.stage("image_crop"):
+            strips = self.tube_layout().extract(tube_image, sides, origin=(y_start - dy, x_start - dx))
+        return strips
+
+    def registration_regions(self):
+        # verification window of the ROI registration, decoded together with the tubes
+        return [self.registration.window()] if self.registration is not None else []
+
+    def registered_frame(self, image_or_path, window_image):
+        # None while the tubes are within tolerance of their ROIs. Otherwise moves the ROIs back
+        # onto the tubes and returns the full frame for the caller to slice the strips from.
+        with self.stage("registration"):
+            if self.registration.verify(window_image):
+                return None
+            frame = image_or_path if isinstance(image_or_path, np.ndarray) else RoiDecoder.decode_full(image_or_path)
+            self.registration.register(frame)
+        return frame
+
+    def volume_from_rect_image(self, rect_image, side=None):
+        hint_height = self.height_hints.get(side)
+        if hint_height is None:
+            area, height, _ = self.strip_segmentation(rect_image)
+            self.full_scan = True
+        else:
+            area, height, _, self.full_scan = self.windowed_segmentation(rect_image, hint_height)
+        self.area = area
+        self.height = height
+
+        return self.volume_from_area(area)
+
+    def volume_from_area(self, area):
+        with self.stage("polynomial"):
+            volume_lut = self.get_volume_lut()
+            # fractional areas (sub-pixel meniscus heights) are interpolated between two entries
+            area = min(max(area, 0), len(volume_lut) - 1)
+            lower = int(area)
+            if lower == area:
+                return volume_lut[lower]
+            return volume_lut[lower] + (area - lower) * (volume_lut[lower + 1] - volume_lut[lower])
+
+    def volume_estimation_batch(self, images, sides=None):
+        # Returns an array of shape (len(images), len(sides)) with the volume of every tube
+        areas, _, _ = self.area_estimation_batch(images, sides)
+        return self.volume_from_area_array(areas)
+
+    def area_estimation_batch(self, images, sides=None):
+        # Segments a list of paths or decoded frames without touching self.side/self.vol_*.
+        # Frames are decoded batch_size at a time so that long time-lapses fit in memory.
+        if sides is None:
+            sides = self.sides
+
+        shape = (len(images), len(sides))
+        areas = np.zeros(shape, dtype=self.area_dtype())
+        heights = np.zeros(shape, dtype=self.area_dtype())
+        meniscus_areas = np.zeros(shape, dtype=np.int64)
+
+        for start in range(0, len(images), self.batch_size):
+            frames = [self.read_tube_strips(image, sides) for image in images[start:start + self.batch_size]]
+            stop = start + len(frames)
+            for k, side in enumerate(sides):
+                if self.meniscus_search == "full" and not self.subpixel_meniscus:
+                    strips = np.stack([frame[side] for frame in frames])
+                    areas[start:stop, k], heights[start:stop, k], meniscus_areas[start:stop, k] = self.stack_segmentation(strips)
+                    continue
+                for n, frame in enumerate(frames, start):
+                    areas[n, k], heights[n, k], meniscus_areas[n, k] = self.strip_segmentation(frame[side])
+
+        return areas, heights, meniscus_areas
+
+    def area_estimation_dataset(self, image_paths, sides=None):
+        # area_estimation_batch fanned out over the process pool, results in input order
+        if sides is None:
+            sides = self.sides
+        if len(image_paths) == 0:
+            empty = np.zeros((0, len(sides)), dtype=self.area_dtype())
+            return empty, empty.copy(), empty.astype(np.int64)
+
+        results = self.runner.map_chunks(functools.partial(self.area_estimation_batch, sides=sides), image_paths)
+        areas, heights, meniscus_areas = (np.concatenate(arrays) for arrays in zip(*results))
+
+        return areas, heights, meniscus_areas
+
+    def area_estimation_cached(self, image_paths, sides, cache_path):
+        # area_estimation_dataset that only segments images missing from the on-disk feature cache
+        cache = FeatureCache(cache_path)
+        params_hash = cache.params_hash(self.segmentation_params())
+        cache.touch(params_hash)
+        if self.feature_cache_max_age_days is not None:
+            pruned = cache.prune(params_hash, max_age=self.feature_cache_max_age_days * 86400)
+            if pruned:
+                print(f"Feature cache: dropped {pruned} entries of other parameters unused for {self.feature_cache_max_age_days} days")
+
+        shape = (len(image_paths), len(sides))
+        areas = np.zeros(shape, dtype=self.area_dtype())
+        heights = np.zeros(shape, dtype=self.area_dtype())
+        meniscus_areas = np.zeros(shape, dtype=np.int64)
+
+        content_hashes = [cache.content_hash(image_path) for image_path in image_paths]
+        missing = []
+        for n, content_hash in enumerate(content_hashes):
+            rows = [cache.get(content_hash, params_hash, side) for side in sides]
+            if any(row is None for row in rows):
+                missing.append(n)
+            else:
+                areas[n], heights[n], meniscus_areas[n] = zip(*rows)
+
+        if missing:
+            new_areas, new_heights, new_meniscus_areas = self.area_estimation_dataset([image_paths[n] for n in missing], sides)
+            areas[missing], heights[missing], meniscus_areas[missing] = new_areas, new_heights, new_meniscus_areas
+            cache.put_many((content_hashes[n], params_hash, side, areas[n, k], heights[n, k], meniscus_areas[n, k])
+                           for n in missing for k, side in enumerate(sides))
+
+        print(f"Feature cache: {len(image_paths) - len(missing)} images cached, {len(missing)} segmented")
+        cache.close()
+
+        return areas, heights, meniscus_areas
+
+    def area_dtype(self):
+        # areas and meniscus heights are fractional with subpixel_meniscus
+        return np.float64 if self.subpixel_meniscus else np.int64
+
+    def segmentation_params(self):
+        # everything that changes the segmentation of a tube strip, used to key the feature cache
+        return {"rois": {side: self.tube_roi(side) for side in self.sides},
+                "x": [self.x1, self.x2, self.x3, self.x4],
+                "y": [self.y1, self.y2, self.y3],
+                "hue": [self.hue_min, self.hue_max, self.saturation_min],
+                "meniscus_value": [self.meniscus_value_min, self.meniscus_value_max],
+                "meniscus_rows": [self.meniscus_search_rows, self.meniscus_band_rows],
+                "meniscus_search": [self.meniscus_search, list(self.pyramid_factor), self.pyramid_refine_rows, self.subpixel_meniscus]}
+
+    def stack_segmentation(self, strips):
+        # Vectorized equivalent of image_segmentation + count_white_pixels over a
+        # (N, rows, cols, 3) stack of tube strips. Returns areas, meniscus heights and meniscus areas.
+        n, rows, cols = strips.shape[:3]
+        # S and V do not depend on the channel order, so one conversion serves both searches
+        hsv = self.strip_hsv(strips)
+        E_channel = hsv[..., 2]
+
+        # meniscus row search (get_meniscus_height)
+        line_sum_U, line_sum_E = self.row_sums(hsv)
+        max_index_U = np.argmax(line_sum_U, axis=1)
+
+        row = np.arange(rows)
+        lower_bound = np.maximum(0, max_index_U - self.meniscus_search_rows)[:, None]
+        upper_bound = np.minimum(rows, max_index_U + self.meniscus_search_rows + 1)[:, None]
+        restricted_E = np.where((row >= lower_bound) & (row < upper_bound), line_sum_E, np.inf)
+        min_index_E = np.argmin(restricted_E, axis=1)
+
+        heights = np.round((min_index_E + max_index_U) / 2).astype(np.int64)
+
+        # meniscus refinement (get_area_of_interest + meniscus_segmentation), only the band rows
+        # above every height are gathered, rows above the top of the strip are masked out
+        band_rows = heights[:, None] + np.arange(-self.meniscus_band_rows, 0)
+        band = np.take_along_axis(E_channel, np.maximum(band_rows, 0)[:, :, None], axis=1)
+        mask = (band >= self.meniscus_value_min) & (band <= self.meniscus_value_max) & (band_rows >= 0)[:, :, None]
+        meniscus_areas = np.count_nonzero(mask, axis=(1, 2))
+
+        # every row below the meniscus height is fluid
+        areas = cols * (rows - heights) + meniscus_areas
+
+        return areas, heights, meniscus_areas
+
+    def volume_from_area_array(self, areas):
+        # Vectorized volume_from_area
+        volume_lut = self.get_volume_lut()
+        areas = np.asarray(areas)
+        if np.issubdtype(areas.dtype, np.integer):
+            return volume_lut[np.clip(areas, 0, len(volume_lut) - 1)]
+        areas = np.clip(areas, 0, len(volume_lut) - 1)
+        lower = areas.astype(np.int64)
+        upper = np.minimum(lower + 1, len(volume_lut) - 1)
+        return volume_lut[lower] + (areas - lower) * (volume_lut[upper] - volume_lut[lower])
+
+    def get_volume_lut(self):
+        # Rebuilt whenever the calibration coefficients or the tube geometry change
+        max_area = self.max_tube_area()
+        cone_coefficients, cylinder_coefficients = self.polynomial_coefficients()
+        params = (max_area, self.ref_area, tuple(cone_coefficients), tuple(cylinder_coefficients))
+        if self.volume_lut is None or self.volume_lut_params != params:
+            self.volume_lut = self.volume_polynomial(np.arange(max_area + 1, dtype=np.int64))
+            self.volume_lut_params = params
+        return self.volume_lut
+
+    def volume_polynomial(self, areas):
+        # calibration polynomials (cone below ref_area, cylinder above), negative volumes and
+        # the empty-tube constant (cone constant term) are mapped to 0
+        areas = np.asarray(areas, dtype=np.int64)
+        cone_coefficients, cylinder_coefficients = self.polynomial_coefficients()
+        cone = self.evaluate_polynomial(cone_coefficients, areas)
+        cylinder = self.evaluate_polynomial(cylinder_coefficients, areas)
+        volumes = np.where(areas < self.ref_area, cone, cylinder)
+        volumes[(volumes < 0) | (volumes == cone_coefficients[-1])] = 0
+
+        return volumes
+
+    def polynomial_coefficients(self):
+        # (cone, cylinder) coefficients, highest power first
+        cone_coefficients = self.cone_coefficients if self.cone_coefficients is not None else [self.g, self.h, self.i, self.j]
+        cylinder_coefficients = self.cylinder_coefficients if self.cylinder_coefficients is not None else [self.c, self.d, self.e, self.f]
+        return list(cone_coefficients), list(cylinder_coefficients)
 
-        mask = ((H_channel >= channel1Min) & (U_channel >= channel2Min) & (H_channel <= channel1Max))
-        binary_image = np.zeros_like(I[:, :, 0], dtype=np.float32)
-        binary_image[mask] = 1.0
-        binary_image = (binary_image * 255).astype(np.uint8)
+    @staticmethod
+    def evaluate_polynomial(coefficients, areas):
+        # sum of coefficient * area**power, highest power first. Powers are taken in float64 (exact
+        # for cubics of strip areas) so that high degrees do not overflow.
+        areas = np.asarray(areas, dtype=np.float64)
+        degree = len(coefficients) - 1
+        result = coefficients[0] * areas**degree
+        for power, coefficient in zip(range(degree - 1, -1, -1), coefficients[1:]):
+            result = result + coefficient * areas**power
+        return result
 
-        return binary_image
+    def HUE_filter(self, image_rgb_crop):
+        with self.stage("HUE_filter"):
+            if self.hue_filter_mode == "lut":
+                return self.HUE_filter_lut(image_rgb_crop)
+            return self.HUE_filter_float(image_rgb_crop)
+
+    def HUE_filter_float(self, image_rgb_crop):
+        # Float HSV thresholds: hue_min <= H <= hue_max (degrees) and S >= saturation_min.
+        # Converted as one row of pixels like strip_hsv, and cv2.inRange bounds are inclusive
+        # like the comparisons, so the mask is the same as converting the 2D crop.
+        crop = np.ascontiguousarray(image_rgb_crop)
+        I = cv2.cvtColor(np.float32(crop.reshape(1, -1, 3)) / 255.0, cv2.COLOR_RGB2HSV)
+
+        lower = (self.hue_min, self.saturation_min, -1.0)
+        upper = (self.hue_max, 2.0, 2.0)
+
+        return cv2.inRange(I, lower, upper).reshape(crop.shape[:2])
+
+    def HUE_filter_lut(self, image_rgb_crop):
+        # Integer-only variant: classify every pixel with a lookup table over quantized RGB.
+        # Approximate: a bin is classified by its centre, so pixels near the hue and saturation
+        # thresholds can land on the other side (about 95% pixel agreement with HUE_filter_float)
+        params = (self.hue_min, self.hue_max, self.saturation_min, self.hue_lut_bins)
+        if self.hue_lut is None or self.hue_lut_params != params:
+            self.hue_lut = self.build_hue_lut()
+            self.hue_lut_params = params
+
+        shift = 8 - int(math.log2(self.hue_lut_bins))
+        quantized = np.right_shift(image_rgb_crop, shift).astype(np.intp)
+        index = (quantized[:, :, 0] * self.hue_lut_bins + quantized[:, :, 1]) * self.hue_lut_bins + quantized[:, :, 2]
+
+        return self.hue_lut[index]
+
+    def build_hue_lut(self):
+        # Runs the float HUE_filter once on the centre of every RGB bin
+        bins = self.hue_lut_bins
+        step = 256 // bins
+        centres = np.arange(bins, dtype=np.uint8) * step + step // 2
+        c0, c1, c2 = np.meshgrid(centres, centres, centres, indexing='ij')
+        grid = np.stack([c0, c1, c2], axis=-1).reshape(bins * bins, bins, 3)
+
+        return self.HUE_filter_float(grid).reshape(-1)
+
+    def benchmark_hue_filter(self, dataset_path, repeats=10):
+        # Times every HUE_filter mode on the tube strips of a labelled dataset and
+        # measures how well the lookup table agrees with the float reference
+        image_files = [file for file in os.listdir(dataset_path) if file.endswith(('.jpg', '.jpeg', '.png'))]
+        strips = []
+        for image_file in image_files:
+            strips.extend(self.read_tube_strips(os.path.join(dataset_path, image_file)).values())
+
+        modes = {"float": self.HUE_filter_float, "lut": self.HUE_filter_lut}
+        references = [self.HUE_filter_float(strip) for strip in strips]
+        self.HUE_filter_lut(strips[0])  # build the table outside the timed loop
+
+        results = {}
+        for mode, hue_filter in modes.items():
+            start = time.perf_counter()
+            for _ in range(repeats):
+                masks = [hue_filter(strip) for strip in strips]
+            elapsed_ms = (time.perf_counter() - start) * 1000 / (repeats * len(strips))
+
+            agreement = np.mean([np.mean(mask == reference) for mask, reference in zip(masks, references)])
+            white_pixel_errors = [abs(self.count_white_pixels(mask) - self.count_white_pixels(reference)) for mask, reference in zip(masks, references)]
+            results[mode] = {"ms_per_strip": elapsed_ms,
+                             "pixel_agreement": agreement,
+                             "max_white_pixel_error": max(white_pixel_errors)}
+            print(f"{mode}: {elapsed_ms:.3f} ms/strip, pixel agreement {agreement * 100:.3f}%, max white pixel error {max(white_pixel_errors)}")
+
+        return results
     
     def get_meniscus_height(self, rect_image):
-        hsv_image = cv2.cvtColor(rect_image, cv2.COLOR_BGR2HSV)
-        U_channel = hsv_image[:, :, 1]
-        E_channel = hsv_image[:, :, 2]
+        with self.stage("get_meniscus_height"):
+            hsv_image = cv2.cvtColor(rect_image, cv2.COLOR_BGR2HSV)
+            U_channel = hsv_image[:, :, 1]
+            E_channel = hsv_image[:, :, 2]
 
-        line_sum_U = np.sum(U_channel, axis=1)
-        line_sum_E = np.sum(E_channel, axis=1)
-        max_index_U = np.argmax(line_sum_U)
+            line_sum_U = np.sum(U_channel, axis=1)
+            line_sum_E = np.sum(E_channel, axis=1)
 
-        lower_bound = max(0, max_index_U - 12)
-        upper_bound = min(len(line_sum_E), max_index_U + 13)
+            return self.meniscus_height_from_sums(line_sum_U, line_sum_E)
+
+    def meniscus_height_from_sums(self, line_sum_U, line_sum_E, offset=0):
+        # offset: strip row of the first sum, when the sums only cover a window of the strip
+        max_index_U = np.argmax(line_sum_U) + offset
+
+        lower_bound = max(offset, max_index_U - self.meniscus_search_rows)
+        upper_bound = min(len(line_sum_E) + offset, max_index_U + self.meniscus_search_rows + 1)
         
-        restricted_E = line_sum_E[lower_bound:upper_bound]
+        restricted_E = line_sum_E[lower_bound - offset:upper_bound - offset]
         
         min_index_E_restricted = np.argmin(restricted_E)
 
@@ -313,7 +966,34 @@ class VolumeEstimation:
             self.area_right.append(area)
             self.area_meniscus_right.append(area_meniscus)
 
-    def training_data(self, dataset_path):
+    def get_calibration(self):
+        cone_coefficients, cylinder_coefficients = self.polynomial_coefficients()
+        return {"version": self.calibration_version,
+                "ref_area": int(self.ref_area),
+                "cone_vol": self.cone_vol,
+                "cone": [float(c) for c in cone_coefficients],
+                "cylinder": [float(c) for c in cylinder_coefficients]}
+
+    def apply_calibration(self, calibration):
+        # calibration as stored by CalibrationRegistry, the volume table is rebuilt on next use.
+        # Cubics keep the g..j / c..f attributes, other degrees go to the coefficient lists.
+        cone_coefficients = [float(c) for c in calibration["cone"]]
+        cylinder_coefficients = [float(c) for c in calibration["cylinder"]]
+        if not cone_coefficients or not cylinder_coefficients:
+            raise ValueError("Calibration polynomials need at least one coefficient")
+        self.ref_area = calibration["ref_area"]
+        if len(cone_coefficients) == 4 and len(cylinder_coefficients) == 4:
+            self.g, self.h, self.i, self.j = cone_coefficients
+            self.c, self.d, self.e, self.f = cylinder_coefficients
+            self.cone_coefficients = None
+            self.cylinder_coefficients = None
+        else:
+            self.cone_coefficients = cone_coefficients
+            self.cylinder_coefficients = cylinder_coefficients
+        self.cone_vol = calibration.get("cone_vol", self.cone_vol)
+        self.calibration_version = calibration.get("version", self.calibration_version)
+
+    def training_data(self, dataset_path, cache_path=None, calibration_dir=None):
         volumes_gt_cone = [0]
         volumes_gt_cylinder = []
         areas_cone = [0]
@@ -321,18 +1001,16 @@ class VolumeEstimation:
 
         image_files = [file for file in os.listdir(dataset_path) if file.endswith(('.jpg', '.jpeg', '.png'))]
 
-        for image_file in image_files:
-            image_path = os.path.join(dataset_path, image_file)
-            image = cv2.imread(image_path)
-            for side in ['RIGHT', 'LEFT']:
-                #self.visualization(image)
-                volume_gt = self.get_gt_volume(image_file)
-                
-                rect_image = self.image_crop(image, side)
-                binary_image = self.image_segmentation(rect_image)
-
-                area = self.count_white_pixels(binary_image)
+        image_paths = [os.path.join(dataset_path, image_file) for image_file in image_files]
+        if cache_path is not None:
+            # only new or changed images are segmented, the curves are re-fitted from the cached areas
+            areas, _, _ = self.area_estimation_cached(image_paths, ['RIGHT', 'LEFT'], cache_path)
+        else:
+            areas, _, _ = self.area_estimation_dataset(image_paths, ['RIGHT', 'LEFT'])
 
+        for image_file, image_areas in zip(image_files, areas):
+            volume_gt = self.get_gt_volume(image_file)
+            for area in image_areas:
                 if volume_gt == self.cone_vol:
                     self.ref_area = area
 
@@ -375,6 +1053,8 @@ class VolumeEstimation:
         self.d = d
         self.e = e
         self.f = f
+        self.cone_coefficients = None
+        self.cylinder_coefficients = None
 
         print("self.ref_area =", self.ref_area, "\nself.g =", g, "\nself.h =", h, "\nself.i =", i, "\nself.j =", j, "\nself.c =", c, "\nself.d =", d, "\nself.e =", e, "\nself.f =", f)
         
@@ -394,23 +1074,51 @@ class VolumeEstimation:
         plt.savefig('polinomial.svg', dpi=300, format='svg', bbox_inches='tight')
         plt.show()
 
+        if calibration_dir is not None:
+            # versioned calibration file for the estimator (CALIBRATION-UPDATE reloads it)
+            calibration = self.get_calibration()
+            calibration["dataset"] = os.path.abspath(dataset_path)
+            self.calibration_version = CalibrationRegistry(calibration_dir).save(calibration)["version"]
+
         params = [g, h, i, j, c, d, e, f]
         return params
 
+    def fit_calibration(self, dataset_path, degrees=(1, 2, 3, 4, 5, 6), folds=5, breakpoints=None, cache_path=None, calibration_dir=None):
+        # training_data with the breakpoint (instead of cone_vol) and the polynomial degrees chosen
+        # by k-fold cross-validation, see CalibrationFitter. Returns the applied calibration.
+        image_files = self.runner.list_images(dataset_path)
+        image_paths = [os.path.join(dataset_path, image_file) for image_file in image_files]
+        if cache_path is not None:
+            areas, _, _ = self.area_estimation_cached(image_paths, ['RIGHT', 'LEFT'], cache_path)
+        else:
+            areas, _, _ = self.area_estimation_dataset(image_paths, ['RIGHT', 'LEFT'])
+
+        volumes_gt = np.repeat([self.get_gt_volume(image_file) for image_file in image_files], areas.shape[1])
+        fitter = CalibrationFitter(degrees=degrees, folds=folds, runner=self.runner)
+        calibration = fitter.fit(areas.ravel(), volumes_gt, breakpoints)
+        calibration["dataset"] = os.path.abspath(dataset_path)
+
+        if calibration_dir is not None:
+            calibration = CalibrationRegistry(calibration_dir).save(calibration)
+        self.apply_calibration(calibration)
+
+        return calibration
+
     def testing_data(self, dataset_path):
         volumes_gt = []
         volumes = []
         net = []
         image_files = [file for file in os.listdir(dataset_path) if file.endswith(('.jpg', '.jpeg', '.png'))]
 
-        for side in ["RIGHT", "LEFT"]:
-            self.side = side 
-            for image_file in image_files:
-                image_path = os.path.join(dataset_path, image_file)
+        image_paths = [os.path.join(dataset_path, image_file) for image_file in image_files]
+        sides = ["RIGHT", "LEFT"]
+        areas, _, _ = self.area_estimation_dataset(image_paths, sides)
+        estimates = self.volume_from_area_array(areas)
+
+        for k, side in enumerate(sides):
+            for image_file, volume in zip(image_files, estimates[:, k]):
                 volume_gt = self.get_gt_volume(image_file)
-                self.volume_estimation(image_path) 
-                volume = self.vol_right if side == 'RIGHT' else self.vol_left
-                
+
                 net.append(volume_gt - volume)
                 #print("GT:", volume_gt, "\nNet:",  volume_gt-volume, "\n")
                 volumes_gt.append(volume_gt)
@@ -543,7 +1251,7 @@ class VolumeEstimation:
         print("Regression:", polynomial)
 
     def get_area_of_interest(self, rect_image, height):
-        start_row = max(height - 20, 0)
+        start_row = max(height - self.meniscus_band_rows, 0)
         end_row = min(height, rect_image.shape[0])
         region_meniscus = np.zeros_like(rect_image)
 
@@ -555,17 +1263,15 @@ class VolumeEstimation:
         return region_meniscus
     
     def meniscus_segmentation(self, rgb_meniscus):
-        I = cv2.cvtColor(rgb_meniscus, cv2.COLOR_RGB2HSV)
+        with self.stage("meniscus_segmentation"):
+            I = cv2.cvtColor(rgb_meniscus, cv2.COLOR_RGB2HSV)
 
-        E_channel = I[:, :, 2]
+            E_channel = I[:, :, 2]
 
-        channel2Max = 130
-        channel2Min = 30
+            channel2Max = self.meniscus_value_max
+            channel2Min = self.meniscus_value_min
 
-        mask = ((E_channel <= channel2Max) & (E_channel >= channel2Min))
-        binary_meniscus = np.zeros_like(I[:, :, 0], dtype=np.float32)
-        binary_meniscus[mask] = 1.0
-        binary_meniscus = (binary_meniscus * 255).astype(np.uint8)
+            binary_meniscus = cv2.inRange(E_channel, channel2Min, channel2Max)
 
         return binary_meniscus
  
@@ -588,37 +1294,42 @@ class VolumeEstimation:
         #binary_image = cv2.cvtColor(binary_image, cv2.COLOR_RGB2GRAY)
         line_sum = np.sum(binary_image // 255, axis=1)
         line_sum =  line_sum.astype(np.int64)
-        original_data = pd.Series(line_sum)
-        filtered_data = original_data.copy()
+        rows = np.arange(len(line_sum))
 
         window_size = 5
-        rolling_mean = original_data.rolling(window=window_size).mean()
-        global_mean = np.mean(rolling_mean)
         threshold = 0.3
 
-        # For each window, if its mean is significantly lower than the global mean, set all elements in that window to zero
-        for i in range(window_size, len(original_data)):
-            if rolling_mean[i] < global_mean * threshold:
-                filtered_data[i-window_size:i] = 0
+        # rolling mean from a cumulative sum, the first window_size - 1 rows have no full window
+        cumsum = np.concatenate(([0], np.cumsum(line_sum)))
+        rolling_mean = np.zeros(len(line_sum))
+        rolling_mean[window_size - 1:] = (cumsum[window_size:] - cumsum[:-window_size]) / window_size
+        global_mean = np.sum(rolling_mean) / max(len(line_sum) - window_size + 1, 1)
+
+        # A window ending at i (i >= window_size) whose mean is significantly lower than the global mean
+        # zeroes rows i-window_size..i-1, so row r is zeroed when any of the windows ending at r+1..r+window_size is low
+        is_low = np.zeros(len(line_sum) + window_size, dtype=np.int64)
+        is_low[window_size:len(line_sum)] = rolling_mean[window_size:] < global_mean * threshold
+        low_cumsum = np.concatenate(([0], np.cumsum(is_low)))
+        suppressed = (low_cumsum[rows + window_size + 1] - low_cumsum[rows + 1]) > 0
+
+        # rows from y2 down keep their original values
+        final_data = np.where(suppressed & (rows < self.y2), 0, line_sum)
 
-        final_data = pd.concat([filtered_data[:self.y2], pd.Series(original_data[self.y2:])], ignore_index=True)
-        np_array = final_data.values
-        for i, value in enumerate(np_array):
-            # If the value at index i is 0, set the corresponding line in binary_image to black
-            if value == 0:
-                binary_image[i, :] = 0
+        # If the value at index i is 0, set the corresponding line in binary_image to black
+        binary_image[final_data == 0, :] = 0
 
         # return to 0-255 format
         binary_image = binary_image.astype(np.uint8)
 
         # Plot new data
-        #plt.plot(np_array, label=self.side)
+        #plt.plot(final_data, label=self.side)
         #plt.legend()
         #plt.show()
         return binary_image
     
     def count_white_pixels(self, binary_image):
-        white_pixel_count = np.sum(binary_image == 255)
+        with self.stage("count_white_pixels"):
+            white_pixel_count = np.sum(binary_image == 255)
         return white_pixel_count
     
     def histogram_h(self, binary_image):
@@ -636,25 +1347,64 @@ class VolumeEstimation:
 
         return 0
 
+    def apply_layout(self, layout):
+        # estimate the tubes of a TubeLayout instead of LEFT/RIGHT, the volume table follows the largest strip
+        self.layout = layout
+        self.sides = layout.names
+        if self.side not in self.sides:
+            self.side = self.sides[0]
+
+    def tube_layout(self):
+        # layout of the measured ROIs, without roi_offset
+        if self.layout is not None:
+            return self.layout
+        return TubeLayout([(side, self.base_tube_roi(side)) for side in self.sides])
+
+    def enable_registration(self, cache_path=None, reference=None, **registration_kwargs):
+        # reference: frame (or path) where the tubes are exactly on their ROIs, otherwise the
+        # templates come from cache_path. Returns None when there is neither.
+        registration = RoiRegistration(self, cache_path=cache_path, **registration_kwargs)
+        if reference is not None:
+            registration.set_reference(self.read_image(reference))
+        if registration.reference is None:
+            print("No ROI registration reference, the tube ROIs stay fixed")
+            return None
+        self.registration = registration
+        return registration
+
+    def max_tube_area(self):
+        # pixels of the largest tube strip, i.e. the largest possible segmented area
+        return max((y_end - y_start) * (x_end - x_start) for y_start, y_end, x_start, x_end in map(self.tube_roi, self.sides))
+
+    def tube_roi(self, side):
+        # (y_start, y_end, x_start, x_end) of the tube strip in the full frame
+        y_start, y_end, x_start, x_end = self.base_tube_roi(side)
+        dy, dx = self.roi_offset
+        return (y_start + dy, y_end + dy, x_start + dx, x_end + dx)
+
+    def base_tube_roi(self, side):
+        # tube strip as measured, before roi_offset
+        if self.layout is not None:
+            return self.layout.roi(side)
+        if side == "LEFT":
+            return (self.y1, self.y3, self.x1, self.x2)
+        elif side == "RIGHT":
+            return (self.y1, self.y3, self.x3, self.x4)
+        raise ValueError(f"Invalid side: {side}")
+
     def image_crop(self, image, side=None):
         if side is None:
             side = self.side
 
-        if side == "LEFT":
-            # LEFT tube coordinates
-            self.rectangle_tl = (self.y1, self.x1)  # Top-left point of the rectangle
-            self.rectangle_tr = (self.y1, self.x2)  # Top-right point of the rectangle
-            self.rectangle_bl = (self.y3, self.x1)  # Bottom-left point of the rectangle
-            self.rectangle_br = (self.y3, self.x2)  # Bottom-right point of the rectangle
-
-        elif side == "RIGHT":
-            # RIGHT tube coordinates
-            self.rectangle_tl = (self.y1, self.x3)  # Top-left point of the rectangle
-            self.rectangle_tr = (self.y1, self.x4)  # Top-right point of the rectangle
-            self.rectangle_bl = (self.y3, self.x3)  # Bottom-left point of the rectangle
-            self.rectangle_br = (self.y3, self.x4)  # Bottom-right point of the rectangle
+        # tube coordinates (LEFT, RIGHT or a tube of the layout)
+        y_start, y_end, x_start, x_end = self.tube_roi(side)
+        self.rectangle_tl = (y_start, x_start)  # Top-left point of the rectangle
+        self.rectangle_tr = (y_start, x_end)  # Top-right point of the rectangle
+        self.rectangle_bl = (y_end, x_start)  # Bottom-left point of the rectangle
+        self.rectangle_br = (y_end, x_end)  # Bottom-right point of the rectangle
 
-        rect_image = image[self.rectangle_tl[0]:self.rectangle_bl[0], self.rectangle_tl[1]:self.rectangle_tr[1]]
+        with self.stage("image_crop"):
+            rect_image = image[self.rectangle_tl[0]:self.rectangle_bl[0], self.rectangle_tl[1]:self.rectangle_tr[1]]
         #rect_image = cv2.resize(rect_image, (rect_image.shape[1], rect_image.shape[0]))
 
         return rect_image
@@ -706,13 +1456,9 @@ class VolumeEstimation:
         image_files.sort(key=lambda x: os.path.getmtime(os.path.join(dataset_path, x)))
 
 
-        for side in ["LEFT"]:
-            self.side = side
-            for image_file in image_files:
-                image_path = os.path.join(dataset_path, image_file)
-                self.volume_estimation(image_path)
-                volume = self.vol_right if side == 'RIGHT' else self.vol_left
-                volumes.append(volume)
+        image_paths = [os.path.join(dataset_path, image_file) for image_file in image_files]
+        areas, _, _ = self.area_estimation_dataset(image_paths, ["LEFT"])
+        volumes = list(self.volume_from_area_array(areas)[:, 0])
 
         # print(volumes)
         # for i in range(1, len(volumes)):
@@ -197,6 +197,12 @@ class Autoculture(Device):
                 # Volume estimation received
                 volume = float(value)
                 action = actionDecider(self.wells_dict[msg_index], 'volume', volume, message["IMAGE"])  # Pass the well and reservoir volume to the actionDecider
+
+                # Send the pump volume back to the estimator for its online calibration
+                observation = calibrationObservation(self.wells_dict[msg_index], message)
+                if observation is not None:
+                    self.mb.publish_message(topic="telemetry/" + self.experiment_uuid + "/log/estimator/CALIBRATION/REQUEST", message=observation)
+
                 if action is not None:
                     # Publish the Feedback action
                     self.mb.publish_message(topic=topic, message=action)
@@ -241,6 +247,10 @@ class Autoculture(Device):
                     self.mb.publish_message(topic=topic, message=action)
                     self.post_to_slack(text="FEEDBACK decided to " + str(action))
 
+    def reset_estimator_track(self, msg_index):
+        # The fluid action moved the tube level, the estimator restarts its smoothed volume from the next photo
+        self.mb.publish_message(topic="telemetry/" + self.experiment_uuid + "/log/estimator/TRACK/REQUEST", message=trackReset(self.wells_dict[msg_index]))
+
     def handle_dispense(self, topic, message):
         # DISPENSE: Dispense requested
         
@@ -263,6 +273,7 @@ class Autoculture(Device):
                 self.mb.publish_message(topic=topic,message={"DISPENSE":"OUT_OF_BOUNDS","FROM":self.device_name})
             else:
                 self.wells_dict[msg_index].dispense(vol)
+                self.reset_estimator_track(msg_index)
                 # TODO: If key not in wells_dict, render error message
                 print("Finished")
 
@@ -293,6 +304,7 @@ class Autoculture(Device):
                 self.mb.publish_message(topic=topic,message={"ASPIRATE":"OUT_OF_BOUNDS","FROM":self.device_name})
             else:
                 self.wells_dict[msg_index].aspirate(vol)
+                self.reset_estimator_track(msg_index)
 
         except (ValueError, IndexError) as e:
             print("Error occurred:", e)
@@ -337,6 +349,7 @@ class Autoculture(Device):
 
             # Complete the feed (replenishment) cycle
             self.wells_dict[msg_index].replenishmentCycle()
+            self.reset_estimator_track(msg_index)
 
             # Post to to Slack
             #self.post_to_slack(text=self.device_name + "'s " + self.wells_dict[msg_index].name + " FEED COMPLETE")
@@ -386,6 +399,7 @@ class Autoculture(Device):
                 self.mb.publish_message(topic=topic,message={"PULL":"OUT_OF_BOUNDS", "FROM":self.device_name})
             else:
                 self.wells_dict[msg_index].pull(num)
+                self.reset_estimator_track(msg_index)
 
             # Publish task COMPLETE
             #self.post_to_slack(text=self.device_name + str(num) +"PULL COMPLETE")
@@ -415,6 +429,7 @@ class Autoculture(Device):
                 self.mb.publish_message(topic=topic,message={"PLUNGE":"OUT_OF_BOUNDS", "FROM":self.device_name})
             else:
                 self.wells_dict[msg_index].plunge(num)
+                self.reset_estimator_track(msg_index)
 
             # Publish task COMPLETE
             self.post_to_slack(text=self.device_name + str(num) +"PLUNGE COMPLETE")
@@ -180,3 +180,45 @@ def actionDecider(well, type, value, im_path):
     
     # Return the requested action (MQTT)
     return action
+
+
+def calibrationObservation(well, message):
+    """
+    Pairs the segmented tube area of an estimate with the volume the pumps say is in the tube,
+    for the online recalibration of the estimator. Call after actionDecider, which keeps the
+    tube offset and accumulated volume up to date.
+
+        Args:
+            'well' (obj) : reference to Well class object (from autoculture.py)
+            'message' (dict) : FEEDBACK-REQUEST of the estimator
+
+    Returns None when the estimate has no area, is a cached reply ("CACHED": true, the image was
+    already observed) or the tube offset is not known yet (first cycle).
+    """
+    if message.get("AREA") is None or message.get("CACHED") or int(well.fluidic_state['iteration']) < 1:
+        return None
+
+    # Inverse of the adjustment in actionDecider: volume in the current tube
+    tube_vol = float(well.fluidic_state['in_volume']) + well.reservoir_offset - well.accumulated_vol
+    return {"COMMAND": "CALIBRATION-OBSERVATION",
+            "AREA": float(message["AREA"]),
+            "VOL": tube_vol,
+            "CHIP_ID": well.name,
+            "INDEX": well.estimate,
+            "CALIBRATION_VERSION": message.get("CALIBRATION_VERSION"),
+            "FROM": well.autoculture.device_name}
+
+
+def trackReset(well):
+    """
+    Tells the estimator that a fluid action changed the volume in the well's tube. With --tracking the
+    estimator smooths the volumes of each tube and would report the pre-action prediction for the next
+    photos; after this message the next photo restarts the track from its own volume.
+
+        Args:
+            'well' (obj) : reference to Well class object (from autoculture.py)
+    """
+    return {"COMMAND": "TRACK-RESET",
+            "CHIP_ID": well.name,
+            "INDEX": well.estimate,
+            "FROM": well.autoculture.device_name}